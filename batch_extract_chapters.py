@@ -0,0 +1,241 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+from create_chapter_payloads_from_pdf import get_files_in_directory, is_pdf, process_pdf
+
+# Configure logging to capture important information and errors
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def find_pdf_files(input_directory):
+    """
+    Lists the PDF files of a directory in a stable order.
+
+    Args:
+        input_directory (str): The directory to scan.
+
+    Returns:
+        list: The paths of the PDF files found in the directory.
+    """
+    return [os.path.join(input_directory, file) for file in sorted(get_files_in_directory(input_directory))
+            if is_pdf(file)]
+
+
+def extract_book(pdf_file_path, output_directory, options, connection):
+    """
+    Worker entry point: extracts the chapters of one book and sends a summary back to the parent process.
+    Any exception is reported through the connection; a hard crash leaves the connection empty and is
+    detected by the parent from the process exit code.
+
+    Args:
+        pdf_file_path (str): The path to the PDF file to be processed.
+        output_directory (str): Directory where the chapter JSON file is saved.
+        options (dict): Keyword arguments forwarded to process_pdf.
+        connection (Connection): Write end of the pipe to the parent process.
+    """
+    page_counts = []
+    try:
+        # process_pdf reports the page count from the page cache it reads (or from the build manifest of an
+        # unchanged book), so the PDF is hashed and opened once.
+        chapter_count = process_pdf(pdf_file_path, output_directory, raise_errors=True,
+                                    page_count_observer=page_counts.append, **options)
+        page_count = page_counts[-1] if page_counts else 0
+        if chapter_count:
+            connection.send({"status": "ok", "pages": page_count, "chapters": chapter_count})
+        else:
+            connection.send({"status": "error", "pages": page_count, "error": "No chapters were processed."})
+    except Exception as e:
+        connection.send({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+
+def start_worker(context, pdf_file_path, output_directory, options):
+    """
+    Starts one worker process for a book.
+
+    Returns:
+        dict: The process, the read end of its pipe and its start time.
+    """
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=extract_book, args=(pdf_file_path, output_directory, options, sender),
+                              daemon=True)
+    process.start()
+    sender.close()  # Only the child holds the write end, so a crash closes the pipe.
+    return {"pdf": pdf_file_path, "process": process, "connection": receiver, "started": time.monotonic()}
+
+
+def collect_worker(worker):
+    """
+    Builds the manifest entry of a finished worker.
+
+    Args:
+        worker (dict): A worker returned by start_worker whose process has exited.
+
+    Returns:
+        dict: The manifest entry of the book.
+    """
+    worker["process"].join()
+    result = None
+    try:
+        if worker["connection"].poll():
+            result = worker["connection"].recv()
+    except (EOFError, OSError):
+        result = None
+    finally:
+        worker["connection"].close()
+    if result is None:
+        result = {"status": "crashed", "error": f"Worker exited with code {worker['process'].exitcode}"}
+    return result
+
+
+def stop_worker(worker):
+    """
+    Kills a worker that exceeded its timeout.
+
+    Args:
+        worker (dict): A worker returned by start_worker.
+    """
+    worker["process"].terminate()
+    worker["process"].join(5)
+    if worker["process"].is_alive():
+        worker["process"].kill()
+        worker["process"].join()
+    worker["connection"].close()
+
+
+def write_manifest(manifest, output_directory):
+    """
+    Writes the batch manifest to a JSON file.
+
+    Args:
+        manifest (dict): The summary and the per-book entries of the batch.
+        output_directory (str): Directory where the manifest is saved.
+
+    Returns:
+        str: The path of the manifest file.
+    """
+    manifest_path = os.path.join(output_directory, "batch_manifest.json")
+    try:
+        with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False, indent=4)
+        logging.info(f"Batch manifest written to {manifest_path}")
+    except Exception as e:
+        logging.error(f"Error saving batch manifest: {e}")
+    return manifest_path
+
+
+def summarize_batch(books, elapsed_seconds):
+    """
+    Computes the counts and throughput of a batch.
+
+    Args:
+        books (list): The manifest entries of the batch.
+        elapsed_seconds (float): Wall time of the whole batch.
+
+    Returns:
+        dict: Success/failure counts, books per minute and pages per second.
+    """
+    succeeded = [book for book in books if book["status"] == "ok"]
+    pages = sum(book.get("pages", 0) for book in succeeded)
+    return {
+        "books": len(books),
+        "succeeded": len(succeeded),
+        "failed": len(books) - len(succeeded),
+        "pages": pages,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "books_per_minute": round(len(succeeded) * 60 / elapsed_seconds, 2) if elapsed_seconds else 0.0,
+        "pages_per_second": round(pages / elapsed_seconds, 2) if elapsed_seconds else 0.0
+    }
+
+
+def process_pdf_directory(input_directory, output_directory, workers=None, timeout=600,
+                          apply_exclude_fluff=True, apply_remove_empty_chapters=True, incremental=False):
+    """
+    Extracts the chapters of every PDF in a directory over a pool of worker processes.
+
+    Each book runs in its own process, so a PDF that crashes pypdf or hangs past the timeout only
+    fails that book. Results are recorded in batch_manifest.json in the output directory.
+
+    Args:
+        input_directory (str): Directory containing the PDF files, named '{ISBN}.pdf'.
+        output_directory (str): Directory where the chapter JSON files and the manifest are saved.
+        workers (int): Number of books processed in parallel. Defaults to the number of CPUs.
+        timeout (float): Seconds after which a book is abandoned.
+        apply_exclude_fluff (bool): Forwarded to process_pdf.
+        apply_remove_empty_chapters (bool): Forwarded to process_pdf.
+        incremental (bool): Forwarded to process_pdf: skip books whose PDF and options did not change.
+
+    Returns:
+        dict: The batch manifest.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_directory, exist_ok=True)
+    options = {"apply_exclude_fluff": apply_exclude_fluff, "apply_remove_empty_chapters": apply_remove_empty_chapters,
+               "incremental": incremental}
+    context = multiprocessing.get_context()
+
+    pending = deque(find_pdf_files(input_directory))
+    logging.info(f"Processing {len(pending)} PDF files from {input_directory} with {workers} workers")
+    running = []
+    books = []
+    batch_started = time.monotonic()
+
+    while pending or running:
+        while pending and len(running) < workers:
+            running.append(start_worker(context, pending.popleft(), output_directory, options))
+
+        next_deadline = min(worker["started"] for worker in running) + timeout
+        wait([worker["process"].sentinel for worker in running], max(0.0, next_deadline - time.monotonic()))
+
+        now = time.monotonic()
+        still_running = []
+        for worker in running:
+            if not worker["process"].is_alive():
+                entry = collect_worker(worker)
+            elif now - worker["started"] >= timeout:
+                stop_worker(worker)
+                entry = {"status": "timeout", "error": f"Exceeded {timeout} seconds"}
+            else:
+                still_running.append(worker)
+                continue
+
+            entry["pdf"] = worker["pdf"]
+            entry["seconds"] = round(now - worker["started"], 3)
+            if entry["status"] == "ok":
+                book_name = os.path.basename(worker["pdf"]).split('.')[0]
+                entry["output"] = os.path.join(output_directory, f"{book_name}_autosplits.json")
+                logging.info(f"Finished {worker['pdf']} in {entry['seconds']}s")
+            else:
+                logging.error(f"Failed {worker['pdf']} ({entry['status']}): {entry.get('error')}")
+            books.append(entry)
+        running = still_running
+
+    summary = summarize_batch(books, time.monotonic() - batch_started)
+    logging.info(f"Batch finished: {summary['succeeded']}/{summary['books']} books, "
+                 f"{summary['books_per_minute']} books/min, {summary['pages_per_second']} pages/s")
+    manifest = {"summary": summary, "books": sorted(books, key=lambda book: book["pdf"])}
+    write_manifest(manifest, output_directory)
+    return manifest
+
+
+if __name__ == "__main__":
+    # This script extracts the chapters of every '{ISBN}.pdf' file in a directory using all available cores.
+
+    # Define 'data_path' to point to the directory where your PDF files are stored.
+    # Chapter JSON files and 'batch_manifest.json' are written to 'output_path'.
+    data_path = 'data'
+    output_path = 'data'
+    workers = None  # Defaults to the number of CPUs.
+    timeout = 600  # Seconds allowed per book.
+    incremental = True  # Skip books whose PDF and options did not change since the last run.
+
+    try:
+        process_pdf_directory(data_path, output_path, workers, timeout, incremental=incremental)
+    except Exception as e:
+        logging.error(f"An error occurred while processing the PDF directory: {e}")
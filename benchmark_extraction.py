@@ -0,0 +1,532 @@
+import contextlib
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource  # Unix only; peak RSS is reported as None elsewhere
+except ImportError:
+    resource = None
+
+import pypdf
+from pypdf import PdfReader, PdfWriter
+
+from create_chapter_payloads_from_pdf import (EXCLUDE_KEYWORDS, array_to_json_file, bookmark_dict,
+                                              build_chapter_pipeline, iter_pdf_chapters, run_chapter_pipeline)
+from create_page_splits_from_pdf import read_pdf_and_extract_data, write_json_output
+from create_pages_folder_from_pdf import split_pdf_into_pages
+from page_cache import count_words, stream_page_cache
+from fluff_classifier import FluffClassifier, get_fluff_classifier
+from text_normalization import collapse_letter_spacing, normalize_text
+
+
+BENCHMARK_PDF = 'data/9354990517.pdf'
+BENCHMARK_RESULTS_FILE = os.path.join('data', '.benchmarks', 'results.jsonl')
+
+# Stages of the end-to-end suite, in pipeline order. Each one runs in a fresh process against a warm page
+# cache, except extract_text, which measures the cold pypdf pass that fills it.
+PIPELINE_STAGES = ('outline', 'extract_text', 'extract_text_bounded', 'chapters', 'fluff_filter', 'json_write',
+                   'page_splits', 'pages_folder')
+
+# RSS ceiling of the extract_text_bounded stage, the windowed extraction of page_cache.iter_windowed_pages.
+BENCHMARK_MEMORY_LIMIT_MB = 256
+
+
+def make_synthetic_chapters(chapter_count, words_per_chapter=3000):
+    """
+    Builds extracted chapters shaped like the output of iter_pdf_chapters: numbered chapters, fluff
+    sections and empty part headings whose name propagates to the following chapters.
+
+    Args:
+        chapter_count (int): Number of outline entries.
+        words_per_chapter (int): Approximate length of each non-empty chapter.
+
+    Returns:
+        list: The synthetic chapters.
+    """
+    body = ' '.join(f"word{index % 97}" for index in range(words_per_chapter))
+    fluff_names = ["Acknowledgements", "Notes", "Index", "About the Author", "Bibliography"]
+    chapters = []
+    for index in range(chapter_count):
+        if index % 25 == 0:
+            name, contents, type_of_name = f"PART {index // 25 + 1}", '', 'str'
+        elif index % 10 == 0:
+            name, contents, type_of_name = fluff_names[index % len(fluff_names)], body, 'str'
+        elif index % 7 == 0:
+            name, contents, type_of_name = f"Interlude {index}", "A short interlude.", "int"
+        else:
+            name, contents, type_of_name = f"Chapter {index}: The Long Road", body, "int"
+        chapters.append({
+            'name': name,
+            'contents': contents,
+            'word_count': count_words(contents),  # stored at extraction time, like make_chapter does
+            'type_of_name': type_of_name,
+            'sequence_index': index,
+            'part': ''
+        })
+    return chapters
+
+
+def legacy_chapter_pipeline(chapters, isbn):
+    """
+    The six list passes that get_chapter_payloads_from_pdf ran before the stage pipeline, kept as the
+    benchmark baseline (fluff filter with list membership tests, a deepcopy of the kept chapters and
+    word counts rebuilt from the contents of every chapter).
+    """
+    exclude_indices = []
+    for index, request_body in enumerate(chapters):
+        chapter_name = request_body["name"].lower()
+        if "chapter" in chapter_name:
+            print(f"CHAPTER DOES NOT NEED TO BE FILTERED: {request_body['name']}")
+            continue
+        if any(keyword in chapter_name for keyword in EXCLUDE_KEYWORDS):
+            exclude_indices.append(index)
+            print(f"\tEXCLUDED CHAPTER - KEYWORDS FLUFF: {request_body['name']}")
+            continue
+        if count_words(request_body["contents"]) < 1000:
+            exclude_indices.append(index)
+            print(f"\tEXCLUDED CHAPTER - TOO SMALL: {request_body['name']} ({count_words(request_body['contents'])} words)")
+        else:
+            print(f"CHAPTER DOES NOT NEED TO BE FILTERED: {request_body['name']}")
+    included = [request_body for index, request_body in enumerate(chapters) if index not in exclude_indices]
+    print("\nCHAPTERS INCLUDED:")
+    for request_body in included:
+        print(request_body["name"])
+    arr = copy.deepcopy([request_body for index, request_body in enumerate(chapters) if index not in exclude_indices])
+
+    propagate_name = None
+    for i, obj in enumerate(arr):
+        if obj["contents"] == "" and propagate_name is None:
+            propagate_name = obj["name"]
+        elif obj["contents"] == "" and propagate_name is not None:
+            propagate_name = obj["name"]
+        elif propagate_name is not None and obj["type_of_name"] == "int":
+            arr[i]["part"] = propagate_name
+    arr = [obj for obj in arr if obj["contents"] != ""]
+    for i, obj in enumerate(arr):
+        arr[i]["sequence_index"] = i
+    for i, obj in enumerate(arr):
+        arr[i]["isbn"] = isbn
+    for i, obj in enumerate(arr):
+        arr[i].pop("type_of_name", None)
+    return arr
+
+
+def stage_chapter_pipeline(chapters, isbn):
+    return list(run_chapter_pipeline(chapters, build_chapter_pipeline(isbn)))
+
+
+def measure(function, *args):
+    """
+    Runs a function with its prints silenced and measures it.
+
+    Returns:
+        tuple: The function result, the wall time in seconds and the peak traced allocation in bytes.
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = function(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def benchmark_chapter_pipeline(chapter_counts=(100, 1000, 10000)):
+    """
+    Compares the legacy list passes with the single-pass stage pipeline on synthetic books.
+
+    Args:
+        chapter_counts (tuple): Numbers of outline entries to benchmark.
+
+    Returns:
+        list: One result per chapter count, with times in seconds and peak allocations in bytes.
+    """
+    get_fluff_classifier()  # compiled once per process, outside the timings
+    results = []
+    for chapter_count in chapter_counts:
+        legacy_output, legacy_seconds, legacy_peak = measure(
+            legacy_chapter_pipeline, make_synthetic_chapters(chapter_count), 'isbn')
+        stage_output, stage_seconds, stage_peak = measure(
+            stage_chapter_pipeline, make_synthetic_chapters(chapter_count), 'isbn')
+        if legacy_output != stage_output:
+            raise AssertionError(f"Stage pipeline output differs from the legacy pipeline ({chapter_count} chapters)")
+        results.append({
+            'benchmark': 'chapter_pipeline',
+            'chapters': chapter_count,
+            'legacy_seconds': round(legacy_seconds, 4),
+            'stage_seconds': round(stage_seconds, 4),
+            'legacy_peak_bytes': legacy_peak,
+            'stage_peak_bytes': stage_peak
+        })
+    return results
+
+
+def line_by_line_normalize_text(text):
+    """
+    The straightforward version of the letter-spacing repair kept as the benchmark baseline: every line is split
+    and rebuilt in Python, whether or not the page contains letter-spaced text. It does not repair hyphenation.
+    """
+    lines = [collapse_letter_spacing(line) for line in text.replace('\r\n', '\n').split('\n')]
+    return '\n'.join(lines)
+
+
+def benchmark_text_normalization(pdf_path='data/9354990517.pdf', repeat=5):
+    """
+    Measures the normalization of a whole book's raw pypdf text. Text extraction is done once up front
+    and is not part of the timings.
+
+    Args:
+        pdf_path (str): The PDF whose pages are normalized.
+        repeat (int): Number of runs; the fastest is reported.
+
+    Returns:
+        dict: Times in seconds, throughput and word counts before and after normalization.
+    """
+    raw_pages = [page.extract_text() for page in PdfReader(pdf_path).pages]
+    character_count = sum(len(text) for text in raw_pages)
+
+    def fastest(function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = [function(text) for text in raw_pages]
+            timings.append(time.perf_counter() - started)
+        return result, min(timings)
+
+    normalized_pages, normalize_seconds = fastest(normalize_text)
+    _, line_by_line_seconds = fastest(line_by_line_normalize_text)
+    return {
+        'benchmark': 'text_normalization',
+        'pages': len(raw_pages),
+        'characters': character_count,
+        'line_by_line_seconds': round(line_by_line_seconds, 4),
+        'normalize_seconds': round(normalize_seconds, 4),
+        'megabytes_per_second': round(character_count / normalize_seconds / 1e6, 1),
+        'raw_words': sum(count_words(text) for text in raw_pages),
+        'normalized_words': sum(count_words(text) for text in normalized_pages),
+        'raw_characters': character_count,
+        'normalized_characters': sum(len(text) for text in normalized_pages)
+    }
+
+
+def benchmark_fluff_classifier(rule_counts=(30, 3000), title_count=200_000, legacy_title_count=2_000):
+    """
+    Compares the substring loop of the old fluff filter with FluffClassifier as the number of rules grows.
+    Synthetic rules are made-up words; titles mix real chapter names, fluff names and made-up words. Every title
+    is distinct, so the classifier is timed on its rules and not on hits of its name cache.
+
+    Args:
+        rule_counts (tuple): Numbers of exclude rules to benchmark.
+        title_count (int): Number of titles classified by FluffClassifier.
+        legacy_title_count (int): Number of titles run through the substring loop, which is much slower.
+
+    Returns:
+        list: One result per rule count, with the time per title in microseconds.
+    """
+    fluff_names = ["Acknowledgements", "Notes", "Index", "About the Author", "Bibliography", "Praise for the Book"]
+    titles = []
+    for index in range(title_count):
+        if index % 5 == 0:
+            titles.append(f"{fluff_names[index % len(fluff_names)]} {index}")
+        elif index % 5 == 1:
+            titles.append(f"Chapter {index}: The Long Road")
+        else:
+            titles.append(f"The Story of word{index % 997} and word{index % 991} Number {index}")
+
+    results = []
+    for rule_count in rule_counts:
+        keywords = [f"keyword{index}" for index in range(rule_count - len(EXCLUDE_KEYWORDS))] + EXCLUDE_KEYWORDS
+
+        started = time.perf_counter()
+        for title in titles[:legacy_title_count]:
+            chapter_name = title.lower()
+            if "chapter" not in chapter_name:
+                any(keyword in chapter_name for keyword in keywords)
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        classifier = FluffClassifier(exclude_keywords=keywords)
+        compile_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for title in titles:
+            classifier.classify_name(title)
+        classifier_seconds = time.perf_counter() - started
+
+        results.append({
+            'benchmark': 'fluff_classifier',
+            'rules': rule_count,
+            'titles': title_count,
+            'legacy_microseconds_per_title': round(legacy_seconds / legacy_title_count * 1e6, 2),
+            'classifier_microseconds_per_title': round(classifier_seconds / title_count * 1e6, 2),
+            'classifier_compile_seconds': round(compile_seconds, 4)
+        })
+    return results
+
+
+# Commands timed by benchmark_cli_startup: the CLI entry points, and the imports they avoid at startup.
+CLI_STARTUP_COMMANDS = {
+    'python': ['-c', 'pass'],
+    'cli --help': ['cli.py', '--help'],
+    'cli chapters --help': ['cli.py', 'chapters', '--help'],
+    'import create_chapter_payloads_from_pdf': ['-c', 'import create_chapter_payloads_from_pdf'],
+    'import pandas': ['-c', 'import pandas'],
+    'import selenium.webdriver': ['-c', 'import selenium.webdriver'],
+}
+
+
+def benchmark_cli_startup(repeat=5):
+    """
+    Measures the cold start of CLI commands and of heavy imports, each in a fresh interpreter (best of repeat runs).
+    Commands that fail, e.g. imports of packages that are not installed, are reported with seconds None.
+    """
+    results = []
+    for name, arguments in CLI_STARTUP_COMMANDS.items():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable] + arguments, capture_output=True)
+            elapsed = time.perf_counter() - started
+            if completed.returncode != 0:
+                best = None
+                break
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({'benchmark': 'cli_startup', 'command': name,
+                        'seconds': round(best, 4) if best is not None else None})
+    return results
+
+
+def make_synthetic_pdf(output_path, page_count, source_pdf=BENCHMARK_PDF, pages_per_chapter=20):
+    """
+    Writes a large PDF for benchmarks by repeating the pages of a source PDF, with an outline entry every
+    pages_per_chapter pages. Repeated pages share their content streams, so the file stays small while
+    every page still has to be extracted.
+
+    Args:
+        output_path (str): Where the PDF is written.
+        page_count (int): Number of pages of the synthetic PDF.
+        source_pdf (str): The PDF whose pages are repeated.
+        pages_per_chapter (int): Pages between two outline entries.
+
+    Returns:
+        str: output_path.
+    """
+    reader = PdfReader(source_pdf)
+    writer = PdfWriter()
+    for page_index in range(page_count):
+        writer.add_page(reader.pages[page_index % len(reader.pages)])
+    for chapter_index, page_index in enumerate(range(0, page_count, pages_per_chapter)):
+        writer.add_outline_item(f"Chapter {chapter_index + 1}", page_index)
+    with open(output_path, 'wb') as pdf_file:
+        writer.write(pdf_file)
+    return output_path
+
+
+def get_peak_rss_kb():
+    """
+    Returns the peak resident set size of the current process in kilobytes, or None where unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == 'Darwin' else peak  # bytes on macOS, kilobytes on Linux
+
+
+def get_children_cpu_seconds():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure_pipeline_stage(stage, pdf_path, work_directory, workers=1):
+    """
+    Runs one stage of the extraction pipelines and measures it. Meant to run in a fresh process, so the peak
+    RSS belongs to this stage (plus its setup, reported separately as setup_rss_kb).
+
+    Args:
+        stage (str): One of PIPELINE_STAGES.
+        pdf_path (str): The PDF to process.
+        work_directory (str): Directory for the page caches and outputs of the benchmark.
+        workers (int): Worker processes for text extraction and threads for pages_folder.
+
+    Returns:
+        dict: Wall and CPU seconds, peak RSS, and the pages per second of the timed part of the stage.
+    """
+    book_name = os.path.basename(pdf_path).split('.')[0]
+    cache_directory = os.path.join(work_directory, 'page_cache')
+    output_directory = os.path.join(work_directory, 'output')
+    os.makedirs(output_directory, exist_ok=True)
+    page_count = len(PdfReader(pdf_path).pages)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Setup: everything the stage consumes, built before the clock starts.
+        if stage in ('extract_text', 'extract_text_bounded'):
+            cold_cache_directory = os.path.join(work_directory, 'cold_page_cache')
+            shutil.rmtree(cold_cache_directory, ignore_errors=True)
+        elif stage in ('fluff_filter', 'json_write'):
+            chapters = list(iter_pdf_chapters(book_name, pdf_path, cache_directory))
+            if stage == 'json_write':
+                chapters = list(run_chapter_pipeline(chapters, build_chapter_pipeline(book_name)))
+        setup_rss_kb = get_peak_rss_kb()
+
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time() + get_children_cpu_seconds()
+        if stage == 'outline':
+            reader = PdfReader(pdf_path)
+            bookmark_dict(reader.outline, reader, use_labels=True)
+        elif stage == 'extract_text':
+            for _ in stream_page_cache(pdf_path, cold_cache_directory, workers)['pages']:
+                pass
+        elif stage == 'extract_text_bounded':
+            for _ in stream_page_cache(pdf_path, cold_cache_directory,
+                                       memory_limit_mb=BENCHMARK_MEMORY_LIMIT_MB)['pages']:
+                pass
+        elif stage == 'chapters':
+            for _ in iter_pdf_chapters(book_name, pdf_path, cache_directory):
+                pass
+        elif stage == 'fluff_filter':
+            for _ in run_chapter_pipeline(chapters, build_chapter_pipeline(book_name)):
+                pass
+        elif stage == 'json_write':
+            array_to_json_file(chapters, os.path.join(output_directory, f"{book_name}_autosplits.json"))
+        elif stage == 'page_splits':
+            write_json_output(read_pdf_and_extract_data(pdf_path, book_name, cache_directory), book_name,
+                              output_directory)
+        elif stage == 'pages_folder':
+            split_pdf_into_pages(pdf_path, output_directory, workers=max(workers, 1))
+        else:
+            raise ValueError(f"Unknown benchmark stage {stage!r}, expected one of {PIPELINE_STAGES}")
+        wall_seconds = time.perf_counter() - started_wall
+        cpu_seconds = time.process_time() + get_children_cpu_seconds() - started_cpu
+
+    return {
+        'benchmark': 'pipeline_stage',
+        'pdf': os.path.basename(pdf_path),
+        'stage': stage,
+        'pages': page_count,
+        'workers': workers,
+        'wall_seconds': round(wall_seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'pages_per_second': round(page_count / wall_seconds, 1) if wall_seconds else None,
+        'setup_rss_kb': setup_rss_kb,
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_pipeline_stages(pdf_paths=(BENCHMARK_PDF,), synthetic_page_counts=(1000,), stages=PIPELINE_STAGES,
+                              work_directory=os.path.join('data', '.benchmarks', 'work'), workers=1):
+    """
+    Runs every stage of the extraction pipelines (outline, text extraction, chapter splitting, fluff filtering,
+    JSON writing, page metadata and the page folder split) on the given PDFs and on synthetic PDFs of the
+    given sizes. Each stage runs in a freshly spawned process so its peak RSS is its own.
+
+    Args:
+        pdf_paths (tuple): The PDFs to benchmark.
+        synthetic_page_counts (tuple): Page counts of the synthetic PDFs generated with make_synthetic_pdf.
+        stages (tuple): The stages to run, in order.
+        work_directory (str): Directory for the synthetic PDFs, page caches and outputs (emptied first).
+        workers (int): Worker processes for text extraction and threads for pages_folder.
+
+    Returns:
+        list: One result per PDF and stage, tagged with the commit, Python and pypdf versions.
+    """
+    shutil.rmtree(work_directory, ignore_errors=True)
+    os.makedirs(work_directory)
+    pdf_paths = list(pdf_paths) + [
+        make_synthetic_pdf(os.path.join(work_directory, f"synthetic_{page_count}_pages.pdf"), page_count)
+        for page_count in synthetic_page_counts]
+    run_metadata = {
+        'commit': get_git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pypdf': pypdf.__version__
+    }
+
+    results = []
+    for pdf_path in pdf_paths:
+        pdf_work_directory = os.path.join(work_directory, os.path.basename(pdf_path).split('.')[0])
+        os.makedirs(pdf_work_directory, exist_ok=True)
+        # Warm the page cache shared by the stages that read from it.
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in stream_page_cache(pdf_path, os.path.join(pdf_work_directory, 'page_cache'), workers)['pages']:
+                pass
+        for stage in stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(measure_pipeline_stage, stage, pdf_path, pdf_work_directory, workers).result()
+            results.append({**run_metadata, **result})
+    return results
+
+
+def save_benchmark_results(results, results_file=BENCHMARK_RESULTS_FILE):
+    """
+    Appends results to a JSON Lines history, so runs of different commits can be compared.
+    """
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, 'a', encoding='utf-8') as history:
+        for result in results:
+            history.write(json.dumps(result) + '\n')
+
+
+def compare_benchmark_results(baseline_commit, commit, results_file=BENCHMARK_RESULTS_FILE):
+    """
+    Compares the pipeline stage timings of two commits from the results history, using the latest run of each.
+
+    Returns:
+        list: One entry per PDF and stage present in both runs, with the wall time and peak RSS ratios
+        (above 1 means the second commit is slower or uses more memory).
+    """
+    latest = {}
+    with open(results_file, 'r', encoding='utf-8') as history:
+        for line in history:
+            result = json.loads(line)
+            if result.get('benchmark') == 'pipeline_stage' and result.get('commit') in (baseline_commit, commit):
+                latest[(result['commit'], result['pdf'], result['stage'])] = result
+
+    comparison = []
+    for (result_commit, pdf, stage), baseline in latest.items():
+        current = latest.get((commit, pdf, stage))
+        if result_commit != baseline_commit or current is None:
+            continue
+        comparison.append({
+            'pdf': pdf,
+            'stage': stage,
+            'wall_seconds_ratio': round(current['wall_seconds'] / baseline['wall_seconds'], 3)
+            if baseline['wall_seconds'] else None,
+            'peak_rss_ratio': round(current['peak_rss_kb'] / baseline['peak_rss_kb'], 3)
+            if baseline['peak_rss_kb'] and current['peak_rss_kb'] else None
+        })
+    return comparison
+
+
+if __name__ == "__main__":
+    # This script benchmarks the extraction pipelines stage by stage on the bundled PDF and on a synthetic
+    # 1000-page PDF, then the chapter post-processing pipeline, the text normalization, the fluff classifier and the
+    # cold start of the CLI.
+    # Results are printed as JSON lines and appended to data/.benchmarks/results.jsonl with the current commit;
+    # compare two commits with compare_benchmark_results(baseline_commit, commit).
+    results = benchmark_pipeline_stages()
+    results += benchmark_chapter_pipeline()
+    results.append(benchmark_text_normalization())
+    results += benchmark_fluff_classifier()
+    results += benchmark_cli_startup()
+    for result in results:
+        print(json.dumps(result))
+    save_benchmark_results(results)
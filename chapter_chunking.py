@@ -0,0 +1,116 @@
+import re
+from bisect import bisect_right
+
+# A piece ends after a paragraph break, or after the end of a sentence (with its closing quotes or brackets)
+# followed by whitespace. The whitespace stays with the piece it follows.
+PIECE_BOUNDARY_PATTERN = re.compile(r'\n[ \t]*\n\s*|(?<=[.!?…])["»”’)\]]*\s+')
+# A word and its trailing whitespace, the unit used to split a sentence longer than the budget.
+WORD_SPAN_PATTERN = re.compile(r'\S+\s*')
+# Approximates the tokens of an LLM tokenizer: one per word and one per punctuation mark.
+TOKEN_ESTIMATE_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+CHUNK_UNITS = ('characters', 'tokens')
+
+
+def measure_span(text, start, end, unit='characters'):
+    """
+    Returns the size of text[start:end] in characters or estimated tokens, without slicing the text.
+    """
+    if unit == 'tokens':
+        return sum(1 for _ in TOKEN_ESTIMATE_PATTERN.finditer(text, start, end))
+    return end - start
+
+
+def iter_text_chunks(texts, chunk_size, chunk_overlap=0, unit='characters'):
+    """
+    Packs the sentences and paragraphs of a text given in parts (e.g. the page texts of a chapter) into chunks of
+    at most chunk_size characters or estimated tokens. Consecutive chunks share their last and first pieces, up to
+    chunk_overlap, including across the boundaries between parts. A sentence larger than the budget is cut between
+    words, and a single word larger than it becomes its own chunk.
+
+    The parts are never joined: only the pieces of the current chunk and the unfinished sentence are held, and each
+    chunk is yielded as soon as the next piece no longer fits. Each piece is measured once, so the cost is linear in
+    the length of the text. The chunks are the same as those of the joined text.
+
+    Args:
+        texts (iterable): The parts of the text, in order.
+        chunk_size (int): The budget of a chunk.
+        chunk_overlap (int): The budget of the text repeated at the start of the next chunk.
+        unit (str): 'characters' or 'tokens'.
+
+    Yields:
+        tuple: The start and end offsets of each chunk in the joined text, and its text.
+    """
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"Unknown chunk unit {unit!r}, expected one of {CHUNK_UNITS}")
+    buffer = ''  # the joined text from offset buffer_start on
+    buffer_start = 0
+    piece_start = 0  # where the next piece starts, i.e. the end of the last piece boundary found
+    window = []  # (start, end, size) of the pieces of the current chunk
+    window_size = 0
+
+    def add_piece(start, end, size):
+        nonlocal window, window_size
+        if window and window_size + size > chunk_size:
+            chunk_start, chunk_end = window[0][0], window[-1][1]
+            yield chunk_start, chunk_end, buffer[chunk_start - buffer_start:chunk_end - buffer_start]
+            # Carry over the trailing pieces that fit in the overlap and still leave room for the new piece.
+            kept = []
+            kept_size = 0
+            for previous in reversed(window):
+                if kept_size + previous[2] > chunk_overlap or kept_size + previous[2] + size > chunk_size:
+                    break
+                kept.append(previous)
+                kept_size += previous[2]
+            window = kept[::-1]
+            window_size = kept_size
+        window.append((start, end, size))
+        window_size += size
+
+    def add_span(start, end):
+        # A sentence or paragraph, cut between words when it is larger than the budget.
+        size = measure_span(buffer, start - buffer_start, end - buffer_start, unit)
+        if size <= chunk_size:
+            yield from add_piece(start, end, size)
+            return
+        for word in WORD_SPAN_PATTERN.finditer(buffer, start - buffer_start, end - buffer_start):
+            yield from add_piece(word.start() + buffer_start, word.end() + buffer_start,
+                                 measure_span(buffer, word.start(), word.end(), unit))
+
+    for text in texts:
+        if not text:
+            continue
+        buffer += text
+        for match in PIECE_BOUNDARY_PATTERN.finditer(buffer, piece_start - buffer_start):
+            if match.end() == len(buffer):
+                break  # the boundary may go on in the next part; it is searched again from piece_start
+            yield from add_span(piece_start, match.end() + buffer_start)
+            piece_start = match.end() + buffer_start
+        # Keep the pieces of the current chunk, the unfinished piece, and the character before it for the
+        # lookbehind of the boundary pattern.
+        keep_from = max(min(window[0][0] if window else piece_start, piece_start - 1), buffer_start)
+        buffer = buffer[keep_from - buffer_start:]
+        buffer_start = keep_from
+
+    for match in PIECE_BOUNDARY_PATTERN.finditer(buffer, piece_start - buffer_start):
+        yield from add_span(piece_start, match.end() + buffer_start)
+        piece_start = match.end() + buffer_start
+    if buffer_start + len(buffer) > piece_start:
+        yield from add_span(piece_start, buffer_start + len(buffer))
+    if window:
+        chunk_start, chunk_end = window[0][0], window[-1][1]
+        yield chunk_start, chunk_end, buffer[chunk_start - buffer_start:chunk_end - buffer_start]
+
+
+def find_page_number(page_starts, offset):
+    """
+    Returns the page number holding a character offset of a chapter.
+
+    Args:
+        page_starts (list): [offset, page_number] of the first character of each page of the chapter.
+        offset (int): A character offset in the chapter contents.
+    """
+    if not page_starts:
+        return None
+    index = bisect_right(page_starts, [offset, float('inf')]) - 1
+    return page_starts[max(index, 0)][1]
@@ -0,0 +1,133 @@
+import argparse
+import logging
+import os
+import sys
+
+# Single entry point for the extraction scripts:
+#   python cli.py chapters data/9354990517.pdf
+#   python cli.py pages data/9354990517.pdf --format jsonl
+#   python cli.py split data/9354990517.pdf --by-chapter
+#   python cli.py goodreads --years 2023 --months 1 2 3
+# Only argparse is imported at startup: each subcommand imports its modules (pypdf, selenium...) when it
+# runs, so `--help` and the PDF subcommands never load what they do not use.
+
+
+def get_isbn(path, isbn=None):
+    return isbn or os.path.basename(path).split('.')[0]
+
+
+def run_chapters(args):
+    os.makedirs(args.output_directory, exist_ok=True)
+    if args.path.lower().endswith('.epub'):
+        from create_chapter_payloads_from_epub import process_epub
+        saved = process_epub(args.path, args.output_directory, not args.keep_fluff, not args.keep_empty,
+                             raise_errors=True, output_format=args.format, chunk_size=args.chunk_size,
+                             chunk_overlap=args.chunk_overlap, chunk_unit=args.chunk_unit,
+                             fluff_languages=args.fluff_languages)
+    else:
+        from create_chapter_payloads_from_pdf import process_pdf
+        saved = process_pdf(args.path, args.output_directory, not args.keep_fluff, not args.keep_empty,
+                            raise_errors=True, workers=args.workers, output_format=args.format,
+                            incremental=args.incremental, chunk_size=args.chunk_size,
+                            chunk_overlap=args.chunk_overlap, chunk_unit=args.chunk_unit,
+                            fluff_languages=args.fluff_languages, memory_limit_mb=args.memory_limit_mb)
+    return 0 if saved else 1
+
+
+def run_pages(args):
+    from create_page_splits_from_pdf import (iter_pdf_page_data, write_json_output, write_jsonl_output,
+                                             write_page_store_output)
+    isbn = get_isbn(args.path, args.isbn)
+    pages = iter_pdf_page_data(args.path, isbn, workers=args.workers, include_image_details=args.image_details)
+    # The writers log their errors and return None instead of raising them.
+    if args.format == 'store':
+        written = write_page_store_output(pages, isbn, args.output_directory)
+    elif args.format == 'jsonl':
+        written = write_jsonl_output(pages, isbn, args.output_directory)
+    else:
+        written = write_json_output(list(pages), isbn, args.output_directory)
+    return 0 if written is not None else 1
+
+
+def run_split(args):
+    from create_pages_folder_from_pdf import create_individual_pdf_pages, split_pdf_into_chapters
+    if args.by_chapter:
+        written = split_pdf_into_chapters(args.path, args.output_directory, args.workers)
+    else:
+        written = create_individual_pdf_pages(args.path, args.output_directory, args.workers)
+    return 0 if written is not None else 1
+
+
+def run_goodreads(args):
+    from extract_goodreads_popular_books_authors import get_goodreads_books_concurrently
+    summary = get_goodreads_books_concurrently(args.years, args.months, args.workers, args.data_path,
+                                               args.base_url, resume=not args.no_resume)
+    return 1 if summary['failed'] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Extract chapters, page metadata and page files '
+                                                                'from books, and scrape Goodreads lists.')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    chapters = subcommands.add_parser('chapters', help='Extract the chapters of a PDF or EPUB to JSON.')
+    chapters.add_argument('path', help='The PDF or EPUB file.')
+    chapters.add_argument('-o', '--output-directory', default='data')
+    chapters.add_argument('--format', choices=['json', 'jsonl', 'store'], default='json')
+    chapters.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                          help='Processes extracting page text in parallel (PDF only).')
+    chapters.add_argument('--keep-fluff', action='store_true', help='Do not filter front/back matter chapters.')
+    chapters.add_argument('--keep-empty', action='store_true', help='Keep chapters with empty contents.')
+    chapters.add_argument('--fluff-languages', nargs='+',
+                          help='Fluff rule sets to use, e.g. fr, or all; detected from the text by default.')
+    chapters.add_argument('--incremental', action='store_true',
+                          help='Skip the book when neither the PDF nor the options changed (PDF only).')
+    chapters.add_argument('--memory-limit-mb', type=float,
+                          help='Extract in page windows under this RSS ceiling and spill long chapters to disk '
+                               '(PDF only, serial).')
+    chapters.add_argument('--chunk-size', type=int, help='Save chunks of at most this size instead of chapters.')
+    chapters.add_argument('--chunk-overlap', type=int, default=0)
+    chapters.add_argument('--chunk-unit', choices=['characters', 'tokens'], default='characters')
+    chapters.set_defaults(handler=run_chapters)
+
+    pages = subcommands.add_parser('pages', help='Extract the metadata of every page of a PDF.')
+    pages.add_argument('path', help='The PDF file.')
+    pages.add_argument('--isbn', help='Defaults to the file name without extension.')
+    pages.add_argument('-o', '--output-directory', default='data')
+    pages.add_argument('--format', choices=['json', 'jsonl', 'store'], default='json')
+    pages.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    pages.add_argument('--image-details', action='store_true', help='Report image counts, dimensions and sizes.')
+    pages.set_defaults(handler=run_pages)
+
+    split = subcommands.add_parser('split', help='Split a PDF into one file per page or per chapter.')
+    split.add_argument('path', help='The PDF file.')
+    split.add_argument('-o', '--output-directory', default='data')
+    split.add_argument('--by-chapter', action='store_true')
+    split.add_argument('--workers', type=int, default=4, help='Threads writing the output files.')
+    split.set_defaults(handler=run_split)
+
+    goodreads = subcommands.add_parser('goodreads', help='Scrape the Goodreads popular books of each month to CSV.')
+    goodreads.add_argument('--years', type=int, nargs='+', required=True)
+    goodreads.add_argument('--months', type=int, nargs='+', default=list(range(1, 13)))
+    goodreads.add_argument('--workers', type=int, default=4)
+    goodreads.add_argument('--data-path', default='data')
+    goodreads.add_argument('--base-url', default='https://www.goodreads.com')
+    goodreads.add_argument('--no-resume', action='store_true', help='Scrape months whose CSV already exists.')
+    goodreads.set_defaults(handler=run_goodreads)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Configured before the subcommand modules are imported, so their own basicConfig calls do nothing.
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        return args.handler(args)
+    except Exception as e:
+        logging.error(f"{args.command} failed: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
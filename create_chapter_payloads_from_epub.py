@@ -0,0 +1,393 @@
+from html.parser import HTMLParser
+from posixpath import dirname, join, normpath
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from jsonl_output import write_jsonl_file
+from create_chapter_payloads_from_pdf import (analyze_raw_extraction, array_to_json_file, build_chapter_pipeline,
+                                              get_word_count, run_chapter_pipeline)
+from heading_scanner import detect_heading
+from page_cache import count_words
+from page_store import write_chapter_store
+import zipfile
+import re
+import pprint
+import os
+import logging
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+
+CONTAINER_PATH = 'META-INF/container.xml'
+XML_NAMESPACES = {
+    'container': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'ncx': 'http://www.daisy.org/z3986/2005/ncx/'
+}
+# Elements whose end starts a new line of text, and elements whose text is never part of the book.
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'section',
+              'article', 'dt', 'dd', 'hr', 'table', 'figcaption'}
+SKIPPED_TAGS = {'head', 'script', 'style', 'title', 'svg'}
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+class XhtmlTextParser(HTMLParser):
+    """
+    Collects the text of an XHTML content document, one line per block element, and records the
+    offset in the text of every element id so TOC entries pointing at a fragment can be located.
+    html.parser is used instead of an XML parser because content documents routinely contain HTML
+    entities such as &nbsp; that are not defined in XML.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.length = 0
+        self.skip_depth = 0
+        self.id_offsets = {}
+
+    def append(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+
+    def end_line(self):
+        if not self.parts or self.parts[-1].endswith('\n'):
+            return
+        if self.parts[-1].endswith(' '):
+            self.parts[-1] = self.parts[-1][:-1]
+            self.length -= 1
+        self.append('\n')
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        if tag in BLOCK_TAGS:
+            self.end_line()
+        for name, value in attrs:
+            if name in ('id', 'name') and value and value not in self.id_offsets:
+                self.id_offsets[value] = self.length
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in SKIPPED_TAGS:
+            self.skip_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.end_line()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        # Whitespace runs collapse to one space, as in a browser; spaces at the start of a line are dropped.
+        data = WHITESPACE_PATTERN.sub(' ', data)
+        if data.startswith(' ') and (not self.parts or self.parts[-1].endswith((' ', '\n'))):
+            data = data[1:]
+        if data:
+            self.append(data)
+
+    def get_text(self):
+        return ''.join(self.parts)
+
+
+class NavTocParser(HTMLParser):
+    """
+    Reads the entries of an EPUB 3 navigation document's toc nav: the href and label of every link,
+    with its depth given by the nesting of <ol> lists.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self.in_toc = False
+        self.nav_depth = 0
+        self.list_depth = 0
+        self.current_link = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'nav':
+            self.nav_depth += 1
+            if 'toc' in (attrs.get('epub:type') or '').split():
+                self.in_toc = True
+        elif self.in_toc and tag == 'ol':
+            self.list_depth += 1
+        elif self.in_toc and tag == 'a' and attrs.get('href'):
+            self.current_link = [attrs['href'], []]
+
+    def handle_endtag(self, tag):
+        if tag == 'nav':
+            self.nav_depth -= 1
+            if self.in_toc and self.nav_depth == 0:
+                self.in_toc = False
+        elif self.in_toc and tag == 'ol':
+            self.list_depth -= 1
+        elif tag == 'a' and self.current_link is not None:
+            href, label = self.current_link
+            self.entries.append((href, ' '.join(''.join(label).split()), max(self.list_depth - 1, 0)))
+            self.current_link = None
+
+    def handle_data(self, data):
+        if self.current_link is not None:
+            self.current_link[1].append(data)
+
+
+def resolve_href(base_path, href):
+    """
+    Resolves an href relative to the document that contains it into a path inside the archive and a fragment.
+    """
+    path, _, fragment = unquote(href).partition('#')
+    return normpath(join(dirname(base_path), path)) if path else base_path, fragment
+
+
+def read_package(epub):
+    """
+    Reads the package document of an EPUB: its manifest, its spine and the location of its table of contents.
+
+    Args:
+        epub (ZipFile): The open EPUB archive.
+
+    Returns:
+        dict: 'path' of the package document, 'spine' as a list of content document paths in reading order,
+        'nav' the path of the EPUB 3 navigation document and 'ncx' the path of the EPUB 2 NCX (either may be None).
+    """
+    container = ElementTree.fromstring(epub.read(CONTAINER_PATH))
+    package_path = container.find('.//container:rootfile', XML_NAMESPACES).get('full-path')
+    package = ElementTree.fromstring(epub.read(package_path))
+
+    manifest = {}
+    nav_path = None
+    for item in package.iterfind('opf:manifest/opf:item', XML_NAMESPACES):
+        item_path, _ = resolve_href(package_path, item.get('href'))
+        manifest[item.get('id')] = item_path
+        if 'nav' in (item.get('properties') or '').split():
+            nav_path = item_path
+
+    spine = package.find('opf:spine', XML_NAMESPACES)
+    return {
+        'path': package_path,
+        'spine': [manifest[itemref.get('idref')] for itemref in spine.iterfind('opf:itemref', XML_NAMESPACES)
+                  if itemref.get('idref') in manifest and itemref.get('linear', 'yes') != 'no'],
+        'nav': nav_path,
+        'ncx': manifest.get(spine.get('toc'))
+    }
+
+
+def iter_ncx_nav_points(parent, depth=0):
+    for nav_point in parent.iterfind('ncx:navPoint', XML_NAMESPACES):
+        label = nav_point.findtext('ncx:navLabel/ncx:text', '', XML_NAMESPACES)
+        content = nav_point.find('ncx:content', XML_NAMESPACES)
+        if content is not None and content.get('src'):
+            yield content.get('src'), ' '.join(label.split()), depth
+        yield from iter_ncx_nav_points(nav_point, depth + 1)
+
+
+def read_toc(epub, package):
+    """
+    Reads the table of contents of an EPUB from its navigation document, or from its NCX for EPUB 2 books.
+
+    Args:
+        epub (ZipFile): The open EPUB archive.
+        package (dict): The package description returned by read_package.
+
+    Returns:
+        list: [content document path, fragment, title, depth] entries in reading order.
+    """
+    if package['nav']:
+        parser = NavTocParser()
+        parser.feed(epub.read(package['nav']).decode('utf-8'))
+        parser.close()
+        base_path, raw_entries = package['nav'], parser.entries
+    elif package['ncx']:
+        nav_map = ElementTree.fromstring(epub.read(package['ncx'])).find('ncx:navMap', XML_NAMESPACES)
+        base_path, raw_entries = package['ncx'], list(iter_ncx_nav_points(nav_map))
+    else:
+        return []
+    return [[*resolve_href(base_path, href), title, depth] for href, title, depth in raw_entries]
+
+
+def read_content_document(epub, document_path):
+    """
+    Streams a content document out of the archive into XhtmlTextParser, without holding the raw XHTML.
+
+    Returns:
+        tuple: The text of the document and the offsets of its element ids.
+    """
+    parser = XhtmlTextParser()
+    with epub.open(document_path) as document:
+        pending = b''
+        for chunk in iter(lambda: document.read(READ_CHUNK_SIZE), b''):
+            chunk = pending + chunk
+            try:
+                text, pending = chunk.decode('utf-8'), b''
+            except UnicodeDecodeError as e:
+                # A multi-byte character split across two reads is completed by the next chunk.
+                text, pending = chunk[:e.start].decode('utf-8'), chunk[e.start:]
+            parser.feed(text)
+        parser.feed(pending.decode('utf-8', errors='replace'))
+    parser.close()
+    return parser.get_text(), parser.id_offsets
+
+
+def make_epub_chapter(name, parts, depth, sequence_index):
+    contents = ''.join(parts).strip()
+    return {
+        'name': name,
+        'contents': contents,
+        'word_count': count_words(contents),
+        'type_of_name': 'str',
+        'outline_depth': depth,
+        'sequence_index': sequence_index,
+        'part': ''
+    }
+
+
+def iter_epub_chapters(epub_file_path):
+    """
+    Extracts the chapters of an EPUB, one per table of contents entry. Spine documents are read one at a
+    time in reading order, and each chapter is yielded as soon as the next entry starts, so only the
+    current chapter is held in memory. Entries pointing at a fragment split their document at that element.
+    Text before the first entry is front matter and is skipped, like the first outline split of a PDF.
+    A book without a table of contents gets one chapter per spine document, named by detect_heading.
+
+    Args:
+        epub_file_path (str): The path to the EPUB file.
+
+    Yields:
+        dict: Chapters with the schema of iter_pdf_chapters.
+    """
+    with zipfile.ZipFile(epub_file_path) as epub:
+        package = read_package(epub)
+        toc = read_toc(epub, package)
+        if not toc:
+            logging.info(f"No table of contents in {epub_file_path}, using one chapter per spine document")
+            toc = [[document_path, '', None, 0] for document_path in package['spine']]
+        entries_by_document = {}
+        for document_path, fragment, title, depth in toc:
+            entries_by_document.setdefault(document_path, []).append((fragment, title, depth))
+
+        sequence_index = 0
+        name, depth, parts = None, 0, None
+        for document_path in package['spine']:
+            entries = entries_by_document.pop(document_path, [])
+            if not entries and parts is None:
+                continue  # front matter is not even parsed
+            text, id_offsets = read_content_document(epub, document_path)
+            starts = sorted((id_offsets.get(fragment, 0) if fragment else 0, position, title, entry_depth)
+                            for position, (fragment, title, entry_depth) in enumerate(entries))
+            offset = 0
+            for start, _, title, entry_depth in starts:
+                if parts is not None:
+                    parts.append(text[offset:start])
+                    yield make_epub_chapter(name, parts, depth, sequence_index)
+                    sequence_index += 1
+                name = title if title is not None else detect_heading(text[start:]) or ''
+                depth, parts = entry_depth, []
+                offset = start
+            parts.append(text[offset:] + '\n')
+
+        if parts is not None:
+            yield make_epub_chapter(name, parts, depth, sequence_index)
+        if entries_by_document:
+            logging.warning(f"Ignored TOC entries outside the spine of {epub_file_path}: {sorted(entries_by_document)}")
+
+
+def process_epub(epub_file_path, output_directory=None, apply_exclude_fluff=True, apply_remove_empty_chapters=True,
+                 raise_errors=False, output_format='json', exclude_keywords=None, chunk_size=None, chunk_overlap=0,
+                 chunk_unit='characters', fluff_languages=None):
+    """
+        Extracts the chapters of an EPUB from its table of contents and saves them like process_pdf does,
+        to {book_name}_autosplits.json (or .jsonl), or to the page store in {output_directory}/page_store with
+        output_format='store', after the same transformations.
+        No conversion to PDF and no page cache are involved: the text comes straight from the XHTML.
+
+        Returns the number of saved chapters (0 if none were processed). Errors are logged and
+        None is returned, unless raise_errors is set, in which case they are re-raised.
+        With chunk_size set, chunks are saved to {book_name}_chunks.json (or .jsonl) instead, as in process_pdf.
+        fluff_languages declares the fluff rule sets of the book, e.g. ['fr'], which is otherwise detected from
+        its first chapters.
+        """
+    try:
+        book_name = os.path.basename(epub_file_path).split('.')[0]
+        logging.info(f"Processing EPUB: {epub_file_path}")
+        output_name = "chunks" if chunk_size else "autosplits"
+        output_file_path = os.path.join(output_directory, f"{book_name}_{output_name}.{output_format}")
+        store_directory = os.path.join(output_directory, 'page_store')
+        output_location = store_directory if output_format == 'store' else output_file_path
+
+        chapter_summaries = []
+        stages = build_chapter_pipeline(
+            book_name, apply_exclude_fluff, apply_remove_empty_chapters,
+            filtered_chapter_observer=lambda chapter: chapter_summaries.append(
+                {'name': chapter['name'], 'word_count': get_word_count(chapter)}),
+            exclude_keywords=exclude_keywords, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            chunk_unit=chunk_unit, fluff_languages=fluff_languages)
+        chapters = run_chapter_pipeline(iter_epub_chapters(epub_file_path), stages)
+
+        if output_format == 'store':
+            saved_chapter_count = write_chapter_store(chapters, book_name, store_directory)
+        elif output_format == 'jsonl':
+            saved_chapter_count = write_jsonl_file(chapters, output_file_path)
+            if not saved_chapter_count:
+                os.remove(output_file_path)
+        else:
+            chapters = list(chapters)
+            saved_chapter_count = len(chapters)
+            if chapters:
+                array_to_json_file(chapters, output_file_path)
+
+        results = analyze_raw_extraction(chapter_summaries,
+                                         filtered_data=chapter_summaries if apply_exclude_fluff else None)
+        pprint.pprint(results)
+
+        if saved_chapter_count:
+            logging.info(f"Data saved to {output_location}")
+        else:
+            logging.error("No chapters were processed.")
+        return saved_chapter_count
+    except Exception as e:
+        logging.error(f"Error processing {epub_file_path}: {e}")
+        if raise_errors:
+            raise
+        return None
+
+
+def get_chapter_payloads_from_epub(isbn, epub_file_path, chunk_size=None, chunk_overlap=0, chunk_unit='characters'):
+    """
+    Extract and process chapters from the EPUB specified by its ISBN and file path,
+    returning the chapters data after the same transformations as get_chapter_payloads_from_pdf.
+    """
+    try:
+        logging.info(f"Extracting chapters from EPUB: {epub_file_path} with ISBN: {isbn}")
+        chapters = iter_epub_chapters(epub_file_path)
+        stages = build_chapter_pipeline(isbn, chunk_size=chunk_size, chunk_overlap=chunk_overlap, chunk_unit=chunk_unit)
+        processed_chapters = list(run_chapter_pipeline(chapters, stages))
+
+        logging.info(f"Processed {len(processed_chapters)} chapters.")
+        return processed_chapters
+    except Exception as e:
+        logging.error(f"Failed processing EPUB {epub_file_path} with ISBN {isbn}: {e}")
+        raise e
+
+
+if __name__ == "__main__":
+    # This script extracts the chapters of an EPUB file from its table of contents and saves them to a JSON file,
+    # without converting the EPUB to a PDF first.
+
+    # Specify the path of the EPUB file here. The output is named after the file name, up to its first '.'.
+    data_path = 'data'
+    epub_path = f'{data_path}/Le Petit Prince - Antoine de Saint-Exupéry - EPUB.epub'
+
+    apply_exclude_fluff = True
+    apply_remove_empty_chapters = True
+    output_format = 'json'  # Use 'jsonl' to write one chapter per line, or 'store' to add them to data/page_store.
+
+    logging.info("Starting EPUB processing")
+
+    try:
+        process_epub(epub_path, data_path, apply_exclude_fluff, apply_remove_empty_chapters,
+                     output_format=output_format)
+        logging.info("EPUB processing completed successfully")
+    except Exception as e:
+        logging.error(f"An error occurred while processing the EPUB: {e}")
@@ -1,14 +1,31 @@
-import copy
-import re
+from functools import partial
+from itertools import chain, islice
 from typing import Dict, Union
 from pypdf import PdfReader
+from jsonl_output import write_jsonl_file
+from incremental_build import (compute_stage_key, find_stale_stages, fingerprint_file, get_build_manifest_path,
+                               read_build_manifest, write_build_manifest)
+from chapter_chunking import find_page_number, iter_text_chunks
+from fluff_classifier import (DEFAULT_LANGUAGE, FLUFF_RULE_SETS, LANGUAGE_SAMPLE_CHARACTERS, detect_language,
+                              get_fluff_classifier, get_fluff_rules_digest)
+from heading_scanner import detect_heading, iter_page_headings
+from instrumentation import LoggingSink, instrumentation
+from memory_budget import ChapterTextSpool, get_spill_threshold, report_peak_rss
+from page_store import PageStore, write_chapter_store
+from page_cache import CACHE_FORMAT_VERSION, count_words, count_words_in_pages, flatten_outline, stream_page_cache
+import pypdf
 import json
 import pprint
 import os
 import logging
+import time
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
+# Bump this whenever a change to chapter splitting or post-processing changes the output,
+# so incremental runs rebuild every book.
+CHAPTER_PIPELINE_VERSION = 4
+
 
 def bookmark_dict(
     bookmark_list, reader: PdfReader, use_labels: bool = False,
@@ -21,24 +38,54 @@ def bookmark_dict(
         use_labels: If true, use page labels. If False, use page indices.
 
     Returns:
-        A dictionary mapping page labels (or page indices) to their title
+        A dictionary mapping page labels (or page indices) to their title, at every outline depth
 
     Examples:
         Download the PDF from https://zenodo.org/record/50395 to give it a try
     """
-    result = {}
-    for item in bookmark_list:
-        if isinstance(item, list):
-            # recursive call
-            result.update(bookmark_dict(item, reader))
-        else:
-            page_index = reader.get_destination_page_number(item)
-            page_label = reader.page_labels[page_index]
-            if use_labels:
-                result[page_label] = item.title
-            else:
-                result[page_index] = item.title
-    return result
+    # reader.page_labels recomputes the labels of the whole document, so it is only read once
+    outline_entries = flatten_outline(bookmark_list, reader, reader.page_labels)
+    return bookmark_dict_from_outline(outline_entries, use_labels)
+
+
+def bookmark_dict_from_outline(outline_entries, use_labels: bool = False) -> Dict[Union[str, int], str]:
+    """
+    Builds the flat bookmark dictionary from the outline stored in the page cache.
+
+    Args:
+        outline_entries: The [page_index, page_label, title, depth] entries of the cached outline.
+        use_labels: If true, use page labels. If False, use page indices. Applies to every depth.
+
+    Returns:
+        A dictionary mapping page labels (or page indices) to their title
+    """
+    return build_outline_index(outline_entries, None, use_labels)['bookmarks']
+
+
+def build_outline_index(outline_entries, page_count, use_labels: bool = False):
+    """
+    Indexes a resolved outline once so that chapter construction only does constant-time lookups.
+
+    Args:
+        outline_entries: The [page_index, page_label, title, depth] entries of the cached outline.
+        page_count: The number of pages of the document, or None to skip the splits.
+        use_labels: If true, key entries by page label. If False, by page index. Applies to every depth.
+
+    Returns:
+        A dictionary with:
+            'bookmarks': key -> title, in outline order (a repeated key keeps its first position and last title)
+            'depths': key -> outline depth of the entry (0 for top-level items)
+            'split_at_pages': the keys followed by page_count, as built by construct_page_splits_array
+    """
+    bookmarks = {}
+    depths = {}
+    for page_index, page_label, title, depth in outline_entries:
+        key = page_label if use_labels else page_index
+        bookmarks[key] = title
+        depths.setdefault(key, depth)
+
+    split_at_pages = construct_page_splits_array(page_count, bookmarks) if page_count is not None else None
+    return {'bookmarks': bookmarks, 'depths': depths, 'split_at_pages': split_at_pages}
 
 
 def array_to_json_file(array, file_name):
@@ -48,12 +95,44 @@ def array_to_json_file(array, file_name):
     try:
         with open(file_name, 'w', encoding='utf-8') as json_file:
             json.dump(array, json_file, ensure_ascii=False, indent=4)
+            instrumentation.count('bytes.written', json_file.tell(), format='json')
     except Exception as e:
         logging.error(f"Error saving JSON: {e}")
 
 
-def construct_page_splits_array(reader, bms):
-    last_page = len(reader.pages)
+def stream_array_to_json_file(records, file_name):
+    """
+    Saves dictionaries to a JSON file as they are produced, byte for byte as array_to_json_file would save
+    their list, without holding the list. The file is written under a temporary name and moved into place
+    once every record went through; nothing is written when there are no records.
+
+    Returns:
+        int: The number of records written.
+    """
+    written = 0
+    temporary_file_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_file_name, 'w', encoding='utf-8') as json_file:
+            for record in records:
+                # json.dump(..., indent=4) nests each list item one level deeper.
+                item = json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+                json_file.write(f"{',' if written else '['}\n    {item}")
+                written += 1
+            json_file.write('\n]' if written else '[]')
+            instrumentation.count('bytes.written', json_file.tell(), format='json')
+        if written:
+            os.replace(temporary_file_name, file_name)
+    except Exception as e:
+        logging.error(f"Error saving JSON after {written} records: {e}")
+        raise
+    finally:
+        if os.path.exists(temporary_file_name):
+            os.remove(temporary_file_name)
+    return written
+
+
+def construct_page_splits_array(page_count, bms):
+    last_page = page_count
     split_at_list = list(bms.keys())
     split_at_list.append(last_page)
     return split_at_list
@@ -70,52 +149,168 @@ def construct_start_and_end_arrays(split_at_pages):
         else:
             start = split_at_pages[i - 1]
             end = split_at_pages[i]
-        print(f"Start: {start}, End: {end}")
         splits.append((start, end))
+    instrumentation.count('outline.splits', len(splits))
     return splits
 
 
-def get_chapter(split, reader, bms):
-    content = []
-    # print(split)
+def get_chapter(split, pages, bms, depths=None, join_contents=True):
+    start, end = split
+    page_records = [pages[page_nb] for page_nb in range(int(start), int(end))]
+    if join_contents:
+        return make_chapter(split, page_records, bms, depths)
+    spool = ChapterTextSpool()
+    for page_record in page_records:
+        spool.append(page_record)
+    return make_spooled_chapter(split, spool, bms, depths, join_contents)
+
+
+def make_chapter(split, page_records, bms, depths=None, contents=None, text_spool=None):
     start, end = split
-    # print(start, end)
     t = type(start)
     name = bms.get(start, '')
-    print(f'Search for {start} as type {t} and found {name}')
-
-    for page_nb in range(int(start), int(end)):
-        page_text = reader.pages[page_nb].extract_text()
-        content.append(page_text)
-    chapter_content = ''.join(content)
-    return {
+    if instrumentation.enabled:
+        instrumentation.event('chapter.named', start=start, key_type=t.__name__, name=name)
+        instrumentation.count('chapters.extracted')
+        instrumentation.count('pages.chaptered', len(page_records))
+
+    # contents is given for spilled chapters, whose page records only keep the length of their text.
+    if contents is None and text_spool is None:
+        contents = ''.join(page_record['text'] for page_record in page_records)
+    page_starts = []
+    offset = 0
+    for page_record in page_records:
+        page_starts.append([offset, page_record['page_number']])
+        offset += page_record['text_length'] if 'text_length' in page_record else len(page_record['text'])
+    chapter = {
         'name': name,
-        'contents': chapter_content,
-        'type_of_name': t.__name__  # keep .__name__ this here
+        'contents': contents,
+        'word_count': count_words_in_pages(page_records),  # from the cached page counts, no rescan
+        'type_of_name': t.__name__,  # keep .__name__ this here
+        'outline_depth': depths.get(start, 0) if depths else 0,
+        'page_starts': page_starts  # maps contents offsets back to page numbers, for chunk_chapters_stage
     }
+    if text_spool is not None:
+        # The page texts stay in the spool instead of being joined (see iter_chapter_texts).
+        del chapter['contents']
+        chapter['text_spool'] = text_spool
+    return chapter
 
 
-def get_chapter_name_from_contents(contents):
-    first_part = contents[0:1000]
-    print(first_part)
-    pass
+def iter_chapter_texts(chapter):
+    """
+    Yields the text of a chapter in parts: its contents, or the texts of its pages when they were kept apart
+    (see iter_pdf_chapters with join_contents=False).
+    """
+    if 'text_spool' in chapter:
+        yield from chapter['text_spool'].iter_texts()
+    else:
+        yield chapter['contents']
+
+
+def chapter_is_empty(chapter):
+    if 'text_spool' in chapter:
+        return chapter['text_spool'].text_length == 0
+    return chapter['contents'] == ""
+
+
+def splits_are_in_page_order(splits):
+    """
+    Tells whether chapters can be built from a single forward pass over the pages,
+    i.e. no split ends before it starts.
+    """
+    return all(int(start) <= int(end) for start, end in splits)
 
 
-def count_words(text):
+def make_spooled_chapter(split, spool, bms, depths=None, join_contents=True):
+    """
+    Builds a chapter from the pages collected in a ChapterTextSpool, then releases the spool. Without
+    join_contents, the chapter keeps the spool instead of its joined contents, and whoever consumes the chapter
+    text closes it (see chunk_chapters_stage).
     """
-    Counts the number of words in a string using regular expressions.
+    if not join_contents:
+        return make_chapter(split, spool.page_records, bms, depths, text_spool=spool)
+    try:
+        return make_chapter(split, spool.page_records, bms, depths,
+                            contents=spool.read_contents() if spool.spilled else None)
+    finally:
+        spool.close()
 
-    This method is more accurate than simple space-based splitting as it considers word boundaries,
-    which is beneficial for texts with punctuation, spaces, or special characters.
+
+def iter_chapters_in_page_order(splits, pages, bms, depths=None, spill_threshold=None, join_contents=True):
+    """
+    Builds the chapters of ordered splits from a stream of page records, keeping only the pages
+    of the current chapter in memory.
 
     Args:
-        text (str): The text string to count words in.
+        splits (list): (start, end) page splits for which splits_are_in_page_order holds.
+        pages (iterable): The page records, in page order.
+        bms (dict): The bookmark dictionary used to name the chapters.
+        depths (dict): The outline depth of each bookmark key.
+        spill_threshold (int): Characters of chapter text held in memory before the rest of the chapter
+            is spilled to disk (see ChapterTextSpool); None keeps whole chapters in memory.
+        join_contents (bool): Whether chapters get their joined contents, or keep their page texts apart.
+
+    Yields:
+        dict: One chapter per split, as returned by get_chapter.
+    """
+    pages = iter(pages)
+    page_nb = 0
+    for split in splits:
+        start, end = int(split[0]), int(split[1])
+        spool = ChapterTextSpool(spill_threshold)
+        while page_nb < end:
+            page = next(pages, None)
+            if page is None:
+                spool.close()
+                raise IndexError('list index out of range')
+            if page_nb >= start:
+                spool.append(page)
+            page_nb += 1
+        yield make_spooled_chapter(split, spool, bms, depths, join_contents)
+    # Drain the stream so a fresh extraction reaches the end and its page cache gets saved.
+    for _ in pages:
+        pass
 
-    Returns:
-        int: The number of words in the text.
+
+def iter_chapters_from_headings(pages, spill_threshold=None, join_contents=True):
+    """
+    Splits a book without an outline into chapters at the pages that open with a heading, as found
+    by heading_scanner. Pages are read once, keeping only the current chapter in memory.
+    Pages before the first heading are front matter and are skipped, like the first outline split;
+    a book without any heading becomes a single unnamed chapter.
+
+    Args:
+        pages (iterable): The page records, in page order.
+        spill_threshold (int): Characters of chapter text held in memory before spilling to disk,
+            as in iter_chapters_in_page_order.
+        join_contents (bool): As in iter_chapters_in_page_order.
+
+    Yields:
+        dict: One chapter per heading, with the schema of make_chapter.
     """
-    words = re.findall(r'\b\w+\b', text)
-    return len(words)
+    start, name, spool = None, '', ChapterTextSpool(spill_threshold)
+    front_matter = ChapterTextSpool(spill_threshold)
+    for page_nb, heading, page in iter_page_headings(pages):
+        if heading is not None:
+            if start is not None:
+                yield make_spooled_chapter((start, page_nb), spool, {start: name}, {start: 0}, join_contents)
+            else:
+                front_matter.close()
+                front_matter = ChapterTextSpool()  # skipped once a heading is found
+            start, name, spool = page_nb, heading, ChapterTextSpool(spill_threshold)
+        (front_matter if start is None else spool).append(page)
+    if start is not None:
+        yield make_spooled_chapter((start, start + len(spool)), spool, {start: name}, {start: 0}, join_contents)
+    elif front_matter:
+        yield make_spooled_chapter((0, len(front_matter)), front_matter, {}, {}, join_contents)
+
+
+def get_chapter_name_from_contents(contents):
+    """
+    Returns the heading that opens a chapter's contents, or None when it does not start with one.
+    """
+    return detect_heading(contents)
 
 
 # get all files in a directory
@@ -124,140 +319,193 @@ def get_files_in_directory(directory):
     return files
 
 
-def extract_pdf_chapters(book_name, pdf_file_path):
-    # book_name = '1626813582'
+def iter_chapters_by_rereading(splits, pages, bms, depths, spill_threshold, pdf_file_path, cache_directory=None,
+                               pdf_hash=None, join_contents=True):
+    """
+    Builds the chapters of out-of-order splits without holding every page: the first split is read from the
+    given stream, which is drained so that a fresh extraction saves its page cache, and each following split
+    streams the page cache again up to its last page. Only the current chapter is held in memory.
 
-    reader = PdfReader(pdf_file_path)
-    bms = bookmark_dict(reader.outline, reader, use_labels=True)
-    print(bms.keys())
-    print(bms.values())
+    Yields:
+        dict: One chapter per split, as returned by get_chapter.
+    """
+    for index, split in enumerate(splits):
+        if index:
+            # Stops reading the cache file at the last page of the split.
+            pages = islice(stream_page_cache(pdf_file_path, cache_directory, pdf_hash=pdf_hash)['pages'],
+                           max(int(split[1]), 0))
+        yield from iter_chapters_in_page_order([split], pages, bms, depths, spill_threshold, join_contents)
 
-    for page_nb, title in sorted(bms.items(), key=lambda n: f"{str(n[0]):>5}"):
-        print(f"{page_nb:>3}: {title}")
-        pass
 
-    sequence = construct_page_splits_array(reader, bms)
-    splits = construct_start_and_end_arrays(sequence)
+def iter_pdf_chapters(book_name, pdf_file_path, cache_directory=None, workers=1, pdf_hash=None,
+                      memory_limit_mb=None, page_count_observer=None, join_contents=True):
+    """
+    Generator version of extract_pdf_chapters: yields each chapter as soon as its last page has been read.
+    Pages are streamed from the page cache, so only the current chapter is held in memory when the
+    outline splits are in page order.
+    With memory_limit_mb set, a cache miss is extracted in page windows under that RSS ceiling
+    (see page_cache.iter_windowed_pages), chapter text past a share of the limit is spilled to disk,
+    and out-of-order outlines re-read the page cache for each chapter instead of loading every page.
+    The chapters are the same in both modes.
+    page_count_observer, when given, is called with the page count of the PDF, read from the page cache header.
+    With join_contents=False, chapters keep their page texts in a ChapterTextSpool under 'text_spool' instead of
+    joining them into 'contents', for stages that read the text in parts (see iter_chapter_texts).
+    """
+    # book_name = '1626813582'
+
+    page_cache = stream_page_cache(pdf_file_path, cache_directory, workers, pdf_hash, memory_limit_mb)
+    spill_threshold = get_spill_threshold(memory_limit_mb) if memory_limit_mb else None
+    if page_count_observer is not None:
+        page_count_observer(page_cache['page_count'])
+    outline_index = build_outline_index(page_cache['outline'], page_cache['page_count'], use_labels=True)
+    bms = outline_index['bookmarks']
+    depths = outline_index['depths']
+    if instrumentation.enabled:
+        instrumentation.event('pdf.outline', book=book_name, bookmarks=len(bms))
+        for page_nb, title in sorted(bms.items(), key=lambda n: f"{str(n[0]):>5}"):
+            instrumentation.event('pdf.bookmark', book=book_name, key=page_nb, title=title)
+
+    splits = construct_start_and_end_arrays(outline_index['split_at_pages'])
     splits_excluding_first = splits[1:]
 
-    chapters = []
-    for index, split in enumerate(splits_excluding_first):
-        chapter = get_chapter(split, reader, bms)
+    if not bms:
+        logging.info(f"No outline in {pdf_file_path}, detecting chapters from page headings")
+        chapters = iter_chapters_from_headings(page_cache['pages'], spill_threshold, join_contents)
+    elif splits_are_in_page_order(splits_excluding_first):
+        chapters = iter_chapters_in_page_order(splits_excluding_first, page_cache['pages'], bms, depths,
+                                               spill_threshold, join_contents)
+    elif memory_limit_mb:
+        chapters = iter_chapters_by_rereading(splits_excluding_first, page_cache['pages'], bms, depths,
+                                              spill_threshold, pdf_file_path, cache_directory,
+                                              page_cache['sha256'], join_contents)
+    else:
+        # Out-of-order outlines need random access to the pages.
+        pages = list(page_cache['pages'])
+        chapters = (get_chapter(split, pages, bms, depths, join_contents) for split in splits_excluding_first)
+
+    for index, chapter in enumerate(chapters):
         chapter['sequence_index'] = index
         chapter['part'] = ''
-        chapters.append(chapter)
+        yield chapter
 
-    return chapters
 
+def extract_pdf_chapters(book_name, pdf_file_path, cache_directory=None, workers=1):
+    return list(iter_pdf_chapters(book_name, pdf_file_path, cache_directory, workers))
 
-def exclude_fluff_from_request_bodies(json_data):
-        """
-        request_bodies = {
-                    "isbn_ten": isbn_ten,
-                    "name": chapter_name,
-                    "sequence_index": index,
-                    "contents": contents,
-                    "part": chapter_part,
-                }
-        """
-        # given a list of request bodies, exclude the ones that are too small or have keywords
-        exclude_keywords = [
-            "acknowledgement",
-            "acknowledgment",
-            "reference",
-            "appendix",
-            "bibliography",
-            "glossary",
-            "copyright",
-            "author's note",
-            "note on",
-            "publisher's note",
-            "about the author",
-            "list of collaborators",
-            "notes",
-            "praise for",
-            "praise",
-            "thanks",
-            "cover",
-            "index",
-            "resources",
-            "sources",
-            "table of contents",
-            "title page",
-            "penguin books",
-            "further readings",
-            "illustration credits",
-            "photo insert",
-            "about the publisher",
-            "author"
-        ]
-        exclude_indices = []
-
-        for index, request_body in enumerate(json_data):
-            try:
-                chapter_contents = request_body["contents"]
-                chapter_name = request_body["name"].lower()
-
-                # Log if chapter should not be filtered
-                if "chapter" in chapter_name:
-                    print(f"CHAPTER DOES NOT NEED TO BE FILTERED: {request_body['name']}")
-                    continue
-
-                # Exclude chapters with exclusionary keywords
-                if any(keyword in chapter_name for keyword in exclude_keywords):
-                    exclude_indices.append(index)
-                    print(f"\tEXCLUDED CHAPTER - KEYWORDS FLUFF: {request_body['name']}")
-                    continue
-
-                # Exclude if chapters not big enough
-                if count_words(chapter_contents) < 1000:
-                    exclude_indices.append(index)
-                    print(
-                        f"\tEXCLUDED CHAPTER - TOO SMALL: {request_body['name']} ({count_words(chapter_contents)} words)")
-                else:
-                    print(f"CHAPTER DOES NOT NEED TO BE FILTERED: {request_body['name']}")
-
-            except Exception as e:
-                print(f"Error during chapter fluff filtering {request_body['name']}: {str(e)}")
-
-        included_request_bodies = [
-            request_body for index, request_body in enumerate(json_data)
-            if index not in exclude_indices
-        ]
+
+# The English exclude keywords, kept for callers of the list; the filter itself uses fluff_classifier rule sets.
+EXCLUDE_KEYWORDS = [keyword for keywords in FLUFF_RULE_SETS['en']['exclude'].values() for keyword in keywords]
+
+
+def get_word_count(chapter):
+    """
+    Returns the word count stored on a chapter at extraction time, counting (and storing) it only
+    for chapters that do not have one yet.
+    """
+    if 'word_count' not in chapter:
+        chapter['word_count'] = count_words(chapter['contents'])
+    return chapter['word_count']
+
+
+def detect_chapters_language(chapters):
+    """
+    Detects the language of a book from the contents of its first chapters, sampling up to
+    LANGUAGE_SAMPLE_CHARACTERS characters of text. Only the chapters read for the sample are held in memory.
+
+    Args:
+        chapters (iterable): The chapter dictionaries.
+
+    Returns:
+        tuple: (language, chapters), where language is the detected key of FLUFF_RULE_SETS, or DEFAULT_LANGUAGE
+        when the sample does not tell, and chapters iterates over all the chapters, the sampled ones first.
+    """
+    chapters = iter(chapters)
+    sampled_chapters = []
+    sample = []
+    sample_length = 0
+    for chapter in chapters:
+        sampled_chapters.append(chapter)
+        for text in iter_chapter_texts(chapter):
+            sample.append(text[:LANGUAGE_SAMPLE_CHARACTERS - sample_length])
+            sample_length += len(sample[-1])
+            if sample_length >= LANGUAGE_SAMPLE_CHARACTERS:
+                break
+        if sample_length >= LANGUAGE_SAMPLE_CHARACTERS:
+            break
+    language = detect_language(' '.join(sample))
+    if language is None:
+        logging.info(f"Could not detect the book language, filtering fluff with the '{DEFAULT_LANGUAGE}' rules")
+        language = DEFAULT_LANGUAGE
+    else:
+        logging.info(f"Detected book language '{language}', filtering fluff with its rules")
+    instrumentation.event('chapters.language', language=language, sample_characters=sample_length)
+    return language, chain(sampled_chapters, chapters)
+
+
+def exclude_fluff_stage(chapters, exclude_keywords=None, classifier=None, languages=None):
+    """
+    Pipeline stage: drops the chapters that are too small or whose name matches a fluff rule.
+    Decisions come from a FluffClassifier, and are counted under 'chapters.excluded' and 'chapters.kept'
+    with their reason code. Unless a classifier or the languages of the book are given, the rule set of the
+    language detected from the first chapters is used (see detect_chapters_language); exclude_keywords
+    replaces its exclude phrases with whole-word rules.
+
+    request_bodies = {
+                "isbn_ten": isbn_ten,
+                "name": chapter_name,
+                "sequence_index": index,
+                "contents": contents,
+                "part": chapter_part,
+            }
+    """
+    if classifier is None:
+        if not languages:
+            languages, chapters = detect_chapters_language(chapters)
+        classifier = get_fluff_classifier(languages, exclude_keywords)
+    for request_body in chapters:
         try:
-            print("\nCHAPTERS INCLUDED:")
-            for request_body in included_request_bodies:
-                try:
-                    print(request_body["name"])
-                except KeyError:
-                    print("Error: 'name' key is missing in some request bodies.")
+            decision = classifier.classify(request_body["name"], lambda: get_word_count(request_body))
+
+            # Exclude chapters with exclusionary keywords, or not big enough
+            if decision["excluded"]:
+                if instrumentation.enabled:
+                    instrumentation.count('chapters.excluded', reason=decision["reason"])
+                    instrumentation.event('chapter.excluded', name=request_body['name'], reason=decision["reason"],
+                                          rule=decision["rule"], word_count=request_body.get('word_count'))
+                continue
+            instrumentation.count('chapters.kept', reason=decision["reason"])
+
         except Exception as e:
-            print(f"Error during the fluff filtering process: {str(e)}")
+            logging.error(f"Error during chapter fluff filtering {request_body.get('name')}: {str(e)}")
 
-        # Using deepcopy to create a complete copy of the data, excluding unwanted elements
-        filtered_request_bodies = copy.deepcopy(
-            [request_body for index, request_body in enumerate(json_data) if index not in exclude_indices])
+        yield request_body
 
-        return filtered_request_bodies
 
+def exclude_fluff_from_request_bodies(json_data):
+    # given a list of request bodies, exclude the ones that are too small or have keywords
+    return list(exclude_fluff_stage(json_data))
 
-def analyze_raw_extraction(data):
+
+def analyze_raw_extraction(data, filtered_data=None):
+    """
+    Reports chapter and word counts before and after fluff filtering, using the word counts stored on
+    the chapters. Pass filtered_data when the chapters have already been filtered to skip re-running
+    the fluff filter.
+    """
     chapter_count = len(data)
     total_word_count = 0
 
     for index, chapter in enumerate(data):
-        words = count_words(chapter['contents'])
-        print(f"{chapter['name']} has {words} words")
-        total_word_count += words
+        total_word_count += get_word_count(chapter)
 
-    filtered_data = exclude_fluff_from_request_bodies(data)
+    if filtered_data is None:
+        filtered_data = exclude_fluff_from_request_bodies(data)
     number_of_excluded_chapters = chapter_count - len(filtered_data)
 
     filtered_total_word_count = 0
     filtered_chapters_with_count = ''
     for index, chapter in enumerate(filtered_data):
-        words = count_words(chapter['contents'])
-        # print(f"{chapter['name']} has {words} words")
+        words = get_word_count(chapter)
         filtered_total_word_count += words
         filtered_chapters_with_count += f"{chapter['name']} -- {words} words\n"
 
@@ -275,98 +523,405 @@ def is_pdf(file):
     return file.endswith('.pdf')
 
 
-def propagate_name_to_part(arr):
+def is_nested_chapter(obj):
+    """
+    Tells whether a chapter comes from a nested outline item, which inherits the name of the preceding part.
+    """
+    if "outline_depth" in obj:
+        return obj["outline_depth"] > 0
+    # nested items used to be the only ones keyed by page index
+    return obj["type_of_name"] == "int"
+
+
+def propagate_name_to_part_stage(chapters):
     propagate_name = None
-    for i, obj in enumerate(arr):
+    for obj in chapters:
         # If contents are blank and no name is currently being propagated, start propagation
-        if obj["contents"] == "" and propagate_name is None:
+        if chapter_is_empty(obj) and propagate_name is None:
             propagate_name = obj["name"]
         # If contents are blank and a name is being propagated, stop propagation before updating this object
-        elif obj["contents"] == "" and propagate_name is not None:
+        elif chapter_is_empty(obj) and propagate_name is not None:
             propagate_name = obj["name"]  # We've encountered another empty "contents", reset the name
         # Propagate the name to the part key if needed
-        elif propagate_name is not None and obj["type_of_name"] == "int":
-            arr[i]["part"] = propagate_name
-    return arr
+        elif propagate_name is not None and is_nested_chapter(obj):
+            obj["part"] = propagate_name
+        yield obj
+
+
+def remove_empty_chapters_stage(chapters):
+    return (obj for obj in chapters if not chapter_is_empty(obj))
+
+
+def re_sequence_chapters_stage(chapters):
+    for i, obj in enumerate(chapters):
+        obj["sequence_index"] = i
+        yield obj
+
+
+def inject_isbn_stage(chapters, isbn):
+    for obj in chapters:
+        obj["isbn"] = isbn
+        yield obj
+
+
+def remove_type_of_name_stage(chapters):
+    for obj in chapters:
+        obj.pop("type_of_name", None)
+        obj.pop("outline_depth", None)
+        obj.pop("page_starts", None)
+        yield obj
+
+
+def chunk_chapters_stage(chapters, chunk_size, chunk_overlap=0, chunk_unit='characters'):
+    """
+    Pipeline stage: replaces every chapter by its chunks, split under a budget of chunk_size characters
+    or estimated tokens at paragraph or sentence boundaries, consecutive chunks overlapping by up to
+    chunk_overlap. Chunks keep the chapter fields and add a stable id, their position and their
+    character offsets in the chapter, and the pages they come from when the chapter has page offsets.
+    The text is read in parts (see iter_chapter_texts), so chapters built with join_contents=False are chunked
+    from their page texts without being joined, and each chunk is yielded as soon as it is cut. Chunks are cut
+    twice, first only to count them for chunk_count, so no list of chunks is held either.
+    """
+    for obj in chapters:
+        page_starts = obj.get("page_starts")
+        try:
+            chunk_count = sum(1 for _ in iter_text_chunks(iter_chapter_texts(obj), chunk_size, chunk_overlap,
+                                                          chunk_unit))
+            chunks = iter_text_chunks(iter_chapter_texts(obj), chunk_size, chunk_overlap, chunk_unit)
+            for chunk_index, (start, end, chunk_contents) in enumerate(chunks):
+                chunk_contents = chunk_contents.rstrip()
+                end = start + len(chunk_contents)
+                yield {
+                    "chunk_id": f"{obj.get('isbn', '')}-{obj['sequence_index']:04d}-{chunk_index:04d}",
+                    "name": obj["name"],
+                    "contents": chunk_contents,
+                    "word_count": count_words(chunk_contents),
+                    "sequence_index": obj["sequence_index"],
+                    "part": obj["part"],
+                    "isbn": obj.get("isbn"),
+                    "chunk_index": chunk_index,
+                    "chunk_count": chunk_count,
+                    "start_offset": start,
+                    "end_offset": end,
+                    "start_page": find_page_number(page_starts, start),
+                    "end_page": find_page_number(page_starts, max(end - 1, start))
+                }
+        finally:
+            if 'text_spool' in obj:
+                obj['text_spool'].close()
+
+
+def observe_stage(chapters, observer):
+    """
+    Pipeline stage: hands every chapter to observer (e.g. list.append) and passes it on unchanged.
+    """
+    for obj in chapters:
+        observer(obj)
+        yield obj
+
+
+def propagate_name_to_part(arr):
+    return list(propagate_name_to_part_stage(arr))
 
 
 def remove_empty_chapters(arr):
-    return [obj for obj in arr if obj["contents"] != ""]
+    return list(remove_empty_chapters_stage(arr))
 
 
 def re_sequence_chapters(arr):
-    for i, obj in enumerate(arr):
-        arr[i]["sequence_index"] = i
-    return arr
+    return list(re_sequence_chapters_stage(arr))
 
 
 def inject_isbn_to_chapters(arr, isbn):
-    for i, obj in enumerate(arr):
-        arr[i]["isbn"] = isbn
-    return arr
+    return list(inject_isbn_stage(arr, isbn))
 
 
 def remove_type_of_name_helper(arr):
-    for i, obj in enumerate(arr):
-        arr[i].pop("type_of_name", None)
-    return arr
+    return list(remove_type_of_name_stage(arr))
 
 
-def process_pdf(pdf_file_path, output_directory=None, apply_exclude_fluff=True, apply_remove_empty_chapters=True):
+def build_chapter_pipeline(isbn, apply_exclude_fluff=True, apply_remove_empty_chapters=True,
+                           filtered_chapter_observer=None, exclude_keywords=None, chunk_size=None, chunk_overlap=0,
+                           chunk_unit='characters', fluff_languages=None):
     """
-        Main function to process the PDF file, extract chapters based on bookmarks,
-        and save the extracted chapters as a JSON file after applying various transformations.
-        """
+    Lists the post-processing stages applied to extracted chapters, in order.
+
+    Every stage is a generator taking and yielding chapter dictionaries, so the whole pipeline runs as a
+    single pass in which each chapter is handled by all stages before the next one is read. Chapters are
+    updated in place and never copied.
+
+    Args:
+        isbn (str): The ISBN injected into every chapter.
+        apply_exclude_fluff (bool): Whether to drop fluff chapters.
+        apply_remove_empty_chapters (bool): Whether to drop chapters with empty contents.
+        filtered_chapter_observer (callable): Optional callback receiving each chapter kept by the fluff filter.
+        exclude_keywords (list): Keywords marking fluff chapters, replacing the rule sets of fluff_classifier.
+        chunk_size (int): When set, chapters are replaced by chunks of at most this many characters or tokens.
+        chunk_overlap (int): The budget of text repeated between consecutive chunks.
+        chunk_unit (str): The unit of chunk_size and chunk_overlap, 'characters' or 'tokens' (estimated).
+        fluff_languages (list): The fluff_classifier rule sets to use, e.g. ['fr'], or ['all'] for all of them.
+            Defaults to the language detected from the chapters.
+
+    Returns:
+        list: The stages, each a callable taking an iterable of chapters.
+    """
+    stages = []
+    if apply_exclude_fluff:
+        stages.append(partial(exclude_fluff_stage, exclude_keywords=exclude_keywords, languages=fluff_languages))
+    if filtered_chapter_observer is not None:
+        stages.append(partial(observe_stage, observer=filtered_chapter_observer))
+    stages.append(propagate_name_to_part_stage)
+    if apply_remove_empty_chapters:
+        stages.append(remove_empty_chapters_stage)
+    stages.append(re_sequence_chapters_stage)
+    stages.append(partial(inject_isbn_stage, isbn=isbn))
+    if chunk_size:
+        stages.append(partial(chunk_chapters_stage, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                              chunk_unit=chunk_unit))
+    stages.append(remove_type_of_name_stage)
+    return stages
+
+
+def get_stage_name(stage):
+    return getattr(stage, 'func', stage).__name__
+
+
+def iter_timed(items, seconds, index):
+    """
+    Passes items through, adding the time spent producing each one to seconds[index].
+    """
+    items = iter(items)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            seconds[index] += time.perf_counter() - started
+            return
+        seconds[index] += time.perf_counter() - started
+        yield item
+
+
+def iter_timed_pipeline(chapters, stages):
+    """
+    Runs the stages like run_chapter_pipeline, timing each of them. The stages are lazy and interleaved, so
+    the time of a stage is the time spent producing its chapters minus the time spent in the stages before it;
+    the source (e.g. iter_pdf_chapters, with the page extraction) counts as the first stage. The spans are
+    emitted as 'pipeline.stage' once the pipeline is exhausted or closed.
+    """
+    names = [getattr(chapters, '__name__', 'source')] + [get_stage_name(stage) for stage in stages]
+    seconds = [0.0] * len(names)
+    chapters = iter_timed(chapters, seconds, 0)
+    for index, stage in enumerate(stages, 1):
+        chapters = iter_timed(stage(chapters), seconds, index)
+    chapter_count = 0
     try:
-        book_name = os.path.basename(pdf_file_path).split('.')[0]
-        logging.info(f"Processing PDF: {pdf_file_path}")
+        for chapter in chapters:
+            chapter_count += 1
+            yield chapter
+    finally:
+        for index, name in enumerate(names):
+            exclusive_seconds = seconds[index] - (seconds[index - 1] if index else 0.0)
+            instrumentation.record_span('pipeline.stage', exclusive_seconds, stage=name)
+        instrumentation.count('pipeline.outputs', chapter_count)
 
-        chapters = extract_pdf_chapters(book_name, pdf_file_path)
 
-        if apply_exclude_fluff:
-            chapters = exclude_fluff_from_request_bodies(chapters)
-        chapters_with_part_info = propagate_name_to_part(chapters)
+def run_chapter_pipeline(chapters, stages):
+    """
+    Chains the stages over a stream of chapters. When instrumentation is enabled, each stage is timed
+    (see iter_timed_pipeline).
 
-        if apply_remove_empty_chapters:
-            chapters_without_empty = remove_empty_chapters(chapters_with_part_info)
-        else:
-            chapters_without_empty = chapters_with_part_info
+    Args:
+        chapters (iterable): The extracted chapters, e.g. from iter_pdf_chapters.
+        stages (list): The stages returned by build_chapter_pipeline.
 
-        chapters_resequenced = re_sequence_chapters(chapters_without_empty)
-        chapters_with_isbn = inject_isbn_to_chapters(chapters_resequenced, book_name)
-        chapters_without_type_of_name = remove_type_of_name_helper(chapters_with_isbn)
+    Returns:
+        iterator: The processed chapters, produced lazily.
+    """
+    if instrumentation.enabled:
+        return iter_timed_pipeline(chapters, stages)
+    for stage in stages:
+        chapters = stage(chapters)
+    return iter(chapters)
+
+
+def describe_chapter_build(pdf_file_path, config, previous_manifest=None):
+    """
+    Fingerprints the inputs of a chapter build and derives its stage keys:
+    'extraction' depends on the PDF content, the pypdf version and the page cache format;
+    'chapters' depends on the extraction key, the pipeline version and the options.
+
+    Args:
+        pdf_file_path (str): The path to the PDF file.
+        config (dict): The options of the chapter pipeline.
+        previous_manifest (dict): The manifest of the previous build, used to avoid re-hashing unchanged PDFs.
+
+    Returns:
+        dict: The build manifest without results.
+    """
+    pdf_fingerprint = fingerprint_file(pdf_file_path, (previous_manifest or {}).get("pdf"))
+    extraction_key = compute_stage_key(pdf_fingerprint["sha256"], pypdf.__version__, CACHE_FORMAT_VERSION)
+    return {
+        "pdf": pdf_fingerprint,
+        "config": config,
+        "stages": {
+            "extraction": extraction_key,
+            "chapters": compute_stage_key(extraction_key, CHAPTER_PIPELINE_VERSION, config)
+        }
+    }
 
-        results = analyze_raw_extraction(chapters)
-        pprint.pprint(results)
 
-        if chapters_without_type_of_name:
-            output_file_path = os.path.join(output_directory, f"{book_name}_autosplits.json")
-            array_to_json_file(chapters_without_type_of_name, output_file_path)
-            logging.info(f"Data saved to {output_file_path}")
+def process_pdf(pdf_file_path, output_directory=None, apply_exclude_fluff=True, apply_remove_empty_chapters=True,
+                raise_errors=False, workers=1, output_format='json', exclude_keywords=None, incremental=False,
+                chunk_size=None, chunk_overlap=0, chunk_unit='characters', fluff_languages=None,
+                memory_limit_mb=None, page_count_observer=None):
+    """
+        Main function to process the PDF file, extract chapters based on bookmarks,
+        and save the extracted chapters as a JSON file after applying various transformations.
+
+        Returns the number of saved chapters (0 if none were processed). Errors are logged and
+        None is returned, unless raise_errors is set, in which case they are re-raised.
+        With workers > 1, page text is extracted by that many processes in parallel.
+        With output_format='jsonl', chapters are streamed one JSON object per line to {book_name}_autosplits.jsonl
+        as soon as they leave the pipeline. With output_format='store', they are streamed into the page store in
+        {output_directory}/page_store instead, for random access to a single chapter (see page_store).
+        exclude_keywords replaces the exclude phrases of the fluff filter, and fluff_languages declares the rule
+        sets to use instead of the language detected from the chapters (see exclude_fluff_stage).
+        With incremental=True, the PDF fingerprint and the options are recorded in {book_name}_autosplits.build.json;
+        a rerun skips the book when neither changed, and re-filters from the page cache without re-extracting
+        text when only the options changed.
+        With chunk_size set, chapters are split into overlapping chunks under that budget (see chunk_chapters_stage)
+        and saved to {book_name}_chunks.json (or .jsonl); the returned count is then the number of chunks.
+        With memory_limit_mb set, the book is processed in bounded memory (see iter_pdf_chapters), the JSON file
+        is written chapter by chapter instead of from the list of chapters, and the peak RSS is logged.
+        The saved chapters are the same.
+        page_count_observer, when given, is called with the page count of the PDF (from the page cache, or from the
+        build manifest when an incremental run skips the book), so callers do not open the PDF again for it.
+        """
+    try:
+        book_name = os.path.basename(pdf_file_path).split('.')[0]
+        logging.info(f"Processing PDF: {pdf_file_path}")
+        output_name = "chunks" if chunk_size else "autosplits"
+        output_file_path = os.path.join(output_directory, f"{book_name}_{output_name}.{output_format}")
+        store_directory = os.path.join(output_directory, 'page_store')
+        output_location = store_directory if output_format == 'store' else output_file_path
+
+        pdf_hash = None
+        if incremental:
+            config = {
+                "apply_exclude_fluff": apply_exclude_fluff,
+                "apply_remove_empty_chapters": apply_remove_empty_chapters,
+                "exclude_keywords": exclude_keywords,
+                "fluff_languages": fluff_languages,
+                # The rule sets are code, so a digest of them is keyed in, not only the options selecting them.
+                "fluff_rules": (get_fluff_rules_digest(fluff_languages, exclude_keywords)
+                                if apply_exclude_fluff else None),
+                "output_format": output_format,
+                "chunking": [chunk_size, chunk_overlap, chunk_unit] if chunk_size else None
+            }
+            manifest_path = get_build_manifest_path(output_file_path)
+            previous_manifest = read_build_manifest(manifest_path)
+            build = describe_chapter_build(pdf_file_path, config, previous_manifest)
+            stale_stages = find_stale_stages(previous_manifest, build["stages"])
+            if output_format == 'store':
+                with PageStore(store_directory) as store:
+                    output_exists = store.count_chapters(book_name) > 0
+            else:
+                output_exists = os.path.exists(output_file_path)
+            if not stale_stages and output_exists:
+                logging.info(f"{output_location} is up to date, skipping {pdf_file_path}")
+                if page_count_observer is not None:
+                    page_count_observer(previous_manifest.get("page_count", 0))
+                return previous_manifest["chapter_count"]
+            if stale_stages == ["chapters"]:
+                logging.info(f"Only the chapter options changed, re-filtering {pdf_file_path} from the page cache")
+            pdf_hash = build["pdf"]["sha256"]
+
+        # Only names and word counts are kept for the report, so chapter contents are never held twice.
+        chapter_summaries = []
+        stages = build_chapter_pipeline(
+            book_name, apply_exclude_fluff, apply_remove_empty_chapters,
+            filtered_chapter_observer=lambda chapter: chapter_summaries.append(
+                {'name': chapter['name'], 'word_count': get_word_count(chapter)}),
+            exclude_keywords=exclude_keywords, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            chunk_unit=chunk_unit, fluff_languages=fluff_languages)
+        page_counts = []
+
+        def observe_page_count(page_count):
+            page_counts.append(page_count)
+            if page_count_observer is not None:
+                page_count_observer(page_count)
+
+        chapters = run_chapter_pipeline(
+            iter_pdf_chapters(book_name, pdf_file_path, workers=workers, pdf_hash=pdf_hash,
+                              memory_limit_mb=memory_limit_mb, page_count_observer=observe_page_count,
+                              join_contents=not chunk_size), stages)
+
+        with instrumentation.span('pdf.process', book=book_name):
+            if output_format == 'store':
+                saved_chapter_count = write_chapter_store(chapters, book_name, store_directory)
+            elif output_format == 'jsonl':
+                saved_chapter_count = write_jsonl_file(chapters, output_file_path)
+                if not saved_chapter_count:
+                    os.remove(output_file_path)
+            elif memory_limit_mb:
+                with instrumentation.span('pdf.write', book=book_name):
+                    saved_chapter_count = stream_array_to_json_file(chapters, output_file_path)
+            else:
+                chapters = list(chapters)
+                saved_chapter_count = len(chapters)
+                if chapters:
+                    with instrumentation.span('pdf.write', book=book_name):
+                        array_to_json_file(chapters, output_file_path)
+
+        results = analyze_raw_extraction(chapter_summaries,
+                                         filtered_data=chapter_summaries if apply_exclude_fluff else None)
+        pprint.pprint(results)
+        if memory_limit_mb:
+            report_peak_rss(pdf_file_path, memory_limit_mb)
+
+        if saved_chapter_count:
+            logging.info(f"Data saved to {output_location}")
+            if incremental:
+                build["chapter_count"] = saved_chapter_count
+                build["page_count"] = page_counts[0]
+                write_build_manifest(build, manifest_path)
         else:
             logging.error("No chapters were processed.")
+        return saved_chapter_count
     except Exception as e:
         logging.error(f"Error processing {pdf_file_path}: {e}")
+        if raise_errors:
+            raise
+        return None
 
 
-def get_chapter_payloads_from_pdf(isbn, pdf_file_path):
+def iter_chapter_payloads_from_pdf(isbn, pdf_file_path, workers=1, chunk_size=None, chunk_overlap=0,
+                                   chunk_unit='characters'):
+    """
+    Generator version of get_chapter_payloads_from_pdf: yields each processed chapter (or chunk) as soon as it
+    leaves the pipeline.
+    """
+    chapters = iter_pdf_chapters(isbn, pdf_file_path, workers=workers, join_contents=not chunk_size)
+    stages = build_chapter_pipeline(isbn, chunk_size=chunk_size, chunk_overlap=chunk_overlap, chunk_unit=chunk_unit)
+    return run_chapter_pipeline(chapters, stages)
+
+
+def get_chapter_payloads_from_pdf(isbn, pdf_file_path, workers=1, chunk_size=None, chunk_overlap=0,
+                                  chunk_unit='characters'):
     """
     Extract and process chapters from PDF specified by its ISBN and file path,
     returning the chapters data after transformations.
+    With workers > 1, page text is extracted by that many processes in parallel.
+    With chunk_size set, the chunks of the chapters are returned instead (see chunk_chapters_stage).
     """
     try:
         logging.info(f"Extracting chapters from PDF: {pdf_file_path} with ISBN: {isbn}")
-        chapters = extract_pdf_chapters(isbn, pdf_file_path)
-
-        filter_chapters = exclude_fluff_from_request_bodies(chapters)
-        chapters_with_part_info = propagate_name_to_part(filter_chapters)
-        chapters_without_empty = remove_empty_chapters(chapters_with_part_info)
-        chapters_resequenced = re_sequence_chapters(chapters_without_empty)
-        chapters_with_isbn = inject_isbn_to_chapters(chapters_resequenced, isbn)
-        chapters_without_type_of_name = remove_type_of_name_helper(chapters_with_isbn)
+        processed_chapters = list(iter_chapter_payloads_from_pdf(isbn, pdf_file_path, workers, chunk_size,
+                                                                 chunk_overlap, chunk_unit))
 
-        logging.info(f"Processed {len(chapters_without_type_of_name)} chapters.")
-        return chapters_without_type_of_name
+        logging.info(f"Processed {len(processed_chapters)} chapters.")
+        return processed_chapters
     except Exception as e:
         logging.error(f"Failed processing PDF {pdf_file_path} with ISBN {isbn}: {e}")
         raise e
@@ -383,11 +938,24 @@ if __name__ == "__main__":
 
     apply_exclude_fluff = True
     apply_remove_empty_chapters = True
+    workers = os.cpu_count() or 1  # Processes used to extract page shards of the PDF in parallel.
+    output_format = 'json'  # Use 'jsonl' to write one chapter per line, or 'store' to add them to data/page_store.
+    incremental = False  # Set to True to skip the book when neither the PDF nor the options changed since the last run.
+    chunk_size = None  # Set e.g. to 4000 to save LLM-sized chunks of the chapters instead of whole chapters.
+    chunk_overlap = 400
+    chunk_unit = 'characters'  # Or 'tokens' (estimated).
+    memory_limit_mb = None  # Set e.g. to 512 to extract in page windows, spill long chapters and log the peak RSS.
+    instrument = False  # Set to True to log counters, stage timings and chapter decisions (see instrumentation.py).
+
+    if instrument:
+        instrumentation.add_sink(LoggingSink(level=logging.INFO))
 
     logging.info("Starting PDF processing")
 
     try:
-        process_pdf(pdf_path, data_path, apply_exclude_fluff, apply_remove_empty_chapters)
+        process_pdf(pdf_path, data_path, apply_exclude_fluff, apply_remove_empty_chapters, workers=workers,
+                    output_format=output_format, incremental=incremental, chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap, chunk_unit=chunk_unit, memory_limit_mb=memory_limit_mb)
         logging.info("PDF processing completed successfully")
     except Exception as e:
         logging.error(f"An error occurred while processing the PDF: {e}")
\ No newline at end of file
@@ -1,8 +1,9 @@
-import re
 import json
 import os
 import logging
-from pypdf import PdfReader
+from jsonl_output import write_jsonl_file
+from page_cache import stream_page_cache
+from page_store import write_page_store
 
 # Set up basic configuration for logging to capture important messages and errors.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,55 +22,71 @@ def clean_contents(contents):
     return contents.strip() if contents else ''
 
 
-def count_words(text):
+def extract_page_data(page_record, isbn, include_image_details=False):
     """
-    Counts the number of words in the given text using a regular expression that matches word boundaries.
+    Builds the metadata of a single PDF page from its page cache record.
 
     Args:
-        text (str): The text in which to count words.
+        page_record (dict): A page record from the page cache (see page_cache.extract_page_record).
+        isbn (str): The ISBN number of the PDF document.
+        include_image_details (bool): If True, also report the image count and, for each image, its pixel
+            dimensions and encoded byte size (read from the image dictionaries, without decoding pixels).
 
     Returns:
-        int: The number of words found in the text.
+        dict: A dictionary containing metadata of the PDF page.
     """
-    return len(re.findall(r'\b\w+\b', text))
+    contents = clean_contents(page_record["text"])
+    page_data = {
+        "isbn": isbn,
+        "page_number": page_record["page_number"],  # Already 1-indexed to be human-readable.
+        "contents": contents,
+        "contains_images": page_record["contains_images"],
+        "word_count": page_record["word_count"],  # Stripping whitespace does not change the word count.
+        "page_class": page_record["page_class"]  # 'text', 'image' or 'blank', see page_classifier.classify_page
+    }
+    if include_image_details:
+        page_data["image_count"] = len(page_record["images"])
+        page_data["images"] = page_record["images"]
+    return page_data
 
 
-def extract_page_data(page, isbn):
+def iter_pdf_page_data(pdf_path, isbn, cache_directory=None, workers=1, include_image_details=False):
     """
-    Extracts metadata from a single PDF page.
+    Generator version of read_pdf_and_extract_data: yields the metadata of each page as soon as it is
+    read from the page cache (or extracted, when the cache is cold), holding one page in memory at a time.
 
     Args:
-        page (PageObject): A PyPDF2 PageObject from which to extract data.
+        pdf_path (str): The file path to the PDF.
         isbn (str): The ISBN number of the PDF document.
+        cache_directory (str): Directory holding the page cache files. Defaults to page_cache.DEFAULT_CACHE_DIRECTORY.
+        workers (int): Number of processes extracting page shards in parallel when the page cache is cold.
+        include_image_details (bool): If True, add image counts, dimensions and sizes to each page.
 
-    Returns:
-        dict: A dictionary containing metadata of the PDF page.
+    Yields:
+        dict: The metadata of a single page, in page order.
     """
-    contents = clean_contents(page.extract_text())
-    contains_images = bool(page.images)  # Converts list to a boolean, True if images are present, otherwise False.
-    return {
-        "isbn": isbn,
-        "page_number": page.page_number + 1,  # Adding 1 to make the page number human-readable (1-indexed).
-        "contents": contents,
-        "contains_images": contains_images,
-        "word_count": count_words(contents)
-    }
+    page_cache = stream_page_cache(pdf_path, cache_directory, workers)
+    for page_record in page_cache["pages"]:
+        yield extract_page_data(page_record, isbn, include_image_details)
 
 
-def read_pdf_and_extract_data(pdf_path, isbn):
+def read_pdf_and_extract_data(pdf_path, isbn, cache_directory=None, workers=1, include_image_details=False):
     """
     Reads a PDF file and extracts metadata for each page.
+    Page text comes from the shared page cache, so pypdf only runs when the PDF has not been extracted yet.
 
     Args:
         pdf_path (str): The file path to the PDF.
         isbn (str): The ISBN number of the PDF document.
+        cache_directory (str): Directory holding the page cache files. Defaults to page_cache.DEFAULT_CACHE_DIRECTORY.
+        workers (int): Number of processes extracting page shards in parallel when the page cache is cold.
+        include_image_details (bool): If True, add image counts, dimensions and sizes to each page.
 
     Returns:
         list: A list of dictionaries, each containing metadata for a single page.
     """
     try:
-        reader = PdfReader(pdf_path)
-        return [extract_page_data(page, isbn) for page in reader.pages]
+        return list(iter_pdf_page_data(pdf_path, isbn, cache_directory, workers, include_image_details))
     except Exception as e:
         logging.error(f"Failed to read or process PDF {pdf_path}: {e}")
         return []  # Return an empty list in case of failure.
@@ -95,6 +112,9 @@ def write_json_output(pages_data, isbn, output_directory):
         pages_data (list): List of dictionaries containing page data.
         isbn (str): The ISBN number used to name the output file.
         output_directory (str): Directory where the output file will be saved.
+
+    Returns:
+        int: The number of pages written, or None on failure.
     """
     ensure_directory_exists(output_directory)
 
@@ -104,8 +124,46 @@ def write_json_output(pages_data, isbn, output_directory):
         with open(output_file_path, "w", encoding="utf-8") as json_file:
             json.dump(pages_data, json_file, ensure_ascii=False, indent=4)
         logging.info(f"Metadata JSON file created at {output_file_path}")
+        return len(pages_data)
     except Exception as e:
         logging.error(f"Failed to write output JSON file: {e}")
+        return None
+
+
+def write_jsonl_output(pages_data, isbn, output_directory):
+    """
+    Streams the extracted page data to a JSON Lines file, one page per line.
+
+    Args:
+        pages_data (iterable): Dictionaries containing page data, typically from iter_pdf_page_data.
+        isbn (str): The ISBN number used to name the output file.
+        output_directory (str): Directory where the output file will be saved.
+
+    Returns:
+        int: The number of pages written.
+    """
+    ensure_directory_exists(output_directory)
+
+    output_file_path = os.path.join(output_directory, f"{isbn}_page_metadata.jsonl")
+    page_count = write_jsonl_file(pages_data, output_file_path)
+    logging.info(f"Metadata JSONL file with {page_count} pages created at {output_file_path}")
+    return page_count
+
+
+def write_page_store_output(pages_data, isbn, output_directory):
+    """
+    Appends the extracted page data to the library page store in {output_directory}/page_store: typed columns
+    in SQLite and page texts in a blob file, so queries across books do not parse per-book JSON (see page_store).
+
+    Args:
+        pages_data (iterable): Dictionaries containing page data, typically from iter_pdf_page_data.
+        isbn (str): The ISBN number of the book.
+        output_directory (str): Directory holding the page_store directory.
+
+    Returns:
+        int: The number of pages stored, or None on failure.
+    """
+    return write_page_store(pages_data, isbn, os.path.join(output_directory, 'page_store'))
 
 
 if __name__ == "__main__":
@@ -116,8 +174,21 @@ if __name__ == "__main__":
     isbn = '9354990517'
     data_path = 'data'
     pdf_path = f'{data_path}/{isbn}.pdf'
+    workers = os.cpu_count() or 1  # Processes used to extract page shards of the PDF in parallel.
+    output_format = 'json'  # Use 'jsonl' to stream one page per line without holding the book in memory,
+    # or 'store' to append the book to the columnar page store shared by the whole library (data/page_store).
+    include_image_details = False  # Set to True to report image counts, dimensions and byte sizes per page.
     try:
-        pages_metadata = read_pdf_and_extract_data(pdf_path, isbn)
-        write_json_output(pages_metadata, isbn, data_path)
+        if output_format in ('jsonl', 'store'):
+            pages_metadata = iter_pdf_page_data(pdf_path, isbn, workers=workers,
+                                                include_image_details=include_image_details)
+            if output_format == 'store':
+                write_page_store_output(pages_metadata, isbn, data_path)
+            else:
+                write_jsonl_output(pages_metadata, isbn, data_path)
+        else:
+            pages_metadata = read_pdf_and_extract_data(pdf_path, isbn, workers=workers,
+                                                       include_image_details=include_image_details)
+            write_json_output(pages_metadata, isbn, data_path)
     except Exception as e:
         logging.error(f"An error occurred: {e}")
\ No newline at end of file
@@ -1,17 +1,22 @@
+import io
 import os
 import logging
-from PyPDF2 import PdfReader, PdfWriter
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pypdf import PdfReader, PdfWriter
 
 # Configure logging to capture important information and errors
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def create_output_folder(isbn):
+def create_output_folder(isbn, data_path='data'):
     """
     Creates a directory for saving individual PDF page files. The folder is named based on the ISBN.
 
     Args:
         isbn (str): The ISBN number which is used to name the folder.
+        data_path (str): The directory in which the folder is created.
 
     Returns:
         str: The path of the created output folder.
@@ -22,53 +27,161 @@ def create_output_folder(isbn):
     return output_folder
 
 
-def save_page_as_pdf(page, output_filename):
+def save_pages_as_pdf(reader, start, end, output_filename):
     """
-    Saves a single PDF page to a file.
+    Saves a range of pages to a single PDF file.
+
+    Pages are added to one writer, so fonts and images shared by the pages of the range are written once.
+    Page objects and their streams are copied as they are, without decoding or re-encoding content.
 
     Args:
-        page (PageObject): A single page from a PDF file.
-        output_filename (str): Full path where the PDF page will be saved.
+        reader (PdfReader): The reader of the source PDF.
+        start (int): Index of the first page of the range (0-indexed).
+        end (int): Index after the last page of the range.
+        output_filename (str): Full path where the PDF will be saved.
     """
     writer = PdfWriter()
-    writer.add_page(page)
+    for page_index in range(start, end):
+        writer.add_page(reader.pages[page_index])
     with open(output_filename, 'wb') as output_pdf:
         writer.write(output_pdf)
 
 
-def split_pdf_into_pages(pdf_path):
+def get_bundle_filename(isbn, start, end):
+    """
+    Names the file of a page range with 1-indexed page numbers: '{isbn}_{page}.pdf' for a single page,
+    '{isbn}_{first}-{last}.pdf' otherwise.
+    """
+    if end - start == 1:
+        return f"{isbn}_{start + 1}.pdf"
+    return f"{isbn}_{start + 1}-{end}.pdf"
+
+
+def read_pdf_bytes(pdf_path):
+    with open(pdf_path, 'rb') as pdf_file:
+        return pdf_file.read()
+
+
+def split_pdf_into_bundles(pdf_path, bundles, output_folder, workers=4, pdf_bytes=None, reader=None):
+    """
+    Splits a PDF into one file per page range, writing the files from a thread pool.
+
+    The source file is read from disk once. Each thread parses it with its own PdfReader, because pypdf
+    readers are not safe to share between threads; a reader the caller already parsed is used by the first thread.
+
+    Args:
+        pdf_path (str): The path to the PDF file to be processed.
+        bundles (list): (start, end) page ranges, 0-indexed with end excluded, as used by get_chapter.
+        output_folder (str): Directory where the files are saved.
+        workers (int): Number of threads writing files.
+        pdf_bytes (bytes): The contents of the PDF file, when the caller already read them.
+        reader (PdfReader): A reader of pdf_bytes the caller no longer uses.
+
+    Returns:
+        list: The paths of the written files, in bundle order.
+    """
+    isbn = os.path.basename(pdf_path).split('.')[0]
+    pdf_bytes = pdf_bytes if pdf_bytes is not None else read_pdf_bytes(pdf_path)
+    thread_state = threading.local()
+    spare_readers = queue.SimpleQueue()
+    if reader is not None:
+        spare_readers.put(reader)
+
+    def write_bundle(bundle):
+        start, end = bundle
+        if not hasattr(thread_state, 'reader'):
+            try:
+                thread_state.reader = spare_readers.get_nowait()
+            except queue.Empty:
+                thread_state.reader = PdfReader(io.BytesIO(pdf_bytes))
+        output_filename = os.path.join(output_folder, get_bundle_filename(isbn, start, end))
+        save_pages_as_pdf(thread_state.reader, start, end, output_filename)
+        return output_filename
+
+    bundles = [(int(start), int(end)) for start, end in bundles if int(end) > int(start)]
+    written = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, output_filename in enumerate(executor.map(write_bundle, bundles)):
+            written.append(output_filename)
+            logging.info(f"Bundle {index + 1}/{len(bundles)} saved to {output_filename}")
+    return written
+
+
+def split_pdf_into_pages(pdf_path, data_path='data', workers=4):
     """
     Splits a given PDF file into individual pages and saves each as a separate PDF file.
 
     Args:
         pdf_path (str): The path to the PDF file to be processed.
+        data_path (str): The directory in which the '{isbn}_pages' folder is created.
+        workers (int): Number of threads writing files.
     """
     isbn = os.path.basename(pdf_path).split('.')[0]
-    output_folder = create_output_folder(isbn)
+    output_folder = create_output_folder(isbn, data_path)
+
+    # The reader that counts the pages is handed over to the first writing thread rather than parsed again.
+    pdf_bytes = read_pdf_bytes(pdf_path)
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    bundles = [(page_number, page_number + 1) for page_number in range(len(reader.pages))]
+    return split_pdf_into_bundles(pdf_path, bundles, output_folder, workers, pdf_bytes, reader)
 
-    reader = PdfReader(pdf_path)
-    number_of_pages = len(reader.pages)
 
-    for page_number in range(number_of_pages):
-        output_filename = os.path.join(output_folder, f"{isbn}_{page_number + 1}.pdf")
-        save_page_as_pdf(reader.pages[page_number], output_filename)
+def get_chapter_page_ranges(pdf_path):
+    """
+    Computes the page ranges of the chapters extracted by create_chapter_payloads_from_pdf, from the
+    outline stored in the page cache.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
 
-        logging.info(f"Page {page_number + 1}/{number_of_pages} saved to {output_filename}")
+    Returns:
+        list: (start, end) page ranges, one per chapter.
+    """
+    from create_chapter_payloads_from_pdf import build_outline_index, construct_start_and_end_arrays
+    from page_cache import stream_page_cache
 
+    # Only the cache header (outline and page count) is needed, so no page text is extracted here.
+    page_cache = stream_page_cache(pdf_path)
+    outline_index = build_outline_index(page_cache['outline'], page_cache['page_count'], use_labels=True)
+    splits = construct_start_and_end_arrays(outline_index['split_at_pages'])
+    return [(int(start), int(end)) for start, end in splits[1:]]
 
-def create_individual_pdf_pages(pdf_file_path):
+
+def split_pdf_into_chapters(pdf_path, data_path='data', workers=4):
+    """
+    Splits a PDF into one file per chapter, using the same page ranges as the chapter payloads.
+
+    Args:
+        pdf_path (str): The path to the PDF file to be processed.
+        data_path (str): The directory in which the '{isbn}_chapters' folder is created.
+        workers (int): Number of threads writing files.
+    """
+    isbn = os.path.basename(pdf_path).split('.')[0]
+    output_folder = f"{data_path}/{isbn}_chapters"
+    os.makedirs(output_folder, exist_ok=True)
+    return split_pdf_into_bundles(pdf_path, get_chapter_page_ranges(pdf_path), output_folder, workers)
+
+
+def create_individual_pdf_pages(pdf_file_path, data_path='data', workers=4):
     """
     Processes a PDF file by reading it, splitting into pages, and saving those pages as individual PDF files.
     This is the main driver function that utilizes other functions to decompose a PDF into its constituent pages.
 
     Args:
         pdf_file_path (str): The path to the PDF file to be processed.
+        data_path (str): The directory in which the '{isbn}_pages' folder is created.
+        workers (int): Number of threads writing files.
+
+    Returns:
+        list: The paths of the written files, or None on failure.
     """
     try:
-        split_pdf_into_pages(pdf_file_path)
+        written = split_pdf_into_pages(pdf_file_path, data_path, workers)
         logging.info("PDF has been split and individual pages have been saved successfully.")
+        return written
     except Exception as e:
         logging.error(f"Error during PDF page splitting: {e}")
+        return None
 
 
 if __name__ == "__main__":
@@ -79,9 +192,13 @@ if __name__ == "__main__":
     isbn = '9354990517'
     data_path = 'data'
     pdf_path = f'{data_path}/{isbn}.pdf'
+    split_by_chapter = False  # Set to True to write one PDF per chapter instead of one per page.
+    workers = 4  # Threads writing the output files.
     try:
-        create_individual_pdf_pages(pdf_path)
+        if split_by_chapter:
+            split_pdf_into_chapters(pdf_path, data_path, workers)
+        else:
+            create_individual_pdf_pages(pdf_path, data_path, workers)
         logging.info("Successfully created individual PDF pages.")
     except Exception as e:
         logging.error(f"An error occurred while processing the PDF: {e}")
-
@@ -1,14 +1,34 @@
-import time
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException, NoSuchElementException
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from goodreads_lists import GOODREADS_BASE_URL, get_month_csv_path, get_month_url, is_month_scraped, write_books_csv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Selenium is imported by the functions driving the browser, so importing this module (e.g. for the CSV helpers
+# or from the CLI) does not pay for it. Locators use the string values of selenium's By constants.
+BOOK_SELECTOR = ("css selector", "article.BookListItem")
+SHOW_MORE_SELECTOR = ("xpath", "//button[contains(@class, 'Button--small')]"
+                               "//span[contains(text(), 'Show more books')]/..")
+
+# Seconds to wait for the first books of a page, and for new books to appear after a 'Show more books' click.
+PAGE_LOAD_TIMEOUT = 15
+SHOW_MORE_TIMEOUT = 10
+# Clicks intercepted by a popup are retried after clicking in empty space, at most this many times per page.
+MAX_INTERCEPTED_CLICKS = 3
+
+
+class IncompleteBookListError(RuntimeError):
+    """
+    Raised when the list of a month could not be loaded in full: no books appeared, or 'Show more books' stopped
+    loading them. No CSV is written for the month, so a resumed run retries it.
+    """
 
 
 def setup_driver():
+    from selenium import webdriver
+
     # Set up the Selenium WebDriver
     options = webdriver.ChromeOptions()
     options.add_argument('--headless')  # Comment this if you don't want to run Chrome in headless mode
@@ -16,93 +36,237 @@ def setup_driver():
     return driver
 
 
+class BrowserPool:
+    """
+    A bounded pool of browser sessions shared by scraping threads. Sessions are started on first use, up to size,
+    and reused afterwards; a session that failed is discarded and replaced on the next acquire.
+
+    Args:
+        size (int): The maximum number of browser sessions.
+        driver_factory (callable): Starts a session, setup_driver by default.
+    """
+
+    def __init__(self, size, driver_factory=setup_driver):
+        self.size = size
+        self.driver_factory = driver_factory
+        self.idle_drivers = queue.Queue()
+        self.slots = queue.Queue()
+        for _ in range(size):
+            self.slots.put(None)
+        self.drivers = []
+
+    @contextmanager
+    def acquire(self):
+        self.slots.get()
+        driver = None
+        healthy = False
+        try:
+            try:
+                driver = self.idle_drivers.get_nowait()
+            except queue.Empty:
+                driver = self.driver_factory()
+                self.drivers.append(driver)
+            yield driver
+            healthy = True
+        finally:
+            if driver is not None:
+                if healthy:
+                    self.idle_drivers.put(driver)
+                else:
+                    self.quit_driver(driver)
+            self.slots.put(None)
+
+    def quit_driver(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Failed to quit browser session: {e}")
+        if driver in self.drivers:
+            self.drivers.remove(driver)
+
+    def close(self):
+        for driver in list(self.drivers):
+            self.quit_driver(driver)
+
+
 def click_in_empty_space(driver):
     """
     Try to click in an empty space on the page to dismiss any unexpected overlays or popups.
     """
+    from selenium.webdriver import ActionChains
+
     try:
         # Clicking at a position that's generally empty to avoid popups
         ActionChains(driver).move_by_offset(10, 10).click().perform()
-        print("Clicked in empty space to avoid popups.")
+        logging.info("Clicked in empty space to avoid popups.")
     except Exception as e:
-        print(f"Failed to click in empty space: {e}")
+        logging.warning(f"Failed to click in empty space: {e}")
+
 
+def count_books(driver):
+    return len(driver.find_elements(*BOOK_SELECTOR))
+
+
+def load_full_page(driver, url, page_load_timeout=PAGE_LOAD_TIMEOUT, show_more_timeout=SHOW_MORE_TIMEOUT):
+    """
+    Opens a list page and clicks 'Show more books' until every book is loaded. Instead of fixed pauses, each
+    step waits for a condition: the first books to be present, then after each click for more books to appear,
+    so a fast page moves on at once and a slow one gets up to the timeout.
+
+    Returns:
+        int: The number of books loaded on the page.
+
+    Raises:
+        IncompleteBookListError: When no books appear, when a click on 'Show more books' loads nothing new,
+            or when popups keep intercepting the clicks.
+    """
+    from selenium.common.exceptions import ElementClickInterceptedException, NoSuchElementException, TimeoutException
+    from selenium.webdriver import ActionChains
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
 
-def load_full_page(driver, url):
     driver.get(url)
-    time.sleep(2)  # Wait for the initial page elements to load
     try:
-        while True:
-            show_more = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'Button--small')]"
-                                                      "//span[contains(text(), 'Show more books')]/.."))
-            )
-            ActionChains(driver).move_to_element(show_more).click().perform()
-            time.sleep(1)
-    except TimeoutException as e:
-        # Handle the case where the 'Show more books' button is no longer present or another timeout scenario
-        if e.args:
-            print(f"Finished loading all books or cannot click 'Show more': {e.args[0].splitlines()[0]}")
-        else:
-            print("Finished loading all books or cannot click 'Show more': No additional information available.")
-    except ElementClickInterceptedException:
-        # If clicking fails due to an intercepted click, click in an empty space and retry
-        click_in_empty_space(driver)
+        WebDriverWait(driver, page_load_timeout).until(EC.presence_of_element_located(BOOK_SELECTOR))
+    except TimeoutException:
+        raise IncompleteBookListError(f"No books found on {url}")
+
+    intercepted_clicks = 0
+    while True:
+        book_count = count_books(driver)
+        try:
+            show_more = WebDriverWait(driver, show_more_timeout).until(EC.element_to_be_clickable(SHOW_MORE_SELECTOR))
+        except TimeoutException:
+            # The 'Show more books' button is gone: every book is on the page
+            break
         try:
-            show_more = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'Button--small')]"
-                                                      "//span[contains(text(), 'Show more books')]/.."))
-            )
             ActionChains(driver).move_to_element(show_more).click().perform()
-        except (TimeoutException, NoSuchElementException, ElementClickInterceptedException) as e:
-            print(f"Could not find or click on 'Show more books' button after attempting to clear popups: {str(e)}")
+            WebDriverWait(driver, show_more_timeout).until(lambda d: count_books(d) > book_count)
+        except TimeoutException:
+            raise IncompleteBookListError(f"'Show more books' of {url} stopped loading books after {book_count}")
+        except (ElementClickInterceptedException, NoSuchElementException) as e:
+            # If clicking fails due to an intercepted click, click in an empty space and retry
+            intercepted_clicks += 1
+            if intercepted_clicks > MAX_INTERCEPTED_CLICKS:
+                raise IncompleteBookListError(f"Could not click on 'Show more books' of {url} after clearing "
+                                              f"popups: {e}")
+            click_in_empty_space(driver)
+    book_count = count_books(driver)
+    logging.info(f"Finished loading all books of {url}: {book_count} books")
+    return book_count
 
 
 def extract_books_data(driver):
     books = []
-    elements = driver.find_elements(By.CSS_SELECTOR, "article.BookListItem")
+    elements = driver.find_elements(*BOOK_SELECTOR)
     for element in elements:
         try:
-            rank = element.find_element(By.CSS_SELECTOR, ".BookListItemRank h2").text.strip('#')
-            title = element.find_element(By.CSS_SELECTOR, ".BookListItem__title h3 a").text
-            author = element.find_element(By.CSS_SELECTOR, ".ContributorLink__name").text
-            rating = element.find_element(By.CSS_SELECTOR, ".AverageRating__ratingValue").text
+            rank = element.find_element("css selector", ".BookListItemRank h2").text.strip('#')
+            title = element.find_element("css selector", ".BookListItem__title h3 a").text
+            author = element.find_element("css selector", ".ContributorLink__name").text
+            rating = element.find_element("css selector", ".AverageRating__ratingValue").text
             books.append([rank, title, author, rating])
         except Exception as e:
-            print(f"Failed to extract data for one book: {e}")
+            logging.warning(f"Failed to extract data for one book: {e}")
     return books
 
 
 def save_to_csv(books, filename):
     """
-    Save the extracted books data to a CSV file.
+    Save the extracted books data to a CSV file (see goodreads_lists.write_books_csv).
+    """
+    write_books_csv(books, filename)
+
+
+def scrape_month(driver, year, month, data_path='data', base_url=GOODREADS_BASE_URL):
+    """
+    Loads the full list of a month in a browser session and saves its books to goodreads_books_{year}_{month}.csv.
+
+    Returns:
+        int: The number of books saved.
+
+    Raises:
+        IncompleteBookListError: When the list was not loaded in full or some of its books could not be read,
+            in which case no CSV is written.
     """
-    df = pd.DataFrame(books, columns=['Ranking', 'Title', 'Author', 'Average Rating'])
-    df.to_csv(filename, index=False)
-    print(f"Data saved to {filename}")
+    url = get_month_url(year, month, base_url)
+    logging.info(f"Processing {url}")
+    book_count = load_full_page(driver, url)
+    books = extract_books_data(driver)
+    if len(books) < book_count:
+        raise IncompleteBookListError(f"Read {len(books)} of the {book_count} books of {url}")
+    save_to_csv(books, get_month_csv_path(year, month, data_path))
+    return len(books)
 
 
-def get_goodreads_books_by(year, months):
+def get_goodreads_books_by(year, months, data_path='data', base_url=GOODREADS_BASE_URL):
     """
-    Main function to extract books data for a given year and months.
+    Main function to extract books data for a given year and months, one month after the other in a single browser.
     """
     driver = setup_driver()
-    for month in months:
-        url = f"https://www.goodreads.com/book/popular_by_date/{year}/{month}"
-        print(f"Processing {url}")
-        load_full_page(driver, url)
-        books = extract_books_data(driver)
-        data_path = 'data'
-        save_to_csv(books, f"{data_path}/goodreads_books_{year}_{month}.csv")
-    driver.quit()
+    try:
+        for month in months:
+            scrape_month(driver, year, month, data_path, base_url)
+    finally:
+        driver.quit()
+
+
+def get_goodreads_books_concurrently(years, months, workers=3, data_path='data', base_url=GOODREADS_BASE_URL,
+                                     resume=True, driver_factory=setup_driver):
+    """
+    Extracts the books of every month of the given years, scraping several months at once with a bounded pool
+    of browser sessions.
+
+    Args:
+        years (list): The years to scrape.
+        months (list): The months to scrape in each year.
+        workers (int): The number of months scraped at once, and of browser sessions.
+        data_path (str): Directory of the goodreads_books_{year}_{month}.csv files.
+        base_url (str): The Goodreads root URL; point it at a local server to run against HTML fixtures.
+        resume (bool): Whether to skip the months whose CSV file already exists.
+        driver_factory (callable): Starts a browser session, setup_driver by default.
+
+    Returns:
+        dict: The number of books saved per (year, month), and the months skipped or failed. Failed months,
+        including those whose list did not load in full, have no CSV, so a resumed run retries them.
+    """
+    periods = [(year, month) for year in years for month in months]
+    skipped = [period for period in periods if resume and is_month_scraped(*period, data_path)]
+    pending = [period for period in periods if period not in skipped]
+    logging.info(f"Scraping {len(pending)} months with {workers} browser sessions ({len(skipped)} already scraped)")
+
+    summary = {'books': {}, 'skipped': skipped, 'failed': []}
+    pool = BrowserPool(workers, driver_factory)
+
+    def scrape(period):
+        with pool.acquire() as driver:
+            return scrape_month(driver, *period, data_path, base_url)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(scrape, period): period for period in pending}
+            for future in as_completed(futures):
+                period = futures[future]
+                try:
+                    summary['books'][period] = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to scrape {get_month_url(*period, base_url)}: {e}")
+                    summary['failed'].append(period)
+    finally:
+        pool.close()
+    return summary
 
 
 if __name__ == "__main__":
 
-    year = 2023
+    years = [2023]
     # Set 'months' to a specific list of months, example:
     # months = [2, 3, 4] to process February, March, and April or
     # months = list(range(1, 13)) to process the Full Year.
     months = list(range(1, 13))
-    get_goodreads_books_by(year, months)
-
+    workers = 3  # Browser sessions scraping months at once.
+    resume = True  # Skip the months whose goodreads_books_{year}_{month}.csv already exists.
+    # To run against local HTML fixtures, serve them with `python -m http.server 8000 -d data/goodreads_fixtures`
+    # and set base_url = 'http://localhost:8000'.
+    base_url = GOODREADS_BASE_URL
+    get_goodreads_books_concurrently(years, months, workers, base_url=base_url, resume=resume)
@@ -0,0 +1,467 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from create_chapter_payloads_from_pdf import iter_chapter_payloads_from_pdf
+from create_page_splits_from_pdf import iter_pdf_page_data
+from fluff_classifier import FLUFF_RULE_SETS, get_fluff_classifier
+from jsonl_output import write_jsonl_file
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A local extraction service: one long-running process accepting PDF paths or uploads over HTTP, and running
+# chapter and page extractions on a pool of warm worker processes (modules imported and fluff rules compiled once).
+#
+#   POST /chapters   {"pdf_path": ..., "isbn": ..., "chunk_size": ...}, or a PDF upload (Content-Type:
+#                    application/pdf, ?isbn=...). Streams the chapters as JSON lines while they are extracted.
+#   POST /pages      Same for the page metadata of create_page_splits_from_pdf.
+#   GET  /stats      Queue depth, running jobs, counts and latency percentiles.
+#
+# Workers write the records of a job to a spool file line by line (jsonl_output flushes each line), and the service
+# streams new lines to the client as they appear, ending with a {"job": {...}} status line. Jobs wait in a bounded
+# queue; when it is full the request is rejected with 503 and Retry-After, so callers slow down instead of piling up.
+# Uploads are streamed to a file in the spool directory as they arrive, and bodies over their limit get 413. A job
+# running longer than JOB_TIMEOUT_SECONDS fails: the worker interrupts it, and the service stops waiting for it.
+
+JOB_KINDS = ('chapters', 'pages')
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+MAX_JSON_BYTES = 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+JOB_TIMEOUT_SECONDS = 600
+# Time the service waits past the timeout for the worker to interrupt the job itself.
+JOB_TIMEOUT_GRACE_SECONDS = 5
+STREAM_POLL_INTERVAL = 0.05
+LATENCY_WINDOW = 1000  # latest jobs kept per kind for the percentiles
+LATENCY_PERCENTILES = (50, 90, 99)
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def warm_worker():
+    """
+    Runs once in each worker process: compiles the fluff rules of every language, any of which a book may be
+    detected in, so the first job does not pay for it.
+    """
+    for language in FLUFF_RULE_SETS:
+        get_fluff_classifier([language])
+
+
+class RequestTooLargeError(ValueError):
+    pass
+
+
+# A BaseException, like KeyboardInterrupt, so that the broad exception handlers of the extraction code let it through.
+class JobTimeoutError(BaseException):
+    pass
+
+
+def raise_job_timeout(signum, frame):
+    raise JobTimeoutError('Job timed out')
+
+
+def run_job(kind, isbn, pdf_path, spool_path, options, timeout=JOB_TIMEOUT_SECONDS):
+    """
+    Worker entry point: runs a job of the given kind, interrupted by JobTimeoutError after timeout seconds where
+    the platform has SIGALRM, so the worker is free for the next job.
+    """
+    if not timeout or not hasattr(signal, 'SIGALRM'):
+        return JOB_RUNNERS[kind](isbn, pdf_path, spool_path, options)
+    signal.signal(signal.SIGALRM, raise_job_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return JOB_RUNNERS[kind](isbn, pdf_path, spool_path, options)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def run_chapter_job(isbn, pdf_path, spool_path, options):
+    """
+    Worker entry point: extracts the chapters of a PDF into the spool file, one JSON line per chapter.
+    """
+    return write_jsonl_file(iter_chapter_payloads_from_pdf(isbn, pdf_path, **options), spool_path)
+
+
+def run_page_job(isbn, pdf_path, spool_path, options):
+    """
+    Worker entry point: extracts the page metadata of a PDF into the spool file, one JSON line per page.
+    """
+    return write_jsonl_file(iter_pdf_page_data(pdf_path, isbn, **options), spool_path)
+
+
+JOB_RUNNERS = {'chapters': run_chapter_job, 'pages': run_page_job}
+
+
+def compute_percentiles(values, percentiles=LATENCY_PERCENTILES):
+    """
+    Returns the nearest-rank percentiles of values, e.g. {'p50': ..., 'p99': ...}, or None when there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {f"p{percentile}": round(ordered[min(len(ordered) - 1, max(0, -(-percentile * len(ordered) // 100) - 1))], 4)
+            for percentile in percentiles}
+
+
+class ExtractionJob:
+    def __init__(self, kind, isbn, pdf_path, spool_path, options, upload_path=None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.isbn = isbn
+        self.pdf_path = pdf_path
+        self.spool_path = spool_path
+        self.options = options
+        self.upload_path = upload_path
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.record_count = None
+        self.error = None
+        self.done = asyncio.Event()
+
+    def describe(self):
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'isbn': self.isbn,
+            'status': 'failed' if self.error else 'done',
+            'records': self.record_count,
+            'error': self.error,
+            'queue_seconds': round(self.started_at - self.queued_at, 4) if self.started_at else None,
+            'total_seconds': round(self.finished_at - self.queued_at, 4) if self.finished_at else None
+        }
+
+
+class ExtractionService:
+    """
+    Schedules extraction jobs on a warm process pool through a bounded queue, and serves them over HTTP.
+
+    Args:
+        workers (int): Worker processes, and jobs running at once.
+        max_queue (int): Jobs waiting for a worker before new requests are rejected.
+        spool_directory (str): Directory of the spool files and uploads of running jobs.
+        job_timeout (float): Seconds after which a job fails; None lets jobs run to the end.
+    """
+
+    def __init__(self, workers=None, max_queue=64, spool_directory=os.path.join('data', '.service_spool'),
+                 job_timeout=JOB_TIMEOUT_SECONDS):
+        self.workers = workers or os.cpu_count() or 1
+        self.job_timeout = job_timeout
+        self.queue = asyncio.Queue(max_queue)
+        self.spool_directory = spool_directory
+        self.executor = None
+        self.dispatchers = []
+        self.running = 0
+        self.counts = {'accepted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self.latencies = {kind: {'queue': deque(maxlen=LATENCY_WINDOW), 'total': deque(maxlen=LATENCY_WINDOW)}
+                          for kind in JOB_KINDS}
+
+    def create_executor(self):
+        # Workers forked from the service would inherit its open client sockets, and a pool replaced while serving
+        # would then keep connections open after the service closed them. The fork server is started with the first
+        # pool, before any connection, and forks clean workers.
+        context = multiprocessing.get_context('forkserver') \
+            if 'forkserver' in multiprocessing.get_all_start_methods() else None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=warm_worker)
+
+    def replace_broken_executor(self, executor):
+        """
+        Replaces the pool after a worker process died (killed, out of memory...), which breaks the whole pool and
+        fails every job running on it. The dispatchers sharing the broken pool replace it only once.
+        """
+        if self.executor is executor:
+            logging.warning("A worker process died, restarting the worker pool")
+            executor.shutdown(wait=False)
+            self.executor = self.create_executor()
+
+    async def start(self):
+        os.makedirs(self.spool_directory, exist_ok=True)
+        self.executor = self.create_executor()
+        loop = asyncio.get_running_loop()
+        # Start every worker process now rather than on the first requests.
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm_worker) for _ in range(self.workers)))
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        logging.info(f"Extraction service ready with {self.workers} warm workers")
+
+    async def stop(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def submit(self, kind, isbn, pdf_path, options, upload_path=None):
+        """
+        Queues a job. Raises asyncio.QueueFull when the queue is full.
+        """
+        job = ExtractionJob(kind, isbn, pdf_path, os.path.join(self.spool_directory, f"{uuid.uuid4().hex}.jsonl"),
+                            options, upload_path)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counts['rejected'] += 1
+            raise
+        self.counts['accepted'] += 1
+        return job
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job.started_at = time.perf_counter()
+            self.running += 1
+            executor = self.executor
+            try:
+                job.record_count = await asyncio.wait_for(
+                    loop.run_in_executor(executor, run_job, job.kind, job.isbn, job.pdf_path, job.spool_path,
+                                         job.options, self.job_timeout),
+                    self.job_timeout + JOB_TIMEOUT_GRACE_SECONDS if self.job_timeout else None)
+                self.counts['completed'] += 1
+            except (JobTimeoutError, asyncio.TimeoutError):
+                # On asyncio.TimeoutError the worker did not interrupt the job (stuck outside Python code) and
+                # stays busy with it; the next jobs wait for a free worker inside the pool.
+                logging.error(f"Job {job.job_id} ({job.kind} of {job.pdf_path}) timed out after {self.job_timeout}s")
+                job.error = f"Timed out after {self.job_timeout} seconds"
+                self.counts['failed'] += 1
+                self.counts['timed_out'] += 1
+            except BrokenProcessPool as e:
+                logging.error(f"Job {job.job_id} ({job.kind} of {job.pdf_path}) failed, its worker died: {e}")
+                job.error = f"Worker process died: {e}"
+                self.counts['failed'] += 1
+                self.replace_broken_executor(executor)
+            except Exception as e:
+                logging.error(f"Job {job.job_id} ({job.kind} of {job.pdf_path}) failed: {e}")
+                job.error = str(e)
+                self.counts['failed'] += 1
+            finally:
+                self.running -= 1
+                job.finished_at = time.perf_counter()
+                self.latencies[job.kind]['queue'].append(job.started_at - job.queued_at)
+                self.latencies[job.kind]['total'].append(job.finished_at - job.queued_at)
+                job.done.set()
+                self.queue.task_done()
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize(),
+            'max_queue': self.queue.maxsize,
+            'running': self.running,
+            **self.counts,
+            'latency_seconds': {kind: {name: compute_percentiles(values) for name, values in latencies.items()}
+                                for kind, latencies in self.latencies.items()}
+        }
+
+    async def stream_job(self, job, writer):
+        """
+        Sends the lines of the job's spool file as they are written, then its status line.
+        """
+        position = 0
+        pending = b''
+        try:
+            while True:
+                finished = job.done.is_set()
+                if os.path.exists(job.spool_path):
+                    with open(job.spool_path, 'rb') as spool:
+                        spool.seek(position)
+                        data = spool.read()
+                    position += len(data)
+                    *lines, pending = (pending + data).split(b'\n')
+                    if lines:
+                        await write_chunk(writer, b'\n'.join(lines) + b'\n')
+                if finished:
+                    break
+                try:
+                    await asyncio.wait_for(job.done.wait(), STREAM_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            await write_chunk(writer, json.dumps({'job': job.describe()}).encode('utf-8') + b'\n')
+            await write_chunk(writer, b'')
+        finally:
+            await job.done.wait()  # the worker may still be writing if the client went away
+            for path in (job.spool_path, job.upload_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+            method, target, headers = request
+            url = urlsplit(target)
+            kind = url.path.strip('/')
+            if url.path == '/stats':
+                await send_json(writer, 200, self.get_stats())
+            elif kind not in JOB_KINDS:
+                await send_json(writer, 404, {'error': f"Unknown endpoint {url.path}"})
+            elif method != 'POST':
+                await send_json(writer, 405, {'error': 'Use POST'})
+            else:
+                await self.handle_job_request(kind, url, headers, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except RequestTooLargeError as e:
+            await send_json(writer, 413, {'error': str(e)})
+        except ValueError as e:
+            await send_json(writer, 400, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Error handling request: {e}")
+            try:
+                await send_json(writer, 500, {'error': 'Internal error'})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def handle_job_request(self, kind, url, headers, reader, writer):
+        upload_path = None
+        if headers.get('content-type', '').startswith('application/pdf'):
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            upload_path = os.path.join(self.spool_directory, f"{uuid.uuid4().hex}.pdf")
+            await receive_upload(reader, get_content_length(headers, MAX_UPLOAD_BYTES), upload_path)
+            pdf_path = upload_path
+            isbn = query.get('isbn') or 'upload'
+            options = {}
+        else:
+            length = get_content_length(headers, MAX_JSON_BYTES)
+            body = await reader.readexactly(length) if length else b''
+            payload = json.loads(body or b'{}')
+            if not isinstance(payload, dict):
+                raise ValueError('Expected a JSON object')
+            pdf_path = payload.get('pdf_path')
+            if not isinstance(pdf_path, str) or not os.path.isfile(pdf_path):
+                raise ValueError(f"No PDF at {pdf_path!r}")
+            isbn = payload.get('isbn') or os.path.basename(pdf_path).split('.')[0]
+            option_names = ('chunk_size', 'chunk_overlap', 'chunk_unit') if kind == 'chapters' \
+                else ('include_image_details',)
+            options = {name: payload[name] for name in option_names if name in payload}
+
+        try:
+            job = self.submit(kind, isbn, pdf_path, options, upload_path)
+        except asyncio.QueueFull:
+            if upload_path:
+                os.remove(upload_path)
+            await send_json(writer, 503, {'error': 'Queue full', 'queue_depth': self.queue.qsize()},
+                            {'Retry-After': '1'})
+            return
+        writer.write(format_head(200, {'Content-Type': 'application/x-ndjson', 'Transfer-Encoding': 'chunked',
+                                       'X-Job-Id': job.job_id}))
+        try:
+            await self.stream_job(job, writer)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The 200 head is already sent: the client sees the chunked body cut short instead of a 500.
+            logging.error(f"Error streaming job {job.job_id}: {e}")
+
+
+async def read_request(reader):
+    """
+    Reads the head of one HTTP/1.1 request, leaving its body in the reader.
+
+    Returns:
+        tuple: The method, the target and the headers (lower-case names), or None on an empty connection.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise ValueError('Malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+def get_content_length(headers, limit):
+    """
+    Returns the body length of a request, raising RequestTooLargeError when it is over limit bytes.
+    """
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise ValueError('Malformed Content-Length')
+    if length > limit:
+        raise RequestTooLargeError(f"Request body larger than {limit} bytes")
+    return length
+
+
+async def receive_upload(reader, length, upload_path):
+    """
+    Streams a request body of length bytes to upload_path, UPLOAD_CHUNK_BYTES at a time. A partial file is
+    removed when the client goes away.
+    """
+    try:
+        with open(upload_path, 'wb') as upload:
+            while length:
+                chunk = await reader.readexactly(min(length, UPLOAD_CHUNK_BYTES))
+                upload.write(chunk)
+                length -= len(chunk)
+    except BaseException:
+        os.remove(upload_path)
+        raise
+
+
+def format_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}", 'Connection: close']
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send_json(writer, status, payload, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(format_head(status, {'Content-Type': 'application/json', 'Content-Length': str(len(body)),
+                                      **(headers or {})}) + body)
+    await writer.drain()
+
+
+async def write_chunk(writer, data):
+    writer.write(f"{len(data):X}\r\n".encode('latin-1') + data + b'\r\n')
+    await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8080, workers=None, max_queue=64):
+    """
+    Runs the extraction service until cancelled.
+    """
+    service = ExtractionService(workers, max_queue)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    logging.info(f"Listening on http://{host}:{port} (POST /chapters, POST /pages, GET /stats)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == "__main__":
+    # This script runs the extraction service. Example requests:
+    #   curl -N -d '{"pdf_path": "data/9354990517.pdf"}' http://127.0.0.1:8080/chapters
+    #   curl -N -H 'Content-Type: application/pdf' --data-binary @data/9354990517.pdf \
+    #       'http://127.0.0.1:8080/pages?isbn=9354990517'
+    #   curl http://127.0.0.1:8080/stats
+    host = '127.0.0.1'
+    port = 8080
+    workers = os.cpu_count() or 1  # Warm worker processes, i.e. extractions running at once.
+    max_queue = 64  # Jobs waiting for a worker before requests are rejected with 503.
+
+    try:
+        asyncio.run(serve(host, port, workers, max_queue))
+    except KeyboardInterrupt:
+        logging.info("Extraction service stopped")
@@ -0,0 +1,353 @@
+import hashlib
+import json
+import logging
+import re
+
+# Rule sets per language. 'keep' phrases mark real chapters, which are never filtered (matched anywhere in the
+# name, so 'Chapter1' counts). 'exclude' phrases are grouped by the reason code reported when they match, and
+# only match whole words, optionally in the plural: 'author' matches 'About the Authors' but not 'The Authority'.
+FLUFF_RULE_SETS = {
+    'en': {
+        'keep': ['chapter'],
+        'exclude': {
+            'front_matter': ['copyright', 'cover', 'title page', 'table of contents', "author's note", 'note on',
+                             "publisher's note", 'list of collaborators'],
+            'back_matter': ['acknowledgement', 'acknowledgment', 'reference', 'appendix', 'bibliography', 'glossary',
+                            'notes', 'thanks', 'index', 'resources', 'sources', 'further readings',
+                            'illustration credits', 'photo insert', 'about the author', 'author'],
+            'promotional': ['praise for', 'praise', 'penguin books', 'about the publisher']
+        }
+    },
+    'fr': {
+        'keep': ['chapitre'],
+        'exclude': {
+            'front_matter': ['couverture', 'page de titre', 'table des matières', 'sommaire', "note de l'auteur",
+                             "note de l'éditeur", 'avertissement', 'dédicace', 'mentions légales'],
+            'back_matter': ['remerciement', 'bibliographie', 'glossaire', 'annexe', 'index', 'notes', 'références',
+                            'sources', "à propos de l'auteur", 'du même auteur', 'crédits photographiques'],
+            'promotional': ['éloges', 'dans la même collection', "à propos de l'éditeur"]
+        }
+    },
+    'es': {
+        'keep': ['capítulo', 'capitulo'],
+        'exclude': {
+            'front_matter': ['portada', 'créditos', 'índice', 'indice', 'nota del autor', 'nota del editor',
+                             'dedicatoria'],
+            'back_matter': ['agradecimiento', 'bibliografía', 'bibliografia', 'glosario', 'apéndice', 'apendice',
+                            'notas', 'referencias', 'fuentes', 'sobre el autor', 'acerca del autor'],
+            'promotional': ['elogios', 'otros títulos', 'sobre la editorial']
+        }
+    },
+    'de': {
+        'keep': ['kapitel'],
+        'exclude': {
+            'front_matter': ['impressum', 'inhaltsverzeichnis', 'inhalt', 'titelseite', 'widmung', 'vorbemerkung'],
+            'back_matter': ['danksagung', 'dank', 'literaturverzeichnis', 'bibliographie', 'glossar', 'anhang',
+                            'anmerkungen', 'personenregister', 'sachregister', 'quellen', 'über den autor',
+                            'über die autorin'],
+            'promotional': ['pressestimmen', 'lieferbare titel', 'über den verlag']
+        }
+    },
+    'it': {
+        'keep': ['capitolo'],
+        'exclude': {
+            'front_matter': ['copertina', 'frontespizio', 'indice', 'sommario', "nota dell'autore",
+                             "nota dell'editore", 'dedica'],
+            'back_matter': ['ringraziamenti', 'bibliografia', 'glossario', 'appendice', 'note al testo', 'fonti',
+                            "l'autore", "sull'autore"],
+            'promotional': ['dello stesso autore', "sull'editore"]
+        }
+    }
+}
+
+# Rule sets used when the language of a book is neither declared nor detected, and the value selecting all of them.
+# A union of languages is only used when asked for: 'dank' (de) excludes 'Dank Memes', 'portada' (es) and 'dedica'
+# (it) match English titles too.
+DEFAULT_LANGUAGE = 'en'
+ALL_LANGUAGES = 'all'
+
+# Frequent function words of each language, kept distinct across languages, from which detect_language counts votes.
+LANGUAGE_STOPWORDS = {
+    'en': ['the', 'and', 'of', 'to', 'is', 'that', 'with', 'was', 'for', 'his', 'her', 'you', 'are', 'this', 'have',
+           'not', 'but'],
+    'fr': ['le', 'les', 'et', 'des', 'est', 'une', 'dans', 'qui', 'pour', 'pas', 'sur', 'elle', 'du', 'au', 'avec',
+           'ce', 'mais'],
+    'es': ['el', 'los', 'las', 'y', 'por', 'para', 'pero', 'como', 'su', 'más', 'muy', 'está', 'también', 'ella',
+           'sus', 'hay'],
+    'de': ['der', 'die', 'das', 'und', 'ist', 'nicht', 'ein', 'eine', 'mit', 'sich', 'auf', 'für', 'dem', 'den', 'ich',
+           'auch'],
+    'it': ['il', 'gli', 'della', 'delle', 'che', 'non', 'sono', 'è', 'alla', 'nel', 'ma', 'anche', 'questo', 'molto',
+           'perché']
+}
+_STOPWORD_LANGUAGES = {word: language for language, words in LANGUAGE_STOPWORDS.items() for word in words}
+
+# Characters of chapter text sampled to detect the language of a book, and the stopwords needed to trust a guess.
+LANGUAGE_SAMPLE_CHARACTERS = 20_000
+MIN_LANGUAGE_STOPWORDS = 20
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+REASON_CHAPTER_NAME = 'chapter_name'
+REASON_TOO_SMALL = 'too_small'
+REASON_KEPT = 'kept'
+REASON_KEYWORD = 'keyword'  # reason code of custom exclude keywords, which are not grouped
+
+MIN_WORD_COUNT = 1000
+
+# Titles repeat a lot across a batch ('Acknowledgements', 'Index'...), so name decisions are memoized.
+NAME_CACHE_SIZE = 100_000
+
+
+def normalize_title(name):
+    """
+    Lower-cases a chapter name and normalizes apostrophes and whitespace, the form rules are matched against.
+    """
+    # str.split also breaks on non-breaking spaces; str.replace is much faster than str.translate with a table.
+    return ' '.join(name.casefold().split()).replace('’', "'").replace('‘', "'").replace('ʼ', "'")
+
+
+def resolve_languages(languages, rule_sets=None):
+    """
+    Returns the list of rule set keys selected by languages: DEFAULT_LANGUAGE when None, every rule set when
+    ALL_LANGUAGES is given (alone or in a list), a single key given as a string, or the keys as given.
+    """
+    rule_sets = rule_sets or FLUFF_RULE_SETS
+    if not languages:
+        return [DEFAULT_LANGUAGE]
+    if isinstance(languages, str):
+        languages = [languages]
+    if ALL_LANGUAGES in languages:
+        return list(rule_sets)
+    return list(languages)
+
+
+def detect_language(text, min_stopwords=MIN_LANGUAGE_STOPWORDS):
+    """
+    Guesses the language of a text from the stopwords of LANGUAGE_STOPWORDS it contains.
+
+    Args:
+        text (str): A sample of the text.
+        min_stopwords (int): The stopwords the most frequent language needs before it is trusted.
+
+    Returns:
+        str: The key of the detected language, or None when the sample is too small to tell.
+    """
+    votes = {}
+    for word in WORD_PATTERN.findall(text.casefold()):
+        language = _STOPWORD_LANGUAGES.get(word)
+        if language is not None:
+            votes[language] = votes.get(language, 0) + 1
+    if not votes:
+        return None
+    language = max(votes, key=votes.get)
+    return language if votes[language] >= min_stopwords else None
+
+
+def build_trie_pattern(phrases):
+    """
+    Builds a regular expression matching any of the phrases, factored as a prefix trie
+    ('note on|notes' becomes 'note(?: on|s)'). Python's re tries alternatives one after the other,
+    so a flat alternation costs time proportional to the number of rules at every position; the trie
+    only follows the branches matching the text, which keeps thousands of rules fast.
+
+    Args:
+        phrases (iterable): The literal phrases.
+
+    Returns:
+        str: The pattern, or None if there are no phrases.
+    """
+    trie = {}
+    for phrase in phrases:
+        if not phrase:
+            continue
+        node = trie
+        for character in phrase:
+            node = node.setdefault(character, {})
+        node[''] = True
+
+    def to_pattern(node):
+        terminal = '' in node
+        branches = [re.escape(character) + to_pattern(child)
+                    for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if terminal else body
+
+    return to_pattern(trie) if trie else None
+
+
+class FluffClassifier:
+    """
+    Decides which chapters are fluff (front matter, back matter, promotional pages, or chapters too small to
+    be worth sending), compiling every rule once into two trie-shaped regular expressions (keep and exclude).
+    Each decision comes with a reason code and the rule that matched.
+
+    Args:
+        languages (iterable): Keys of FLUFF_RULE_SETS to use, or ALL_LANGUAGES for all of them.
+            Defaults to DEFAULT_LANGUAGE.
+        exclude_keywords (list): Replaces the exclude phrases of the rule sets; matches get the 'keyword' reason.
+        min_word_count (int): Chapters with fewer words are excluded as too small.
+        rule_sets (dict): Rule sets to use instead of FLUFF_RULE_SETS.
+    """
+
+    def __init__(self, languages=None, exclude_keywords=None, min_word_count=MIN_WORD_COUNT, rule_sets=None):
+        rule_sets = rule_sets or FLUFF_RULE_SETS
+        languages = resolve_languages(languages, rule_sets)
+        unknown_languages = [language for language in languages if language not in rule_sets]
+        if unknown_languages:
+            raise ValueError(f"No fluff rules for languages {unknown_languages}")
+
+        keep_phrases = {normalize_title(phrase) for language in languages for phrase in rule_sets[language]['keep']}
+        self.languages = languages
+        self.keep_phrases = sorted(keep_phrases)
+        self.exclude_reasons = {}
+        if exclude_keywords is not None:
+            for keyword in exclude_keywords:
+                self.exclude_reasons.setdefault(normalize_title(keyword), REASON_KEYWORD)
+        else:
+            for language in languages:
+                for reason, phrases in rule_sets[language]['exclude'].items():
+                    for phrase in phrases:
+                        self.exclude_reasons.setdefault(normalize_title(phrase), reason)
+
+        keep_pattern = build_trie_pattern(keep_phrases)
+        exclude_pattern = build_trie_pattern(self.exclude_reasons)
+        self.keep_pattern = re.compile(keep_pattern) if keep_pattern else None
+        # The phrase is captured alone, so the match maps back to its reason without stripping the plural.
+        self.exclude_pattern = re.compile(rf"(?<!\w)({exclude_pattern})(?:e?s)?(?!\w)") if exclude_pattern else None
+        self.min_word_count = min_word_count
+        self.name_cache = {}
+
+    def describe_rules(self):
+        """
+        Returns the effective rules of the classifier as a JSON-serializable dictionary.
+        """
+        return {'languages': self.languages, 'keep': self.keep_phrases,
+                'exclude': dict(sorted(self.exclude_reasons.items())), 'min_word_count': self.min_word_count}
+
+    def classify_name(self, name):
+        """
+        Classifies a chapter from its name alone.
+
+        Args:
+            name (str): The chapter name.
+
+        Returns:
+            tuple: (excluded, reason, rule). excluded is None when the name alone does not decide,
+            in which case the chapter size does.
+        """
+        decision = self.name_cache.get(name)
+        if decision is None:
+            title = normalize_title(name)
+            keep_match = self.keep_pattern.search(title) if self.keep_pattern else None
+            exclude_match = self.exclude_pattern.search(title) if self.exclude_pattern and not keep_match else None
+            if keep_match:
+                decision = (False, REASON_CHAPTER_NAME, keep_match.group(0))
+            elif exclude_match:
+                decision = (True, self.exclude_reasons[exclude_match.group(1)], exclude_match.group(1))
+            else:
+                decision = (None, None, None)
+            if len(self.name_cache) >= NAME_CACHE_SIZE:
+                self.name_cache.clear()
+            self.name_cache[name] = decision
+        return decision
+
+    def classify(self, name, word_count):
+        """
+        Classifies a chapter: names with a chapter word are kept, names matching an exclude rule are
+        excluded, and the remaining chapters are excluded when they have fewer than min_word_count words.
+
+        Args:
+            name (str): The chapter name.
+            word_count (int): The number of words of the chapter, or a callable returning it, called only
+                when the name does not decide.
+
+        Returns:
+            dict: 'excluded' (bool), 'reason' (a reason code) and 'rule' (the matched phrase, or None).
+        """
+        excluded, reason, rule = self.classify_name(name)
+        if excluded is None:
+            word_count = word_count() if callable(word_count) else word_count
+            excluded = word_count < self.min_word_count
+            reason = REASON_TOO_SMALL if excluded else REASON_KEPT
+        return {'excluded': excluded, 'reason': reason, 'rule': rule}
+
+
+_default_classifiers = {}
+
+
+def get_fluff_classifier(languages=None, exclude_keywords=None):
+    """
+    Returns a classifier for the given settings, compiled on first use and shared afterwards.
+    """
+    key = (tuple(resolve_languages(languages)), tuple(exclude_keywords) if exclude_keywords is not None else None)
+    if key not in _default_classifiers:
+        _default_classifiers[key] = FluffClassifier(key[0], exclude_keywords)
+    return _default_classifiers[key]
+
+
+def get_fluff_rules_digest(languages=None, exclude_keywords=None):
+    """
+    Returns a digest of the rules the fluff filter applies for the given settings, so that a build keyed on it
+    is redone when the rule sets change. Without languages, the language of each book is detected, so the
+    digest covers the rules of every language and the detection settings.
+
+    Args:
+        languages (list): Keys of FLUFF_RULE_SETS, or ALL_LANGUAGES; None when the language is detected.
+        exclude_keywords (list): Keywords replacing the exclude phrases of the rule sets.
+
+    Returns:
+        str: The hexadecimal SHA-256 of the rules.
+    """
+    if languages:
+        rules = get_fluff_classifier(languages, exclude_keywords).describe_rules()
+    else:
+        rules = {
+            'rules': {language: get_fluff_classifier([language], exclude_keywords).describe_rules()
+                      for language in FLUFF_RULE_SETS},
+            'default_language': DEFAULT_LANGUAGE,
+            'stopwords': LANGUAGE_STOPWORDS,
+            'sample_characters': LANGUAGE_SAMPLE_CHARACTERS,
+            'min_stopwords': MIN_LANGUAGE_STOPWORDS
+        }
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def evaluate_fluff_classifier(labeled_file='data/fluff_titles_labeled.jsonl', classifier=None):
+    """
+    Checks the name decisions of the fluff filter against a labeled set of chapter titles. Each title is
+    classified with the rules of its own language, as exclude_fluff_stage does for a book in that language.
+
+    Args:
+        labeled_file (str): JSON Lines file of {"name": ..., "language": ..., "expected": ...} records, where
+            language is a key of FLUFF_RULE_SETS and expected is the reason code of the name decision, or null
+            when the name alone should not decide.
+        classifier (FluffClassifier): A classifier to evaluate every title with instead, whatever its language.
+
+    Returns:
+        dict: The number of titles, the accuracy and the mismatches.
+    """
+    mismatches = []
+    total = 0
+    with open(labeled_file, 'r', encoding='utf-8') as labeled:
+        for line in labeled:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            total += 1
+            _, reason, rule = (classifier or get_fluff_classifier([record['language']])).classify_name(record['name'])
+            if reason != record['expected']:
+                mismatches.append({'name': record['name'], 'language': record['language'],
+                                   'expected': record['expected'], 'reason': reason, 'rule': rule})
+    return {'titles': total, 'accuracy': (total - len(mismatches)) / total if total else None,
+            'mismatches': mismatches}
+
+
+if __name__ == "__main__":
+    # This script checks the fluff rules against the labeled chapter titles in data/fluff_titles_labeled.jsonl.
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    evaluation = evaluate_fluff_classifier()
+    logging.info(f"{evaluation['titles']} titles, accuracy {evaluation['accuracy']:.3f}")
+    for mismatch in evaluation['mismatches']:
+        logging.warning(f"Mismatch: {mismatch}")
@@ -0,0 +1,43 @@
+import csv
+import logging
+import os
+
+GOODREADS_BASE_URL = 'https://www.goodreads.com'
+
+CSV_COLUMNS = ['Ranking', 'Title', 'Author', 'Average Rating']
+
+
+def get_month_url(year, month, base_url=GOODREADS_BASE_URL):
+    return f"{base_url}/book/popular_by_date/{year}/{month}"
+
+
+def get_month_csv_path(year, month, data_path='data'):
+    return os.path.join(data_path, f"goodreads_books_{year}_{month}.csv")
+
+
+def is_month_scraped(year, month, data_path='data'):
+    """
+    Tells whether the CSV of a month was already written, so a resumed run can skip it.
+    """
+    csv_path = get_month_csv_path(year, month, data_path)
+    return os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
+
+
+def write_books_csv(books, filename):
+    """
+    Saves [ranking, title, author, average rating] rows to a CSV file, in the format pandas' DataFrame.to_csv
+    writes them (header row, minimal quoting, no index). The file is written under a temporary name and then moved
+    into place, so an interrupted run never leaves a partial CSV that a resumed run would skip.
+
+    Args:
+        books (list): The rows, one per book.
+        filename (str): The path of the CSV file.
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary_filename, 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator=os.linesep)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(books)
+    os.replace(temporary_filename, filename)
+    logging.info(f"Data saved to {filename}")
@@ -0,0 +1,134 @@
+import re
+
+from text_normalization import collapse_letter_spacing
+
+# Words that open a chapter heading, e.g. "Chapter 3", "CHAPITRE II", "Capítulo uno", "Premier chapitre".
+CHAPTER_KEYWORDS = r'chapter|chapitre|cap[ií]tulo|capitolo|kapitel|hoofdstuk|rozdzia[łl]|глава'
+CHAPTER_HEADING_PATTERN = re.compile(rf'^(?:{CHAPTER_KEYWORDS})\b|\b(?:{CHAPTER_KEYWORDS})$', re.IGNORECASE)
+CHAPTER_KEYWORD_PATTERN = re.compile(rf'(?:{CHAPTER_KEYWORDS})', re.IGNORECASE)
+# A chapter word fused to the word before it, as in 'PREMIERCHAPITRE': letter-spaced headings whose word gap is no
+# wider than their letter gaps are collapsed into one token (see text_normalization.collapse_letter_spacing).
+FUSED_CHAPTER_KEYWORD_PATTERN = re.compile(rf'([^\W\d_])((?:{CHAPTER_KEYWORDS})\b)', re.IGNORECASE)
+SECTION_HEADING_PATTERN = re.compile(
+    r'^(?:prologue|prolog|epilogue|épilogue|epilog|introduction|preface|préface|foreword|avant-propos|'
+    r'afterword|postface|conclusion|vorwort|nachwort|einleitung)$', re.IGNORECASE)
+ROMAN_NUMERAL_PATTERN = re.compile(r'^(?=[IVXLC])C{0,3}(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})\.?$')
+PAGE_NUMBER_PATTERN = re.compile(r'^[\d\s\-–—.]*$')
+NUMBER_PATTERN = re.compile(r'^\d+\.?$')
+SENTENCE_END_PATTERN = re.compile(r'[.,;:!?…»"]$')
+
+# Only the top of a page is read: running headers and page numbers come first, then the heading.
+MAX_HEADING_LINES = 3
+MAX_HEADING_WORDS = 8
+MAX_HEADING_LENGTH = 60
+SCANNED_CHARACTERS_PER_PAGE = 400
+
+
+def get_heading_lines(text):
+    """
+    Returns the first non-empty lines of a page, letter spacing collapsed and page numbers skipped.
+    Only the beginning of the text is split, so the cost per page does not depend on its length.
+    """
+    lines = []
+    for raw_line in text[:SCANNED_CHARACTERS_PER_PAGE].splitlines():
+        line = collapse_letter_spacing(raw_line)
+        if not line or PAGE_NUMBER_PATTERN.match(line):
+            continue
+        if line.isupper():
+            line = FUSED_CHAPTER_KEYWORD_PATTERN.sub(r'\1 \2', line)
+        lines.append(line)
+        if len(lines) == MAX_HEADING_LINES:
+            break
+    return lines
+
+
+def is_short_line(line):
+    return len(line) <= MAX_HEADING_LENGTH and len(line.split()) <= MAX_HEADING_WORDS
+
+
+def is_numbering(word):
+    return bool(NUMBER_PATTERN.match(word) or ROMAN_NUMERAL_PATTERN.match(word))
+
+
+def is_all_caps_heading(line):
+    """
+    Tells whether a line is an all-caps heading that opens a chapter, such as 'II. THE STORM' or 'PART 3'. Capitals
+    alone are not enough: dedications ('À LÉON WERTH') and epigraph sources are set in capitals too, so the line
+    must also be numbered, by its first or last word.
+    """
+    letters = [character for character in line if character.isalpha()]
+    if len(letters) < 3 or not line.isupper() or SENTENCE_END_PATTERN.search(line):
+        return False
+    words = line.split()
+    return is_numbering(words[0]) or is_numbering(words[-1])
+
+
+def join_split_heading(lines, index):
+    """
+    Joins a chapter word standing alone on its line to the numbering or ordinal on the line before or after it, as
+    in 'CHAPITRE' / 'II' or 'PREMIER' / 'CHAPITRE', with a space.
+
+    Returns:
+        tuple: The heading and the index of its last line.
+    """
+    line = lines[index]
+    if not CHAPTER_KEYWORD_PATTERN.fullmatch(line):
+        return line, index
+    if index + 1 < len(lines) and is_numbering(lines[index + 1]):
+        return f"{line} {lines[index + 1]}", index + 1
+    if index > 0 and len(lines[index - 1].split()) == 1 and lines[index - 1].isupper():
+        return f"{lines[index - 1]} {line}", index
+    return line, index
+
+
+def detect_heading(text):
+    """
+    Looks for a chapter heading at the top of a page: a line opening or closing with a chapter word
+    (in several languages), a section name such as 'Prologue', a lone roman numeral, or a short
+    numbered all-caps first line. A heading set over two lines is joined with a space.
+
+    Args:
+        text (str): The text of a page.
+
+    Returns:
+        str: The heading, followed by its title when the title sits on the next line, or None.
+    """
+    lines = get_heading_lines(text)
+    for index, line in enumerate(lines):
+        if not is_short_line(line):
+            continue
+        if CHAPTER_HEADING_PATTERN.search(line) or ROMAN_NUMERAL_PATTERN.match(line):
+            line, index = join_split_heading(lines, index)
+            title = lines[index + 1] if index + 1 < len(lines) else ''
+            if len(line.split()) <= 2 and title and is_short_line(title) and not SENTENCE_END_PATTERN.search(title):
+                return f"{line}: {title}"
+            return line
+        if SECTION_HEADING_PATTERN.match(line):
+            return line
+    if lines and is_short_line(lines[0]) and is_all_caps_heading(lines[0]):
+        return lines[0]
+    return None
+
+
+def iter_page_headings(pages):
+    """
+    Scans pages once and yields the pages that open a chapter. A heading already seen on an earlier
+    page is a running header, not a new chapter, and is skipped.
+
+    Args:
+        pages (iterable): Page records from the page cache, in page order.
+
+    Yields:
+        tuple: The page index (0-indexed), the heading and the page record, for every page; the heading
+        is None on pages that do not open a chapter.
+    """
+    seen_headings = set()
+    for page_index, page_record in enumerate(pages):
+        heading = detect_heading(page_record['text'])
+        if heading is not None:
+            key = heading.casefold()
+            if key in seen_headings:
+                heading = None
+            else:
+                seen_headings.add(key)
+        yield page_index, heading, page_record
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+
+from page_cache import hash_pdf_file
+
+
+def get_build_manifest_path(output_file_path):
+    """
+    Names the build manifest stored next to an output file, e.g. '{isbn}_autosplits.build.json'.
+
+    Args:
+        output_file_path (str): The path of the output file.
+
+    Returns:
+        str: The path of the build manifest.
+    """
+    return f"{os.path.splitext(output_file_path)[0]}.build.json"
+
+
+def read_build_manifest(manifest_path):
+    """
+    Reads a build manifest.
+
+    Args:
+        manifest_path (str): The path of the build manifest.
+
+    Returns:
+        dict: The manifest, or None if it is missing or unreadable.
+    """
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable build manifest {manifest_path}: {e}")
+        return None
+
+
+def write_build_manifest(manifest, manifest_path):
+    """
+    Writes a build manifest.
+
+    Args:
+        manifest (dict): The input fingerprints, stage keys and results of a build.
+        manifest_path (str): The path of the build manifest.
+    """
+    try:
+        with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False, indent=4)
+    except Exception as e:
+        logging.error(f"Error saving build manifest: {e}")
+
+
+def fingerprint_file(file_path, previous_fingerprint=None):
+    """
+    Fingerprints an input file by content hash. As in make, the size and modification time are checked
+    first: when both match the previous fingerprint, its hash is reused and the file is not read.
+
+    Args:
+        file_path (str): The path of the input file.
+        previous_fingerprint (dict): The fingerprint recorded by the previous build, if any.
+
+    Returns:
+        dict: The size, modification time (ns) and SHA-256 digest of the file.
+    """
+    stat = os.stat(file_path)
+    if (previous_fingerprint
+            and previous_fingerprint.get("size") == stat.st_size
+            and previous_fingerprint.get("mtime_ns") == stat.st_mtime_ns):
+        return previous_fingerprint
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_pdf_file(file_path)}
+
+
+def compute_stage_key(*inputs):
+    """
+    Derives the key of a build stage from everything it depends on (upstream keys, versions, settings).
+
+    Args:
+        *inputs: JSON-serializable inputs of the stage.
+
+    Returns:
+        str: A SHA-256 digest that changes whenever any input changes.
+    """
+    serialized = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def find_stale_stages(previous_manifest, stage_keys):
+    """
+    Lists the stages whose key differs from the previous build, in pipeline order.
+
+    Args:
+        previous_manifest (dict): The manifest of the previous build, or None.
+        stage_keys (dict): The stage keys of the current build, in pipeline order.
+
+    Returns:
+        list: The names of the stages to recompute (all of them when there is no previous build).
+    """
+    previous_keys = (previous_manifest or {}).get("stages", {})
+    return [stage for stage, key in stage_keys.items() if previous_keys.get(stage) != key]
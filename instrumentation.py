@@ -0,0 +1,156 @@
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+# Instrumentation records are dictionaries handed to every registered sink:
+#   {'type': 'counter', 'name': ..., 'value': ..., 'tags': {...}}
+#   {'type': 'span', 'name': ..., 'seconds': ..., 'tags': {...}}
+#   {'type': 'event', 'name': ..., 'tags': {...}}
+# With no sink registered every call returns right away, and hot loops guard their calls with
+# `if instrumentation.enabled:` so not even the tags are built.
+
+
+class Instrumentation:
+    """
+    The instrumentation surface of the extraction pipelines: counters (pages extracted, chapters excluded and why,
+    bytes written), spans timing a stage, and events. Records go to the registered sinks, such as LoggingSink or
+    MetricsCollector, or any callable taking a record.
+    """
+
+    def __init__(self):
+        self.sinks = []
+        self.enabled = False
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        self.enabled = True
+        return sink
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def emit(self, record):
+        for sink in self.sinks:
+            try:
+                sink(record)
+            except Exception as e:
+                logging.error(f"Instrumentation sink {sink!r} failed on {record.get('name')}: {e}")
+
+    def count(self, name, value=1, /, **tags):
+        if self.enabled:
+            self.emit({'type': 'counter', 'name': name, 'value': value, 'tags': tags})
+
+    def event(self, name, /, **tags):
+        if self.enabled:
+            self.emit({'type': 'event', 'name': name, 'tags': tags})
+
+    def record_span(self, name, seconds, /, **tags):
+        """
+        Emits a span measured by the caller, e.g. time accumulated over the chapters of a lazy pipeline stage.
+        """
+        if self.enabled:
+            self.emit({'type': 'span', 'name': name, 'seconds': seconds, 'tags': tags})
+
+    def span(self, name, /, **tags):
+        """
+        Times the enclosed block and emits a span record when it exits, even on errors.
+
+        Usage:
+            with instrumentation.span('pdf.write', book=book_name):
+                ...
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed_span(name, tags)
+
+    @contextmanager
+    def _timed_span(self, name, tags):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - started, **tags)
+
+
+# The instance the pipelines report to.
+instrumentation = Instrumentation()
+
+
+class LoggingSink:
+    """
+    Routes instrumentation records to a logger, one line per record.
+
+    Args:
+        logger (logging.Logger): The logger to write to. Defaults to the 'book_extractor.instrumentation' logger.
+        level (int): The logging level of the lines.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('book_extractor.instrumentation')
+        self.level = level
+
+    def __call__(self, record):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        tags = ' '.join(f"{key}={value}" for key, value in record['tags'].items())
+        if record['type'] == 'counter':
+            self.logger.log(self.level, f"{record['name']} +{record['value']} {tags}".rstrip())
+        elif record['type'] == 'span':
+            self.logger.log(self.level, f"{record['name']} took {record['seconds']:.4f}s {tags}".rstrip())
+        else:
+            self.logger.log(self.level, f"{record['name']} {tags}".rstrip())
+
+
+class MetricsCollector:
+    """
+    Aggregates instrumentation records in memory, for a metrics sink to ship or a run report: counters are summed
+    per name and tags, spans keep their count, total and maximum seconds, and events are kept up to max_events.
+    """
+
+    def __init__(self, max_events=10_000):
+        self.counters = {}
+        self.spans = {}
+        self.events = []
+        self.max_events = max_events
+
+    def __call__(self, record):
+        key = (record['name'], tuple(sorted(record['tags'].items())))
+        if record['type'] == 'counter':
+            self.counters[key] = self.counters.get(key, 0) + record['value']
+        elif record['type'] == 'span':
+            span = self.spans.setdefault(key, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            span['count'] += 1
+            span['total_seconds'] += record['seconds']
+            span['max_seconds'] = max(span['max_seconds'], record['seconds'])
+        elif len(self.events) < self.max_events:
+            self.events.append(record)
+
+    def snapshot(self):
+        """
+        Returns the aggregated metrics as JSON-serializable lists of {'name', 'tags', ...} entries.
+        """
+        return {
+            'counters': [{'name': name, 'tags': dict(tags), 'value': value}
+                         for (name, tags), value in self.counters.items()],
+            'spans': [{'name': name, 'tags': dict(tags), **span} for (name, tags), span in self.spans.items()],
+            'events': list(self.events)
+        }
+
+
+@contextmanager
+def instrumented(sink):
+    """
+    Registers a sink for the duration of a block.
+
+    Usage:
+        with instrumented(MetricsCollector()) as metrics:
+            process_pdf(...)
+        metrics.snapshot()
+    """
+    instrumentation.add_sink(sink)
+    try:
+        yield sink
+    finally:
+        instrumentation.remove_sink(sink)
@@ -0,0 +1,49 @@
+import json
+import logging
+
+from instrumentation import instrumentation
+
+
+def write_jsonl_file(records, file_name):
+    """
+    Streams records to a JSON Lines file, one compact JSON object per line.
+
+    Each line is flushed as soon as its record is produced, so peak memory does not depend on the number
+    of records and downstream jobs can start reading the file before extraction finishes.
+    Errors raised while producing the records are logged and re-raised, leaving the lines written so far.
+
+    Args:
+        records (iterable): The dictionaries to write, typically a generator.
+        file_name (str): Path of the JSONL file.
+
+    Returns:
+        int: The number of records written.
+    """
+    written = 0
+    try:
+        with open(file_name, 'w', encoding='utf-8') as jsonl_file:
+            for record in records:
+                jsonl_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                jsonl_file.flush()
+                written += 1
+            instrumentation.count('bytes.written', jsonl_file.tell(), format='jsonl')
+    except Exception as e:
+        logging.error(f"Error saving JSONL after {written} records: {e}")
+        raise
+    return written
+
+
+def read_jsonl_file(file_name):
+    """
+    Reads a JSON Lines file one record at a time.
+
+    Args:
+        file_name (str): Path of the JSONL file.
+
+    Yields:
+        dict: One record per non-empty line.
+    """
+    with open(file_name, 'r', encoding='utf-8') as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                yield json.loads(line)
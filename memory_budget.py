@@ -0,0 +1,146 @@
+import logging
+import os
+import platform
+import tempfile
+
+try:
+    import resource  # Unix only; peak RSS is reported as None elsewhere
+except ImportError:
+    resource = None
+
+from instrumentation import instrumentation
+
+# Pages parsed by one PdfReader before it is dropped with its page objects and decoded content streams.
+DEFAULT_WINDOW_PAGES = 64
+
+# Share of the memory limit that the text of the current chapter may take before it is spilled to disk.
+# Python strings take up to 4 bytes per character, and the joined contents are held once more at the end.
+SPILL_SHARE = 8
+
+
+def get_current_rss_mb():
+    """
+    Returns the current resident set size of this process in megabytes, read from /proc on Linux,
+    or None where unavailable.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in megabytes, or None where unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def get_spill_threshold(memory_limit_mb):
+    """
+    Returns the number of characters of chapter text kept in memory before ChapterTextSpool spills to disk.
+    """
+    return int(memory_limit_mb * 1024 * 1024 // SPILL_SHARE // 4)
+
+
+def report_peak_rss(label, memory_limit_mb=None):
+    """
+    Logs and emits the peak RSS of this process, warning when it went over the memory limit.
+
+    Returns:
+        float: The peak RSS in megabytes, or None where unavailable.
+    """
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is None:
+        return None
+    instrumentation.event('memory.peak_rss', label=label, peak_rss_mb=round(peak_rss_mb, 1),
+                          memory_limit_mb=memory_limit_mb)
+    if memory_limit_mb and peak_rss_mb > memory_limit_mb:
+        logging.warning(f"Peak RSS of {label}: {peak_rss_mb:.1f} MB, over the {memory_limit_mb} MB limit")
+    else:
+        logging.info(f"Peak RSS of {label}: {peak_rss_mb:.1f} MB")
+    return peak_rss_mb
+
+
+class ChapterTextSpool:
+    """
+    Collects the page records of one chapter. Page texts are kept in memory up to spill_threshold characters;
+    past it, they are appended to a temporary file and only the page numbers, word counts and text lengths stay
+    in memory, until read_contents joins the chapter text back in one read.
+
+    Args:
+        spill_threshold (int): Characters held in memory before spilling; None never spills.
+    """
+
+    def __init__(self, spill_threshold=None):
+        self.spill_threshold = spill_threshold
+        self.page_records = []
+        self.held_characters = 0
+        self.spill_file = None
+
+    def __len__(self):
+        return len(self.page_records)
+
+    @property
+    def spilled(self):
+        return self.spill_file is not None
+
+    def append(self, page_record):
+        if self.spill_file is None and self.spill_threshold is not None:
+            self.held_characters += len(page_record['text'])
+            if self.held_characters > self.spill_threshold:
+                self.spill()
+        if self.spill_file is not None:
+            self.spill_file.write(page_record['text'])
+            page_record = self.summarize(page_record)
+        self.page_records.append(page_record)
+
+    @staticmethod
+    def summarize(page_record):
+        # count_words_in_pages needs the first and last characters of each page, not its whole text.
+        text = page_record['text']
+        return {'page_number': page_record['page_number'], 'word_count': page_record['word_count'],
+                'text_length': len(text), 'text': text[:1] + text[-1:]}
+
+    def spill(self):
+        self.spill_file = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogatepass', newline='')
+        for index, page_record in enumerate(self.page_records):
+            self.spill_file.write(page_record['text'])
+            self.page_records[index] = self.summarize(page_record)
+        instrumentation.count('chapters.spilled')
+
+    @property
+    def text_length(self):
+        return sum(page_record['text_length'] if 'text_length' in page_record else len(page_record['text'])
+                   for page_record in self.page_records)
+
+    def iter_texts(self):
+        """
+        Yields the text of each page in order, from memory or from the spill file, without joining them.
+        """
+        if self.spill_file is None:
+            for page_record in self.page_records:
+                yield page_record['text']
+            return
+        self.spill_file.seek(0)
+        for page_record in self.page_records:
+            yield self.spill_file.read(page_record['text_length'])
+
+    def read_contents(self):
+        """
+        Returns the joined text of the chapter's pages.
+        """
+        if self.spill_file is None:
+            return ''.join(page_record['text'] for page_record in self.page_records)
+        self.spill_file.seek(0)
+        return self.spill_file.read()
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
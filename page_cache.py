@@ -0,0 +1,425 @@
+import gc
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdf
+from pypdf import PdfReader
+
+from instrumentation import instrumentation
+from memory_budget import DEFAULT_WINDOW_PAGES, get_current_rss_mb
+from page_classifier import classify_page
+from page_images import describe_page_images
+from text_normalization import normalize_text
+
+# Bump this whenever the layout of the cached records changes so stale caches are ignored.
+CACHE_FORMAT_VERSION = 6
+
+# Directory holding one cache file per (PDF content, pypdf version) pair.
+DEFAULT_CACHE_DIRECTORY = os.environ.get('BOOK_EXTRACTOR_CACHE_DIR', os.path.join('data', '.page_cache'))
+
+# Number of shards given to each worker process; several small shards even out pages of uneven cost.
+SHARDS_PER_WORKER = 4
+# Shards submitted ahead of the one being yielded, per worker: enough to keep every worker busy, while the records
+# of shards the consumer has not reached yet stay few.
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+# Matches one word; compiled once and shared by every word count.
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+# Matches a single word character, used to tell whether two texts fuse a word when concatenated.
+WORD_CHARACTER_PATTERN = re.compile(r'\w')
+
+# The PdfReader opened once by each extraction worker process.
+_worker_reader = None
+
+
+def count_words(text):
+    """
+    Counts the number of words in the given text using a regular expression that matches word boundaries.
+    Matches are counted as they are found, without building the list of words.
+
+    Args:
+        text (str): The text in which to count words.
+
+    Returns:
+        int: The number of words found in the text.
+    """
+    return sum(1 for _ in WORD_PATTERN.finditer(text))
+
+
+def count_words_in_pages(page_records):
+    """
+    Counts the words of the concatenated text of consecutive pages from their cached word counts,
+    without joining or rescanning the text. A word split across a page break (a page ending with a word
+    character directly followed by a page starting with one) counts once, as it would in the joined text.
+
+    Args:
+        page_records (iterable): Page records with "text" and "word_count", in page order.
+
+    Returns:
+        int: The number of words in the joined text of the pages.
+    """
+    word_count = 0
+    previous_text = ''
+    for page_record in page_records:
+        text = page_record["text"]
+        if not text:
+            continue
+        word_count += page_record["word_count"]
+        if previous_text and WORD_CHARACTER_PATTERN.match(previous_text[-1]) and WORD_CHARACTER_PATTERN.match(text[0]):
+            word_count -= 1
+        previous_text = text
+    return word_count
+
+
+def hash_pdf_file(pdf_path, block_size=1024 * 1024):
+    """
+    Computes the SHA-256 digest of a PDF file's contents.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+        block_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: The hexadecimal digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as pdf_file:
+        for block in iter(lambda: pdf_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_file_path(pdf_hash, cache_directory=None):
+    """
+    Builds the cache file path for a PDF digest and the installed pypdf version.
+
+    Args:
+        pdf_hash (str): The SHA-256 digest of the PDF file.
+        cache_directory (str): Directory holding the cache files. Defaults to DEFAULT_CACHE_DIRECTORY.
+
+    Returns:
+        str: The path of the cache file.
+    """
+    cache_directory = cache_directory or DEFAULT_CACHE_DIRECTORY
+    file_name = f"{pdf_hash}_pypdf-{pypdf.__version__}_v{CACHE_FORMAT_VERSION}.jsonl"
+    return os.path.join(cache_directory, file_name)
+
+
+def flatten_outline(outline, reader, page_labels, depth=0):
+    """
+    Resolves a (possibly nested) outline into a flat list of entries in document order.
+
+    Args:
+        outline: The reader.outline or a nested list from a recursive call.
+        reader (PdfReader): The reader the outline belongs to.
+        page_labels (list): The page labels of the document, computed once by the caller.
+        depth (int): Nesting depth of the given outline list.
+
+    Returns:
+        list: A list of [page_index, page_label, title, depth] entries.
+    """
+    entries = []
+    for item in outline:
+        if isinstance(item, list):
+            entries.extend(flatten_outline(item, reader, page_labels, depth + 1))
+        else:
+            page_index = reader.get_destination_page_number(item)
+            entries.append([page_index, page_labels[page_index], item.title, depth])
+    return entries
+
+
+def extract_page_record(page, page_index):
+    """
+    Extracts the cached fields of a single PDF page.
+
+    Args:
+        page (PageObject): A pypdf PageObject from which to extract data.
+        page_index (int): The 0-indexed position of the page in the document.
+
+    Returns:
+        dict: The normalized page text, the image flag, the image details, the word count and the page class
+        ('text', 'image' or 'blank', see page_classifier) of the page.
+    """
+    # Images are found from the XObject resources alone; bool(page.images) would decode every image.
+    images = describe_page_images(page)
+    # Covers, plates and blank pages have no text-showing operator, so their text is '' without extract_text.
+    page_class = classify_page(page, bool(images))
+    # Letter-spaced runs and line-break hyphenation are repaired before the text is cached and its words counted.
+    text = normalize_text(page.extract_text()) if page_class == 'text' else ''
+    return {
+        "page_number": page_index + 1,
+        "text": text,
+        "contains_images": bool(images),
+        "images": images,
+        "word_count": count_words(text),
+        "page_class": page_class
+    }
+
+
+def split_page_range(page_count, shard_count):
+    """
+    Splits the pages of a document into contiguous shards of near-equal size.
+
+    Args:
+        page_count (int): Number of pages in the document.
+        shard_count (int): Requested number of shards.
+
+    Returns:
+        list: (start, end) page index pairs, end excluded, in page order.
+    """
+    shard_count = max(1, min(shard_count, page_count))
+    bounds = [page_count * shard // shard_count for shard in range(shard_count + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def open_worker_reader(pdf_path):
+    """
+    Process pool initializer: opens the PdfReader used by every shard run in this worker.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+    """
+    global _worker_reader
+    _worker_reader = PdfReader(pdf_path)
+
+
+def extract_page_shard(page_range):
+    """
+    Extracts the records of a contiguous range of pages with the worker's own PdfReader.
+
+    Args:
+        page_range (tuple): (start, end) page indices, end excluded.
+
+    Returns:
+        list: The page records of the range, in page order.
+    """
+    start, end = page_range
+    return [extract_page_record(_worker_reader.pages[page_index], page_index) for page_index in range(start, end)]
+
+
+def iter_extracted_pages(reader, pdf_path, workers=1):
+    """
+    Extracts the page records of a PDF in page order, yielding each one as soon as it is available.
+
+    With more than one worker, the page range is split into shards extracted by worker processes that
+    each open their own PdfReader; shards are merged back in page order, so the records are identical
+    to the serial pass. At most SHARDS_IN_FLIGHT_PER_WORKER shards per worker are submitted ahead of the
+    consumer, and the next one is submitted as each shard is yielded.
+
+    Args:
+        reader (PdfReader): The reader used for the serial pass.
+        pdf_path (str): The file path to the PDF, opened again by each worker process.
+        workers (int): Number of worker processes used for text extraction.
+
+    Yields:
+        dict: One page record per page.
+    """
+    page_count = len(reader.pages)
+    if workers > 1 and page_count > 1:
+        shards = split_page_range(page_count, workers * SHARDS_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_reader,
+                                 initargs=(pdf_path,)) as executor:
+            pending = deque(shards)
+            in_flight = deque()
+            try:
+                while pending or in_flight:
+                    while pending and len(in_flight) < workers * SHARDS_IN_FLIGHT_PER_WORKER:
+                        in_flight.append(executor.submit(extract_page_shard, pending.popleft()))
+                    yield from in_flight.popleft().result()
+            finally:
+                # A consumer that stops early does not wait for shards no worker has started.
+                for future in in_flight:
+                    future.cancel()
+    else:
+        for page_index, page in enumerate(reader.pages):
+            yield extract_page_record(page, page_index)
+
+
+def iter_windowed_pages(pdf_path, page_count, window_pages=DEFAULT_WINDOW_PAGES, memory_limit_mb=None):
+    """
+    Extracts the page records of a PDF in page order under a memory ceiling. Pages are parsed in windows of
+    window_pages by a fresh PdfReader; at the end of each window the reader is dropped with every page object
+    and decoded content stream it cached, which a reader kept for the whole run would hold until the end.
+    A window also ends early when the RSS of the process goes over memory_limit_mb. The records are identical
+    to those of iter_extracted_pages.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+        page_count (int): Number of pages in the document.
+        window_pages (int): Pages parsed by one reader.
+        memory_limit_mb (float): RSS above which the current window is cut short; None only uses window_pages.
+
+    Yields:
+        dict: One page record per page.
+    """
+    if get_current_rss_mb() is None:
+        memory_limit_mb = None  # no /proc: windows of window_pages only
+    page_index = 0
+    while page_index < page_count:
+        reader = PdfReader(pdf_path)
+        window_end = min(page_index + window_pages, page_count)
+        while page_index < window_end:
+            yield extract_page_record(reader.pages[page_index], page_index)
+            page_index += 1
+            if memory_limit_mb and page_index < window_end and get_current_rss_mb() > memory_limit_mb:
+                logging.debug(f"RSS over {memory_limit_mb} MB, ending the page window at page {page_index}")
+                break
+        # pypdf objects reference their reader, so the cycles are collected right away rather than later.
+        del reader
+        gc.collect()
+        instrumentation.count('page_cache.windows')
+        if memory_limit_mb and get_current_rss_mb() > memory_limit_mb:
+            # What is left is not held by the reader: shorter windows would only slow the extraction down.
+            logging.warning(f"RSS of {get_current_rss_mb():.0f} MB is still over the {memory_limit_mb} MB limit "
+                            f"after dropping the PDF reader at page {page_index}")
+            memory_limit_mb = None
+
+
+def build_page_cache(pdf_path, workers=1, memory_limit_mb=None):
+    """
+    Runs the single pypdf extraction pass over a PDF.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+        workers (int): Number of worker processes used for text extraction.
+        memory_limit_mb (float): When set, pages are extracted serially in windows under this RSS ceiling
+            (see iter_windowed_pages) and workers is ignored.
+
+    Returns:
+        dict: The page count, the flattened outline and a generator of page records under "pages".
+    """
+    reader = PdfReader(pdf_path)
+    outline = flatten_outline(reader.outline, reader, reader.page_labels) if reader.outline else []
+    page_count = len(reader.pages)
+    if memory_limit_mb:
+        if workers > 1:
+            logging.info(f"Extracting {pdf_path} serially in page windows under {memory_limit_mb} MB")
+        pages = iter_windowed_pages(pdf_path, page_count, memory_limit_mb=memory_limit_mb)
+    else:
+        pages = iter_extracted_pages(reader, pdf_path, workers)
+    return {
+        "page_count": page_count,
+        "outline": outline,
+        "pages": pages
+    }
+
+
+def iter_cache_file_pages(cache_file):
+    """
+    Reads the page records of an open cache file one line at a time.
+
+    Args:
+        cache_file (file): The cache file, positioned after its header line.
+
+    Yields:
+        dict: One page record per page.
+    """
+    with cache_file:
+        for line in cache_file:
+            yield json.loads(line)
+
+
+def write_through_cache(header, pages, cache_file_path):
+    """
+    Yields the page records of a fresh extraction while writing them to the cache file: a header line
+    followed by one JSON line per page. The file is written under a temporary name and only moved into
+    place once every page went through, so readers never see partial caches.
+
+    Args:
+        header (dict): The document-level fields written on the first line.
+        pages (iterable): The page records from build_page_cache.
+        cache_file_path (str): The path of the cache file.
+
+    Yields:
+        dict: One page record per page.
+    """
+    temporary_path = f"{cache_file_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+        cache_file = open(temporary_path, 'w', encoding='utf-8')
+    except OSError as e:
+        logging.warning(f"Failed to write page cache {cache_file_path}: {e}")
+        yield from pages
+        return
+
+    completed = False
+    try:
+        with cache_file:
+            cache_file.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for page in pages:
+                cache_file.write(json.dumps(page, ensure_ascii=False) + '\n')
+                instrumentation.count('pages.extracted', page_class=page['page_class'])
+                yield page
+            instrumentation.count('bytes.written', cache_file.tell(), format='page_cache')
+        os.replace(temporary_path, cache_file_path)
+        completed = True
+        logging.info(f"Page cache written to {cache_file_path}")
+    finally:
+        if not completed and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def stream_page_cache(pdf_path, cache_directory=None, workers=1, pdf_hash=None, memory_limit_mb=None):
+    """
+    Returns the extracted pages of a PDF as a stream, running pypdf only when no cache exists for this
+    PDF content and pypdf version. Only one page record is held in memory at a time.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+        cache_directory (str): Directory holding the cache files. Defaults to DEFAULT_CACHE_DIRECTORY.
+        workers (int): Number of worker processes used for text extraction on a cache miss.
+        pdf_hash (str): The SHA-256 digest of the PDF when the caller already knows it.
+        memory_limit_mb (float): RSS ceiling of a windowed extraction on a cache miss (see iter_windowed_pages).
+
+    Returns:
+        dict: The page count, the flattened outline and a generator of page records under "pages".
+    """
+    pdf_hash = pdf_hash or hash_pdf_file(pdf_path)
+    cache_file_path = get_cache_file_path(pdf_hash, cache_directory)
+
+    if os.path.exists(cache_file_path):
+        try:
+            cache_file = open(cache_file_path, 'r', encoding='utf-8')
+            try:
+                page_cache = json.loads(cache_file.readline())
+            except ValueError:
+                cache_file.close()
+                raise
+            page_cache["pages"] = iter_cache_file_pages(cache_file)
+            instrumentation.count('page_cache.hits')
+            logging.info(f"Loaded page cache for {pdf_path} from {cache_file_path}")
+            return page_cache
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable page cache {cache_file_path}: {e}")
+
+    instrumentation.count('page_cache.misses')
+    page_cache = build_page_cache(pdf_path, workers, memory_limit_mb)
+    page_cache["sha256"] = pdf_hash
+    page_cache["pypdf_version"] = pypdf.__version__
+    pages = page_cache.pop("pages")
+    page_cache["pages"] = write_through_cache(dict(page_cache), pages, cache_file_path)
+    return page_cache
+
+
+def load_page_cache(pdf_path, cache_directory=None, workers=1):
+    """
+    Returns the extracted pages of a PDF, running pypdf only when no cache exists for this
+    PDF content and pypdf version.
+
+    Args:
+        pdf_path (str): The file path to the PDF.
+        cache_directory (str): Directory holding the cache files. Defaults to DEFAULT_CACHE_DIRECTORY.
+        workers (int): Number of worker processes used for text extraction on a cache miss.
+
+    Returns:
+        dict: The page count, the flattened outline and the list of page records under "pages".
+    """
+    page_cache = stream_page_cache(pdf_path, cache_directory, workers)
+    page_cache["pages"] = list(page_cache["pages"])
+    return page_cache
@@ -0,0 +1,84 @@
+import logging
+import re
+
+from page_images import page_has_images, resolve
+
+# Page classes stored in the page records: 'text' pages show text and go through extract_text, 'image' pages only
+# draw images and 'blank' pages neither, so their text is known to be empty without interpreting them.
+PAGE_CLASSES = ('text', 'image', 'blank')
+
+# The text-showing operators Tj, TJ, ' and ". pypdf's extract_text only produces text from these, so a page whose
+# content streams never use them extracts to ''. The bytes are searched without tokenizing: a match inside a string
+# or inline image data only sends the page down the full extraction, never the other way around.
+TEXT_SHOWING_OPERATOR_PATTERN = re.compile(rb"T[jJ]|['\"]")
+
+
+def stream_shows_text(stream):
+    """
+    Tells whether a content stream may use a text-showing operator, from its decoded bytes.
+    """
+    return TEXT_SHOWING_OPERATOR_PATTERN.search(stream.get_data()) is not None
+
+
+def iter_form_xobjects(resources, visited=None):
+    """
+    Walks the XObject resources of a page and yields its Form XObjects, including those nested in other forms.
+    extract_text interprets the forms a page draws with Do, so their streams can show text as well.
+
+    Args:
+        resources: The /Resources dictionary of a page or of a Form XObject.
+        visited (set): Ids of the Form XObjects already walked, guarding against reference cycles.
+
+    Yields:
+        StreamObject: The Form XObject streams.
+    """
+    visited = set() if visited is None else visited
+    resources = resolve(resources)
+    if not resources or "/XObject" not in resources:
+        return
+    for reference in resolve(resources["/XObject"]).values():
+        xobject = resolve(reference)
+        if xobject.get("/Subtype") == "/Form" and id(xobject) not in visited:
+            visited.add(id(xobject))
+            yield xobject
+            yield from iter_form_xobjects(xobject.get("/Resources"), visited)
+
+
+def page_shows_text(page):
+    """
+    Tells whether any content stream of a page, or of the Form XObjects in its resources, uses a text-showing
+    operator. This decodes the streams but does not parse their operators, build font maps or track positions
+    like extract_text does. A page that cannot be inspected is assumed to show text.
+
+    Args:
+        page (PageObject): A pypdf PageObject.
+
+    Returns:
+        bool: False only when extract_text is certain to return an empty string.
+    """
+    try:
+        contents = page.get_contents()
+        if contents is not None and stream_shows_text(contents):
+            return True
+        return any(stream_shows_text(form) for form in iter_form_xobjects(page.get("/Resources")))
+    except Exception as e:
+        logging.debug(f"Could not inspect the content streams of a page, extracting its text: {e}")
+        return True
+
+
+def classify_page(page, contains_images=None):
+    """
+    Classifies a page from its resources and content-stream operators, without extracting its text.
+
+    Args:
+        page (PageObject): A pypdf PageObject.
+        contains_images (bool): Whether the page draws images, when the caller already knows it.
+
+    Returns:
+        str: 'text' when the page shows text, otherwise 'image' when it draws images, or 'blank'.
+    """
+    if page_shows_text(page):
+        return 'text'
+    if contains_images is None:
+        contains_images = page_has_images(page)
+    return 'image' if contains_images else 'blank'
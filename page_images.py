@@ -0,0 +1,88 @@
+from pypdf.generic import IndirectObject
+
+
+def resolve(value):
+    """
+    Returns the object behind an indirect reference, or the value itself.
+    """
+    return value.get_object() if isinstance(value, IndirectObject) else value
+
+
+def get_encoded_size(stream):
+    """
+    Returns the size of a stream's encoded data in bytes without decoding it.
+    pypdf drops /Length from the dictionary once the stream has been read, so the raw data is measured instead.
+    """
+    if "/Length" in stream:
+        return int(resolve(stream["/Length"]))
+    return len(getattr(stream, "_data", b"") or b"")
+
+
+def iter_image_xobjects(resources, visited=None):
+    """
+    Walks the XObject resources of a page, descending into Form XObjects, and yields the image
+    XObjects found. Only the resource dictionaries are read: image streams are never decoded.
+
+    Args:
+        resources: The /Resources dictionary of a page or of a Form XObject.
+        visited (set): Ids of the Form XObjects already walked, guarding against reference cycles.
+
+    Yields:
+        tuple: The resource name and the image XObject stream.
+    """
+    visited = set() if visited is None else visited
+    resources = resolve(resources)
+    if not resources or "/XObject" not in resources:
+        return
+    xobjects = resolve(resources["/XObject"])
+    for name, reference in xobjects.items():
+        xobject = resolve(reference)
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            yield name, xobject
+        elif subtype == "/Form" and id(xobject) not in visited:
+            visited.add(id(xobject))
+            yield from iter_image_xobjects(xobject.get("/Resources"), visited)
+
+
+def page_has_images(page):
+    """
+    Tells whether a page draws any image XObject, stopping at the first one found.
+    Unlike bool(page.images), no image data is decoded.
+
+    Args:
+        page (PageObject): A pypdf PageObject.
+
+    Returns:
+        bool: True if the page resources reference at least one image.
+    """
+    return next(iter_image_xobjects(page.get("/Resources")), None) is not None
+
+
+def describe_page_images(page):
+    """
+    Reports the images of a page from their XObject dictionaries, without decoding pixel data.
+
+    Args:
+        page (PageObject): A pypdf PageObject.
+
+    Returns:
+        list: One dictionary per image with its resource name, pixel dimensions, bits per component,
+        compression filter and encoded size in bytes.
+    """
+    images = []
+    for name, xobject in iter_image_xobjects(page.get("/Resources")):
+        image_filter = resolve(xobject.get("/Filter"))
+        if isinstance(image_filter, list):
+            image_filter = [str(resolve(item)) for item in image_filter]
+        elif image_filter is not None:
+            image_filter = str(image_filter)
+        images.append({
+            "name": str(name),
+            "width": int(resolve(xobject.get("/Width", 0))),
+            "height": int(resolve(xobject.get("/Height", 0))),
+            "bits_per_component": int(resolve(xobject.get("/BitsPerComponent", 0))),
+            "filter": image_filter,
+            "byte_size": get_encoded_size(xobject)
+        })
+    return images
@@ -0,0 +1,352 @@
+import itertools
+import logging
+import mmap
+import os
+import shutil
+import sqlite3
+import tempfile
+
+# A page store keeps the page and chapter metadata of a whole library in two files:
+#   pages.sqlite  typed columns, one row per page or chapter (no repeated ISBN or key names), indexed by book
+#   pages.blob    the UTF-8 text of every page and chapter, appended book after book; rows hold its byte offset
+#                 and length
+# Aggregate queries only read the SQLite columns. Texts are sliced out of a read-only memory map of the blob, so a
+# lookup costs one index probe and a copy of the text, whatever the length of the book, and every reader process
+# shares the blob through the OS page cache instead of holding its own copy.
+STORE_DATABASE_NAME = 'pages.sqlite'
+STORE_BLOB_NAME = 'pages.blob'
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY,
+    isbn TEXT NOT NULL UNIQUE,
+    page_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    book_id INTEGER NOT NULL REFERENCES books (book_id),
+    page_number INTEGER NOT NULL,
+    word_count INTEGER NOT NULL,
+    contains_images INTEGER NOT NULL,
+    image_count INTEGER,
+    text_offset INTEGER NOT NULL,
+    text_length INTEGER NOT NULL,
+    page_class TEXT,
+    PRIMARY KEY (book_id, page_number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chapters (
+    book_id INTEGER NOT NULL REFERENCES books (book_id),
+    chapter_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    part TEXT NOT NULL,
+    word_count INTEGER,
+    text_offset INTEGER NOT NULL,
+    text_length INTEGER NOT NULL,
+    PRIMARY KEY (book_id, chapter_index)
+) WITHOUT ROWID;
+"""
+
+# Texts are spooled to disk while a book is read, so only its row metadata is held in memory; rows are inserted in
+# batches of this size.
+INSERT_BATCH_SIZE = 1000
+
+
+class PageStore:
+    """
+    Append-only columnar store of page and chapter texts and metadata for many books, backed by SQLite and a
+    text blob file read through mmap.
+
+    Adding the pages (or chapters) of a book spools their texts to a temporary file while they are produced, then
+    appends them to the blob and inserts their rows in one transaction, so readers see the whole book or nothing
+    and other writers only wait for the copy, not for the extraction. Re-adding them replaces the rows; the
+    previous texts stay in the blob unused.
+
+    Args:
+        store_directory (str): Directory holding pages.sqlite and pages.blob, created if needed.
+
+    Usage:
+        with PageStore('data/page_store') as store:
+            store.add_book(isbn, iter_pdf_page_data(pdf_path, isbn))
+            store.get_page(isbn, 12)
+            store.get_chapter(isbn, 7)
+            store.summarize_books()
+    """
+
+    def __init__(self, store_directory):
+        os.makedirs(store_directory, exist_ok=True)
+        self.store_directory = store_directory
+        self.blob_path = os.path.join(store_directory, STORE_BLOB_NAME)
+        # Transactions are managed explicitly (BEGIN IMMEDIATE in begin_book).
+        self.connection = sqlite3.connect(os.path.join(store_directory, STORE_DATABASE_NAME), isolation_level=None)
+        self.connection.executescript(STORE_SCHEMA)
+        if 'page_class' not in {column[1] for column in self.connection.execute("PRAGMA table_info(pages)")}:
+            # Stores written before page classes get the column, NULL for the pages already stored.
+            self.connection.execute("ALTER TABLE pages ADD COLUMN page_class TEXT")
+        self.blob_file = None
+        self.blob_map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.unmap_blob()
+        self.connection.close()
+
+    def unmap_blob(self):
+        if self.blob_map is not None:
+            self.blob_map.close()
+            self.blob_map = None
+        if self.blob_file is not None:
+            self.blob_file.close()
+            self.blob_file = None
+
+    def begin_book(self, cursor, isbn, table):
+        """
+        Opens the write transaction of a book and clears its rows in table. Returns the book id.
+        """
+        # Taking the write lock first also serializes blob appends between writers.
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("INSERT INTO books (isbn, page_count) VALUES (?, 0) ON CONFLICT (isbn) DO NOTHING", (isbn,))
+        book_id = cursor.execute("SELECT book_id FROM books WHERE isbn = ?", (isbn,)).fetchone()[0]
+        cursor.execute(f"DELETE FROM {table} WHERE book_id = ?", (book_id,))
+        return book_id
+
+    @staticmethod
+    def spool_records(records, make_row, spool):
+        """
+        Writes the contents of each record to the spool file, outside of any transaction.
+
+        Returns:
+            list: One (row, offset, length) tuple per record, where row is built by make_row(record) and offset
+            is relative to the start of the spool.
+        """
+        rows = []
+        offset = 0
+        for record in records:
+            text = record["contents"].encode('utf-8')
+            spool.write(text)
+            rows.append((make_row(record), offset, len(text)))
+            offset += len(text)
+        return rows
+
+    def insert_records(self, cursor, book_id, spool, rows, insert_sql):
+        """
+        Appends the spooled texts to the blob and inserts the rows in batches, as (book_id, *row, text_offset,
+        text_length). The blob is synced before the caller commits, so rows never point past its end.
+        """
+        with open(self.blob_path, 'ab') as blob:
+            start = blob.seek(0, os.SEEK_END)
+            spool.seek(0)
+            shutil.copyfileobj(spool, blob)
+            blob.flush()
+            os.fsync(blob.fileno())
+        for batch_start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[batch_start:batch_start + INSERT_BATCH_SIZE]
+            cursor.executemany(insert_sql, [(book_id, *row, start + offset, length) for row, offset, length in batch])
+
+    def add_records(self, isbn, records, table, make_row, insert_sql):
+        """
+        Spools the texts of the records, then stores them and their rows in table in one write transaction,
+        replacing the rows of the book. Returns the book id and the number of records.
+        """
+        with tempfile.TemporaryFile(dir=self.store_directory) as spool:
+            rows = self.spool_records(records, make_row, spool)
+            cursor = self.connection.cursor()
+            try:
+                book_id = self.begin_book(cursor, isbn, table)
+                self.insert_records(cursor, book_id, spool, rows, insert_sql)
+                if table == 'pages':
+                    cursor.execute("UPDATE books SET page_count = ? WHERE book_id = ?", (len(rows), book_id))
+                cursor.execute("COMMIT")
+            except Exception:
+                if self.connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def add_book(self, isbn, pages):
+        """
+        Appends the pages of a book to the store.
+
+        Args:
+            isbn (str): The ISBN of the book; a book already in the store is replaced.
+            pages (iterable): Page metadata dictionaries, e.g. from create_page_splits_from_pdf.iter_pdf_page_data,
+                with page_number, contents, contains_images, word_count and optionally image_count and page_class.
+
+        Returns:
+            int: The number of pages stored.
+        """
+        return self.add_records(
+            isbn, pages, 'pages',
+            lambda page: (page["page_number"], page["word_count"], int(page["contains_images"]),
+                          page.get("image_count"), page.get("page_class")),
+            "INSERT INTO pages (book_id, page_number, word_count, contains_images, image_count, page_class, "
+            "text_offset, text_length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+    def add_chapters(self, isbn, chapters):
+        """
+        Appends the chapters of a book to the store, numbered in the order they come (which is their
+        sequence_index for the output of the chapter pipeline).
+
+        Args:
+            isbn (str): The ISBN of the book; chapters already stored for it are replaced.
+            chapters (iterable): Chapter dictionaries with name, contents, and optionally part and word_count.
+
+        Returns:
+            int: The number of chapters stored.
+        """
+        chapter_indices = itertools.count()
+        return self.add_records(
+            isbn, chapters, 'chapters',
+            lambda chapter: (next(chapter_indices), chapter["name"], chapter.get("part", ''),
+                             chapter.get("word_count")),
+            "INSERT INTO chapters (book_id, chapter_index, name, part, word_count, text_offset, text_length) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+    def read_text(self, text_offset, text_length):
+        """
+        Slices a text out of the memory-mapped blob. The map is reopened when the blob has grown past it,
+        e.g. after another process added a book.
+        """
+        if not text_length:
+            return ''
+        end = text_offset + text_length
+        if self.blob_map is None or end > len(self.blob_map):
+            self.unmap_blob()
+            self.blob_file = open(self.blob_path, 'rb')
+            self.blob_map = mmap.mmap(self.blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.blob_map[text_offset:end].decode('utf-8')
+
+    def get_page(self, isbn, page_number, include_contents=True):
+        """
+        Returns the metadata of one page, in the format of create_page_splits_from_pdf.extract_page_data,
+        or None when the page is not in the store. Only that page's text is read.
+        """
+        row = self.connection.execute(
+            "SELECT page_number, word_count, contains_images, image_count, text_offset, text_length, page_class "
+            "FROM pages JOIN books USING (book_id) WHERE isbn = ? AND page_number = ?", (isbn, page_number)).fetchone()
+        return self.make_page(isbn, row, include_contents) if row else None
+
+    def iter_pages(self, isbn, include_contents=True):
+        """
+        Yields the metadata of the pages of a book in page order, reading texts one page at a time.
+        """
+        cursor = self.connection.execute(
+            "SELECT page_number, word_count, contains_images, image_count, text_offset, text_length, page_class "
+            "FROM pages JOIN books USING (book_id) WHERE isbn = ? ORDER BY page_number", (isbn,))
+        for row in cursor:
+            yield self.make_page(isbn, row, include_contents)
+
+    def make_page(self, isbn, row, include_contents):
+        page_number, word_count, contains_images, image_count, text_offset, text_length, page_class = row
+        page_data = {"isbn": isbn, "page_number": page_number}
+        if include_contents:
+            page_data["contents"] = self.read_text(text_offset, text_length)
+        page_data["contains_images"] = bool(contains_images)
+        page_data["word_count"] = word_count
+        if page_class is not None:
+            page_data["page_class"] = page_class
+        if image_count is not None:
+            page_data["image_count"] = image_count
+        return page_data
+
+    def get_chapter(self, isbn, chapter_index, include_contents=True):
+        """
+        Returns one chapter of a book (its sequence_index in the chapter output), with the keys of the chapter
+        output, or None when it is not in the store. Only that chapter's text is read.
+        """
+        row = self.connection.execute(
+            "SELECT chapter_index, name, part, word_count, text_offset, text_length "
+            "FROM chapters JOIN books USING (book_id) WHERE isbn = ? AND chapter_index = ?",
+            (isbn, chapter_index)).fetchone()
+        return self.make_chapter(isbn, row, include_contents) if row else None
+
+    def iter_chapters(self, isbn, include_contents=True):
+        """
+        Yields the chapters of a book in order, reading texts one chapter at a time.
+        """
+        cursor = self.connection.execute(
+            "SELECT chapter_index, name, part, word_count, text_offset, text_length "
+            "FROM chapters JOIN books USING (book_id) WHERE isbn = ? ORDER BY chapter_index", (isbn,))
+        for row in cursor:
+            yield self.make_chapter(isbn, row, include_contents)
+
+    def make_chapter(self, isbn, row, include_contents):
+        chapter_index, name, part, word_count, text_offset, text_length = row
+        chapter = {"name": name}
+        if include_contents:
+            chapter["contents"] = self.read_text(text_offset, text_length)
+        chapter["word_count"] = word_count
+        chapter["sequence_index"] = chapter_index
+        chapter["part"] = part
+        chapter["isbn"] = isbn
+        return chapter
+
+    def count_chapters(self, isbn):
+        return self.connection.execute("SELECT count(*) FROM chapters JOIN books USING (book_id) WHERE isbn = ?",
+                                       (isbn,)).fetchone()[0]
+
+    def summarize_books(self, isbns=None):
+        """
+        Aggregates the page metadata per book without reading any text.
+
+        Args:
+            isbns (list): The books to summarize. Defaults to the whole library.
+
+        Returns:
+            list: One dict per book with its isbn, page_count, word_count and pages_with_images.
+        """
+        query = ("SELECT isbn, page_count, COALESCE(SUM(word_count), 0), COALESCE(SUM(contains_images), 0) "
+                 "FROM books LEFT JOIN pages USING (book_id)")
+        parameters = ()
+        if isbns is not None:
+            isbns = list(isbns)
+            query += f" WHERE isbn IN ({', '.join('?' * len(isbns))})"
+            parameters = isbns
+        query += " GROUP BY book_id ORDER BY isbn"
+        return [{"isbn": isbn, "page_count": page_count, "word_count": word_count,
+                 "pages_with_images": pages_with_images}
+                for isbn, page_count, word_count, pages_with_images in self.connection.execute(query, parameters)]
+
+    def query(self, sql, parameters=()):
+        """
+        Runs a read query against the pages, chapters and books tables, e.g.
+        "SELECT isbn, page_number FROM pages JOIN books USING (book_id) WHERE word_count = 0 AND contains_images".
+        """
+        return self.connection.execute(sql, parameters).fetchall()
+
+
+def write_page_store(pages_data, isbn, store_directory):
+    """
+    Adds the pages of a book to the page store in store_directory, logging errors instead of raising them.
+
+    Returns:
+        int: The number of pages stored, or None on failure.
+    """
+    try:
+        with PageStore(store_directory) as store:
+            page_count = store.add_book(isbn, pages_data)
+        logging.info(f"{page_count} pages of {isbn} added to the page store in {store_directory}")
+        return page_count
+    except Exception as e:
+        logging.error(f"Failed to add {isbn} to the page store in {store_directory}: {e}")
+        return None
+
+
+def write_chapter_store(chapters, isbn, store_directory):
+    """
+    Adds the chapters of a book to the page store in store_directory, logging errors before re-raising them.
+
+    Returns:
+        int: The number of chapters stored.
+    """
+    try:
+        with PageStore(store_directory) as store:
+            chapter_count = store.add_chapters(isbn, chapters)
+        logging.info(f"{chapter_count} chapters of {isbn} added to the page store in {store_directory}")
+        return chapter_count
+    except Exception as e:
+        logging.error(f"Failed to add the chapters of {isbn} to the page store in {store_directory}: {e}")
+        raise
@@ -0,0 +1,66 @@
+import logging
+import tempfile
+import unittest
+
+from create_chapter_payloads_from_pdf import build_chapter_pipeline, iter_pdf_chapters, run_chapter_pipeline
+from instrumentation import MetricsCollector, instrumented
+from page_cache import stream_page_cache
+
+# Checks that the extraction modes of the bundled PDF give the same page records and chapter payloads as a serial
+# extraction. Every mode extracts into its own empty cache directory, so no mode reads the cache of another.
+#   python -m unittest test_extraction_modes
+
+PDF_PATH = 'data/9354990517.pdf'
+BOOK_NAME = '9354990517'
+
+# Under this limit the RSS of any Python process is over the ceiling, so every page window ends after one page, and
+# chapter text past 1638 characters (see memory_budget.get_spill_threshold) is spilled to disk.
+TINY_MEMORY_LIMIT_MB = 0.05
+
+
+def extract_book(workers=1, memory_limit_mb=None):
+    """
+    Extracts the bundled PDF in a fresh page cache with the given options.
+
+    Returns:
+        tuple: The page records read back from that cache, and the chapter payloads of the chapter pipeline.
+    """
+    with tempfile.TemporaryDirectory() as cache_directory:
+        chapters = run_chapter_pipeline(
+            iter_pdf_chapters(BOOK_NAME, PDF_PATH, cache_directory, workers, memory_limit_mb=memory_limit_mb),
+            build_chapter_pipeline(BOOK_NAME))
+        payloads = list(chapters)
+        pages = list(stream_page_cache(PDF_PATH, cache_directory)['pages'])
+    return pages, payloads
+
+
+class ExtractionModesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.INFO)
+        cls.serial_pages, cls.serial_payloads = extract_book()
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def test_serial_extraction(self):
+        self.assertEqual(len(self.serial_pages), 88)
+        self.assertEqual(len(self.serial_payloads), 27)
+
+    def test_parallel_workers_match_serial(self):
+        pages, payloads = extract_book(workers=2)
+        self.assertEqual(pages, self.serial_pages)
+        self.assertEqual(payloads, self.serial_payloads)
+
+    def test_bounded_memory_matches_serial(self):
+        with instrumented(MetricsCollector()) as metrics:
+            pages, payloads = extract_book(memory_limit_mb=TINY_MEMORY_LIMIT_MB)
+        self.assertGreater(metrics.counters.get(('chapters.spilled', ()), 0), 0)
+        self.assertEqual(pages, self.serial_pages)
+        self.assertEqual(payloads, self.serial_payloads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+
+from fluff_classifier import evaluate_fluff_classifier
+
+# Checks the fluff rules against the labeled chapter titles, each with the rules of its own language.
+#   python -m unittest test_fluff_classifier
+
+LABELED_FILE = 'data/fluff_titles_labeled.jsonl'
+
+
+class LabeledTitlesTest(unittest.TestCase):
+
+    def test_titles_match_their_labels(self):
+        evaluation = evaluate_fluff_classifier(LABELED_FILE)
+        self.assertEqual(evaluation['titles'], 85)
+        self.assertEqual(evaluation['mismatches'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
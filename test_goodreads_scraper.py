@@ -0,0 +1,107 @@
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import extract_goodreads_popular_books_authors as scraper
+from goodreads_lists import get_month_csv_path, get_month_url, is_month_scraped
+
+# Checks that the Goodreads scraper only writes the CSV of a month whose list loaded in full, so a resumed run retries
+# the others. The browser tests run headless Chrome against data/goodreads_fixtures served locally, and are skipped
+# where selenium or Chrome is not installed.
+#   python -m unittest test_goodreads_scraper
+
+FIXTURES_DIRECTORY = 'data/goodreads_fixtures'
+
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class StubDriver:
+    def quit(self):
+        pass
+
+
+class IncompleteMonthTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        data_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(data_directory.cleanup)
+        self.data_path = data_directory.name
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def scrape(self):
+        return scraper.get_goodreads_books_concurrently([2023], [1], workers=1, data_path=self.data_path,
+                                                        driver_factory=StubDriver)
+
+    def test_unfinished_load_writes_no_csv(self):
+        error = scraper.IncompleteBookListError("'Show more books' stopped loading books after 4")
+        with mock.patch.object(scraper, 'load_full_page', side_effect=error):
+            summary = self.scrape()
+        self.assertEqual(summary['failed'], [(2023, 1)])
+        self.assertFalse(os.path.exists(get_month_csv_path(2023, 1, self.data_path)))
+        self.assertFalse(is_month_scraped(2023, 1, self.data_path))
+
+    def test_unreadable_books_write_no_csv(self):
+        with mock.patch.object(scraper, 'load_full_page', return_value=7), \
+                mock.patch.object(scraper, 'extract_books_data', return_value=[['1', 'Spare', 'Prince Harry', '3.86']]):
+            summary = self.scrape()
+        self.assertEqual(summary['failed'], [(2023, 1)])
+        self.assertFalse(is_month_scraped(2023, 1, self.data_path))
+
+
+class BrowserScrapeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.driver = scraper.setup_driver()
+        except Exception as e:  # selenium or Chrome missing
+            raise unittest.SkipTest(f"No browser session: {e}")
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietRequestHandler, directory=FIXTURES_DIRECTORY))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.driver.quit()
+
+    def setUp(self):
+        data_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(data_directory.cleanup)
+        self.data_path = data_directory.name
+
+    def read_csv_rows(self, month):
+        with open(get_month_csv_path(2023, month, self.data_path), encoding='utf-8') as csv_file:
+            return csv_file.read().splitlines()
+
+    def test_single_page_month(self):
+        self.assertEqual(scraper.scrape_month(self.driver, 2023, 2, self.data_path, self.base_url), 3)
+        self.assertEqual(self.read_csv_rows(2)[1], '1,Hidden Pictures,Jason Rekulak,4.18')
+
+    def test_show_more_month(self):
+        self.assertEqual(scraper.scrape_month(self.driver, 2023, 1, self.data_path, self.base_url), 7)
+        self.assertEqual(len(self.read_csv_rows(1)), 8)
+
+    def test_show_more_timeout_fails_the_month(self):
+        # The fixture appends its hidden books 300 ms after the click.
+        with self.assertRaises(scraper.IncompleteBookListError):
+            scraper.load_full_page(self.driver, get_month_url(2023, 1, self.base_url), show_more_timeout=0.1)
+
+    def test_missing_list_fails_the_month(self):
+        with self.assertRaises(scraper.IncompleteBookListError):
+            scraper.load_full_page(self.driver, get_month_url(2023, 3, self.base_url), page_load_timeout=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import re
+
+# Unicode spaces mapped to a plain space, and invisible characters (soft hyphen, zero-width spaces, BOM) removed.
+# Character-class substitutions run in C and cost next to nothing on pages that contain none of them.
+UNICODE_SPACE_PATTERN = re.compile('[\t\x0b\x0c\xa0\u2000-\u200a\u202f\u205f\u3000]')
+INVISIBLE_CHARACTER_PATTERN = re.compile('[\xad\u200b-\u200d\u2060\ufeff]')
+
+# A token made of one non-space character, the unit of letter-spaced text such as 'J e  d e m a n d e'.
+SINGLE_CHARACTER_TOKEN_PATTERN = re.compile(r'(?<!\S)\S(?!\S)')
+TOKEN_PATTERN = re.compile(r'\S+')
+# Letter-spaced text marks word breaks with wider gaps than letter breaks.
+WORD_GAP_PATTERN = re.compile(r' {2,}')
+LETTER_GAP_PATTERN = re.compile(r'(?<=\S) (?=\S)')
+# Four single-character tokens in a row: a cheap test telling whether a page needs the letter-spacing pass at all.
+LETTER_SPACED_RUN_PATTERN = re.compile(r'(?:(?<!\S)\S ){3}\S(?!\S)')
+# A letter-spaced line, captured whole so that re.split puts these lines at the odd indexes: three tokens or more,
+# none longer than four characters (pypdf keeps some glyph runs such as 'ir' or 'œil' together), with either two
+# single characters one space apart or a word gap. Normal lines of short words, such as 'I am not a cat', have neither.
+LETTER_SPACED_LINE_PATTERN = re.compile(
+    r'^((?=[^\n]*(?:(?<!\S)\S \S(?!\S)|\S {2,}\S)) *(?:\S{1,4} +){2,}\S{1,4} *)$', re.MULTILINE)
+# A word split at the end of a line: a hyphen after a letter, continued in lower case on the next line. Compounds
+# split at the same place ('vingt-\nhuit') are joined too, which is the price of repairing the split words.
+HYPHENATED_LINE_BREAK_PATTERN = re.compile(r'(?<=[^\W\d_])-\n(?=[a-zà-ÿ])')
+LINE_EDGE_SPACE_PATTERN = re.compile(r' *\n *')
+BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+
+# Share of single-character tokens above which a line is treated as letter-spaced.
+LETTER_SPACED_TOKEN_RATIO = 0.5
+
+
+def is_letter_spaced(text):
+    """
+    Tells whether most tokens of a text are single characters, as in 'C H A P I T RE  I I'.
+    """
+    token_count = len(TOKEN_PATTERN.findall(text))
+    if token_count < 3:
+        return False
+    return len(SINGLE_CHARACTER_TOKEN_PATTERN.findall(text)) > token_count * LETTER_SPACED_TOKEN_RATIO
+
+
+def collapse_letter_spacing(line):
+    """
+    Joins letter-spaced text such as 'C H A P I T RE  I I' into 'CHAPITRE II': single spaces inside a
+    word are dropped and wider gaps become word breaks. Lines that are not letter-spaced are returned
+    with their whitespace normalized.
+
+    Word gaps are not always wider than letter gaps in the extracted text (e.g. after a narrow glyph),
+    so some words may stay fused; the text still gets roughly one token per word.
+    """
+    if is_letter_spaced(line):
+        return WORD_GAP_PATTERN.sub(' ', LETTER_GAP_PATTERN.sub('', line.strip()))
+    return ' '.join(line.split())
+
+
+def collapse_letter_spaced_lines(text):
+    """
+    Collapses the letter-spaced lines of a text (see LETTER_SPACED_LINE_PATTERN) and leaves the others as they
+    are. The letter-spaced lines are joined, collapsed in one batch and split back into place, so no Python
+    code runs per line. The text must not contain zero-width spaces.
+    """
+    pieces = LETTER_SPACED_LINE_PATTERN.split(text)
+    if len(pieces) == 1:
+        return text
+    # Word gaps are set aside under a zero-width space, which normalize_text has already removed from the text,
+    # so that every space left is a letter gap.
+    spaced_lines = WORD_GAP_PATTERN.sub('\u200b', '\n'.join(pieces[1::2]))
+    pieces[1::2] = spaced_lines.replace(' ', '').replace('\u200b', ' ').split('\n')
+    return ''.join(pieces)
+
+
+def normalize_text(text):
+    """
+    Cleans the text extracted from a page before it is cached and counted:
+    unicode spaces and invisible characters are normalized, letter-spaced lines are collapsed,
+    words hyphenated at a line break are joined, and space runs, spaces at line edges and runs of
+    blank lines are reduced.
+
+    Every step is a precompiled regular expression applied to the whole text. Letter spacing is
+    decided line by line, and only on pages containing a letter-spaced run, so normal lines of a
+    mostly letter-spaced page keep their spaces.
+
+    Args:
+        text (str): The raw text of a page.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = INVISIBLE_CHARACTER_PATTERN.sub('', UNICODE_SPACE_PATTERN.sub(' ', text.replace('\r\n', '\n')))
+    if LETTER_SPACED_RUN_PATTERN.search(text):
+        text = collapse_letter_spaced_lines(text)
+    text = WORD_GAP_PATTERN.sub(' ', text)
+    text = LINE_EDGE_SPACE_PATTERN.sub('\n', text).strip(' ')
+    text = HYPHENATED_LINE_BREAK_PATTERN.sub('', text)
+    return BLANK_LINES_PATTERN.sub('\n\n', text)